@@ -0,0 +1,144 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date
+
+from common.utils.pagination import is_keyset_request
+from common.utils.queryplan import query_plan
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin answering ``304 Not Modified`` to unchanged list/retrieve polls.
+
+    The validator is one aggregate over the filtered queryset: the latest
+    ``updated_at`` of the rows and of the related rows the serializer
+    renders (derived from its query plan, plus ``conditional_related``), and
+    row counts so that deletions change it too. The ETag also covers the
+    query string, the user and the Accept header, since those change the
+    representation.
+
+    ``Last-Modified`` is sent as well, but only ``If-None-Match`` is
+    honoured: a deleted row does not move ``max(updated_at)``.
+
+    Cursor (keyset) pages fetch the page first and aggregate over its rows
+    only, so their cost does not grow with the filtered set.
+
+    Writes must keep ``updated_at`` current, including ``update()`` and
+    ``bulk_update()`` paths, which skip ``auto_now``.
+    """
+
+    # Extra to-many relations whose rows affect the output (e.g. annotations)
+    conditional_related = ()
+
+    def list(self, request, *args, **kwargs):
+        if is_keyset_request(request, self):
+            return self.keyset_list(request)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        values = queryset.aggregate(**self.get_validator_aggregates())
+        not_modified = self.check_not_modified(request, values)
+        if not_modified is not None:
+            return not_modified
+        # The validator's row count doubles as the pagination count
+        self.paginator_count = values["_rows"]
+        response = super().list(request, *args, **kwargs)
+        return self.set_validator_headers(response, values)
+
+    def keyset_list(self, request):
+        """List a cursor page, validated by the rows on that page."""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        values = self.get_page_validator_values(queryset, page)
+        not_modified = self.check_not_modified(request, values)
+        if not_modified is not None:
+            return not_modified
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        return self.set_validator_headers(response, values)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        values = queryset.aggregate(**self.get_validator_aggregates())
+        if not values["_rows"]:
+            return super().retrieve(request, *args, **kwargs)
+        not_modified = self.check_not_modified(request, values)
+        if not_modified is not None:
+            return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validator_headers(response, values)
+
+    def get_validator_aggregates(self):
+        """Aggregate expressions for the validator, keyed by name."""
+        updated, many = _related_paths(query_plan(self.get_serializer_class()))
+        many |= set(self.conditional_related)
+
+        aggregates = {"_rows": Count("pk", distinct=True), "_updated": Max("updated_at")}
+        for path in sorted(updated | many):
+            aggregates[f"_updated__{path}"] = Max(f"{path}__updated_at")
+        for path in sorted(many):
+            aggregates[f"_rows__{path}"] = Count(path, distinct=True)
+        return aggregates
+
+    def get_page_validator_values(self, queryset, rows):
+        """
+        Validator values for a page that is already loaded.
+
+        Aggregates over the page's primary keys only; the keys themselves are
+        included so that rows moving on or off the page change the ETag.
+        """
+        keys = [row.pk for row in rows]
+        values = queryset.filter(pk__in=keys).aggregate(**self.get_validator_aggregates())
+        values["_page"] = ",".join(str(key) for key in keys)
+        return values
+
+    def check_not_modified(self, request, values):
+        """Return a 304 response if the client's ETag matches, else None."""
+        self._validator_etag = self.compute_etag(request, values)
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if not if_none_match:
+            return None
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or self._validator_etag.removeprefix("W/") in tags:
+            response = HttpResponseNotModified()
+            response["ETag"] = self._validator_etag
+            return response
+        return None
+
+    def compute_etag(self, request, values):
+        parts = [
+            request.get_full_path(),
+            str(getattr(request.user, "pk", "")),
+            request.META.get("HTTP_ACCEPT", ""),
+        ]
+        parts.extend(f"{name}={values[name]}" for name in sorted(values))
+        digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+        return f'W/"{digest}"'
+
+    def set_validator_headers(self, response, values):
+        if response.status_code != 200:
+            return response
+        response["ETag"] = self._validator_etag
+        timestamps = [
+            value for name, value in values.items() if name.startswith("_updated") and value
+        ]
+        if timestamps:
+            response["Last-Modified"] = http_date(max(timestamps).timestamp())
+        return response
+
+
+def _related_paths(plan, prefix=""):
+    """Relation paths in a query plan: (all paths, to-many paths)."""
+    paths = {prefix + path for path in plan.select_related}
+    many = set()
+    for path, _, child_plan, _ in plan.prefetch:
+        many.add(prefix + path)
+        if child_plan is not None:
+            child_paths, child_many = _related_paths(child_plan, f"{prefix}{path}__")
+            paths |= child_paths
+            many |= child_many
+    return paths, many
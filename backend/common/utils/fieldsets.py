@@ -0,0 +1,91 @@
+from rest_framework import serializers
+
+SAFE_METHODS = ("GET", "HEAD")
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin for ``?fields=`` and ``?expand=`` on read requests.
+
+    fields: Comma-separated field names to render. Dotted names select the
+        fields of a nested object (``ship_to.city``); naming a nested object
+        alone renders all of its fields.
+    expand: Comma-separated nested objects to render in full. When given,
+        nested objects that are not listed are rendered as their id.
+
+    Fields that are not rendered are dropped before the serializer binds
+    them, so unrequested nested serializers never run. Without either
+    parameter the output is unchanged. Write requests always use every
+    field.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+
+        params = request.query_params
+        if "fields" not in params and "expand" not in params:
+            return fields
+
+        path = self._fieldset_path()
+        requested = _split(params.get("fields"))
+        expand = _split(params.get("expand")) if "expand" in params else None
+
+        if requested is not None:
+            names = _names_under(requested, path)
+            if names is not None:
+                fields = {name: field for name, field in fields.items() if name in names}
+
+        if expand is not None:
+            for name, field in list(fields.items()):
+                if not isinstance(field, serializers.BaseSerializer):
+                    continue
+                nested = path + (name,)
+                # Asking for fields inside a nested object implies expanding it
+                if nested not in expand and not _inner_names(requested or set(), nested):
+                    fields[name] = _collapsed(field)
+
+        return fields
+
+    def _fieldset_path(self):
+        """Field names from the root serializer down to this one."""
+        path = []
+        node = self
+        while node.parent is not None:
+            if not isinstance(node.parent, serializers.ListSerializer):
+                path.append(node.field_name)
+            node = node.parent
+        return tuple(reversed(path))
+
+
+def _split(value):
+    if value is None:
+        return None
+    parts = (part.strip() for part in value.split(","))
+    return {tuple(part.split(".")) for part in parts if part}
+
+
+def _names_under(requested, path):
+    """Fields requested directly below ``path``, or None for all of them."""
+    if path and path in requested:
+        return None
+    names = _inner_names(requested, path)
+    if path and not names:
+        # The nested object was reached through expand only
+        return None
+    return names
+
+
+def _inner_names(requested, path):
+    """Fields requested strictly inside ``path``."""
+    depth = len(path)
+    return {p[depth] for p in requested if len(p) > depth and p[:depth] == path}
+
+
+def _collapsed(field):
+    """Primary key stand-in for a nested serializer that was not expanded."""
+    if isinstance(field, serializers.ListSerializer):
+        return serializers.PrimaryKeyRelatedField(many=True, read_only=True, source=field.source)
+    return serializers.PrimaryKeyRelatedField(read_only=True, source=field.source)
@@ -0,0 +1,21 @@
+from django.middleware.gzip import GZipMiddleware
+
+
+class CompressedResponseMiddleware(GZipMiddleware):
+    """
+    GZip for API responses.
+
+    Skips bodies shorter than ``min_length`` and content types that are
+    already compressed (label PDFs, ZIP archives, PNG previews), where gzip
+    only costs CPU.
+    """
+
+    min_length = 1024
+    compressed_types = ("application/pdf", "application/zip", "image/")
+
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").startswith(self.compressed_types):
+            return response
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,43 @@
+from functools import partial
+
+from django.db import transaction
+
+_PENDING_ATTR = "_collected_on_commit"
+
+
+def collect_on_commit(callback, items, using=None):
+    """
+    Call ``callback`` once per transaction with every item collected in it.
+
+    Model signals fire once per written row; collecting the affected keys
+    and handling them after the commit turns N writes into one follow-up
+    (one cache bump, one reindex, one query). Outside a transaction the
+    callback runs immediately, like ``transaction.on_commit``.
+
+    Each call schedules a flush; the first one to run after the commit
+    takes every collected item and the rest find nothing left. Items of a
+    rolled-back transaction or savepoint are not dropped but handed on with
+    the next flush, so callbacks must be idempotent and tolerate keys whose
+    rows no longer exist.
+
+    Args:
+        callback: Callable taking a set of items; module-level so that it
+            identifies the collection
+        items: Iterable of hashable items to add
+        using: Database alias of the transaction
+    """
+    connection = transaction.get_connection(using)
+    pending = connection.__dict__.setdefault(_PENDING_ATTR, {})
+    pending.setdefault(callback, set()).update(items)
+
+    flush = partial(_flush, pending, callback)
+    if connection.in_atomic_block:
+        transaction.on_commit(flush, using=using)
+    else:
+        flush()
+
+
+def _flush(pending, callback):
+    items = pending.pop(callback, None)
+    if items:
+        callback(items)
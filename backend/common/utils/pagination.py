@@ -1,17 +1,135 @@
+import base64
+import binascii
+from functools import partial
+
+from django.core.paginator import Paginator
+from django.utils.dateparse import parse_datetime
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
 
+class _KnownCountPaginator(Paginator):
+    """Django paginator that uses a row count computed elsewhere."""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+
+
+def is_keyset_request(request, view):
+    """True when ``view`` serves this request with KeysetPagination."""
+    return bool(getattr(view, "keyset_pagination", False)) and (
+        KeysetPagination.cursor_query_param in request.query_params
+    )
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Forward-only cursor pagination on ``(created_at, id)``, newest first.
+
+    Each page continues after the last row of the previous one instead of
+    using OFFSET, and no COUNT is run, so the page query costs the same
+    however deep it is. Views must not add whole-set aggregates (totals,
+    conditional GET validators) to cursor pages either. The cursor is opaque
+    to clients; an empty ``cursor`` asks for the first page. Requested
+    ``ordering`` is ignored.
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    page_size = 20
+    cursor_query_param = "cursor"
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            # (created_at, id) < (cursor) with a range on the leading index column
+            queryset = queryset.filter(created_at__lte=created_at).exclude(
+                created_at=created_at, id__gte=pk
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.has_previous = bool(cursor)
+        rows = rows[:page_size]
+        self.next_cursor = self.encode_cursor(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            return pagination._positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "has_next": self.has_next,
+                "has_previous": self.has_previous,
+                "next_cursor": self.next_cursor,
+                "results": data,
+            }
+        )
+
+    def encode_cursor(self, row):
+        position = f"{row.created_at.isoformat()}|{row.pk}"
+        return base64.urlsafe_b64encode(position.encode("ascii")).decode("ascii")
+
+    def decode_cursor(self, cursor):
+        try:
+            position = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii")
+            created_at, pk = position.split("|")
+            created_at = parse_datetime(created_at)
+        except (binascii.Error, UnicodeError, ValueError):
+            created_at = None
+        if created_at is None:
+            raise NotFound("Invalid cursor")
+        return created_at, pk
+
+
 class CustomPagination(pagination.PageNumberPagination):
     """
     Custom pagination with friendly fields (no next/previous links).
+
+    Views that set ``keyset_pagination = True`` switch to KeysetPagination
+    when the request carries a ``cursor`` parameter.
     """
 
     page_size_query_param = "page_size"
     max_page_size = 100
     page_size = 20
+    _keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None, count=None):
+        """
+        Args:
+            count: Total number of rows when the caller already has it (for
+                example from an aggregate it runs anyway), saving the COUNT
+                query; defaults to the view's ``paginator_count`` if set
+        """
+        if count is None:
+            count = getattr(view, "paginator_count", None)
+        if is_keyset_request(request, view):
+            self._keyset = KeysetPagination()
+            return self._keyset.paginate_queryset(queryset, request, view)
+
+        if count is not None:
+            self.django_paginator_class = partial(_KnownCountPaginator, count=count)
+        return super().paginate_queryset(queryset, request, view)
 
     def get_paginated_response(self, data):
+        if self._keyset is not None:
+            return self._keyset.get_paginated_response(data)
         return Response(
             {
                 "count": self.page.paginator.count,
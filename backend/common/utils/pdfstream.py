@@ -0,0 +1,208 @@
+import zlib
+
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfgen import canvas
+
+# Standard 14 fonts that carry their own built-in encoding
+_SYMBOLIC_FONTS = {"Symbol", "ZapfDingbats"}
+
+# Object numbers reserved for the document skeleton, written by save()
+_CATALOG, _PAGES, _RESOURCES = 1, 2, 3
+
+
+class StreamingCanvas(canvas.Canvas):
+    """
+    reportlab canvas that writes every finished page straight to a file.
+
+    A regular canvas keeps all pages in memory until ``save()`` and then
+    formats the whole document at once. This one writes each page's content
+    stream as soon as ``showPage()`` is called, so memory stays flat no
+    matter how many pages are drawn; only the byte offsets needed for the
+    cross-reference table are kept.
+
+    Output is deterministic: there is no creation date or document id, so
+    identical drawing produces identical bytes.
+
+    Supports what the label layouts draw: standard Type 1 fonts, vector
+    paths, colours and form XObjects (``begin_form`` / ``end_form`` /
+    ``draw_form``). Images and annotations are not supported.
+
+    Args:
+        fh: Writable binary file object
+        pagesize: (width, height) in points
+        compress: Flate-compress content streams
+        elide_state: Skip font, colour and line width changes that would not
+            change the current graphics state
+    """
+
+    def __init__(self, fh, pagesize, compress=True, elide_state=False):
+        super().__init__(fh, pagesize=pagesize, pageCompression=compress)
+        self._out = fh
+        self._compress = compress
+        self._elide_state = elide_state
+        self._position = 0
+        self._offsets = {}
+        self._page_numbers = []
+        self._forms = {}
+        self._form_stack = []
+        self._next_number = _RESOURCES + 1
+        # Content stream bytes as drawn (forms counted at every use) vs stored
+        self.content_bytes = 0
+        self.stored_bytes = 0
+        self._write(b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n")
+
+    @property
+    def bytes_written(self):
+        return self._position
+
+    @property
+    def bytes_saved(self):
+        """Content bytes saved by compression and form reuse so far."""
+        return self.content_bytes - self.stored_bytes
+
+    @property
+    def form_count(self):
+        return len(self._forms)
+
+    def setFont(self, psfontname, size, leading=None):
+        if (
+            self._eliding
+            and leading is None
+            and psfontname == self._fontname
+            and size == self._fontsize
+        ):
+            return
+        super().setFont(psfontname, size, leading)
+
+    def setFillColor(self, aColor, alpha=None):
+        if self._eliding and alpha is None and aColor is self._fillColorObj:
+            return
+        super().setFillColor(aColor, alpha)
+
+    def setStrokeColor(self, aColor, alpha=None):
+        if self._eliding and alpha is None and aColor is self._strokeColorObj:
+            return
+        super().setStrokeColor(aColor, alpha)
+
+    def setLineWidth(self, width):
+        if self._eliding and width == self._lineWidth:
+            return
+        super().setLineWidth(width)
+
+    @property
+    def _eliding(self):
+        # Forms inherit whatever state is current where they are painted, so
+        # their content always sets its own state
+        return self._elide_state and not self._form_stack
+
+    def has_form(self, key):
+        return key in self._forms
+
+    def begin_form(self, key):
+        """Start capturing drawing operations into a form XObject under ``key``."""
+        self.push_state_stack()
+        self._form_stack.append((key, self._code))
+        self._code = []
+
+    def end_form(self):
+        """Finish the current form and write it to the file."""
+        form_code = self._code
+        key, self._code = self._form_stack.pop()
+        # The form runs inside q/Q, so the page state is unchanged after it
+        self.pop_state_stack()
+
+        content = ("\n".join(form_code) + "\n").encode("latin-1")
+        data, filters = self._encode(content)
+        width, height = self._pagesize
+        number = self._add_object(
+            b"<< /Type /XObject /Subtype /Form /BBox [0 0 %s %s] /Resources %d 0 R "
+            b"/Length %d%s >>\nstream\n%s\nendstream"
+            % (_num(width), _num(height), _RESOURCES, len(data), filters, data)
+        )
+        self.stored_bytes += len(data)
+        self._forms[key] = (b"Fm%d" % (len(self._forms) + 1), number, len(content))
+
+    def draw_form(self, key):
+        """Paint a form defined with ``begin_form`` / ``end_form``."""
+        name, _, content_size = self._forms[key]
+        self._code.append("q /%s Do Q" % name.decode("ascii"))
+        self.content_bytes += content_size
+
+    def showPage(self):
+        code = self._psCommandsBeforePage + [self._preamble] + self._code
+        content = ("\n".join(code + self._psCommandsAfterPage) + "\n ").encode("latin-1")
+        data, filters = self._encode(content)
+        self.content_bytes += len(content)
+        self.stored_bytes += len(data)
+
+        stream_number = self._add_object(
+            b"<< /Length %d%s >>\nstream\n%s\nendstream" % (len(data), filters, data)
+        )
+        width, height = self._pagesize
+        page_number = self._add_object(
+            b"<< /Type /Page /Parent %d 0 R /Resources %d 0 R "
+            b"/MediaBox [0 0 %s %s] /Contents %d 0 R >>"
+            % (_PAGES, _RESOURCES, _num(width), _num(height), stream_number)
+        )
+        self._page_numbers.append(page_number)
+
+        if self._onPage:
+            self._onPage(self._pageNumber)
+        self._startPage()
+
+    def save(self):
+        if self._code:
+            self.showPage()
+
+        fonts = []
+        for font_name, internal_name in sorted(self._doc.fontMapping.items(), key=lambda f: f[1]):
+            encoding = b"" if font_name in _SYMBOLIC_FONTS else b" /Encoding /WinAnsiEncoding"
+            number = self._add_object(
+                b"<< /Type /Font /Subtype /Type1 /BaseFont /%s%s >>"
+                % (font_name.encode("ascii"), encoding)
+            )
+            fonts.append(b"%s %d 0 R" % (internal_name.encode("ascii"), number))
+
+        resources = b"/Font << %s >> /ProcSet [/PDF /Text]" % b" ".join(fonts)
+        if self._forms:
+            forms = b" ".join(b"/%s %d 0 R" % (name, number) for name, number, _ in self._forms.values())
+            resources += b" /XObject << %s >>" % forms
+        self._add_object(b"<< %s >>" % resources, _RESOURCES)
+
+        kids = b" ".join(b"%d 0 R" % number for number in self._page_numbers)
+        self._add_object(
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_numbers)),
+            _PAGES,
+        )
+        self._add_object(b"<< /Type /Catalog /Pages %d 0 R >>" % _PAGES, _CATALOG)
+
+        xref_position = self._position
+        size = self._next_number
+        xref = [b"xref\n0 %d\n0000000000 65535 f \n" % size]
+        xref.extend(b"%010d 00000 n \n" % self._offsets[n] for n in range(1, size))
+        self._write(b"".join(xref))
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (size, _CATALOG, xref_position)
+        )
+
+    def _encode(self, content):
+        if self._compress:
+            return zlib.compress(content), b" /Filter /FlateDecode"
+        return content, b""
+
+    def _add_object(self, body, number=None):
+        if number is None:
+            number = self._next_number
+            self._next_number += 1
+        self._offsets[number] = self._position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        return number
+
+    def _write(self, data):
+        self._out.write(data)
+        self._position += len(data)
+
+
+def _num(value):
+    return fp_str(value).encode("ascii")
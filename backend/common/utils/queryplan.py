@@ -0,0 +1,137 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+# select_related: paths of nested single objects
+# prefetch: (path, related model, plan for the nested serializer or None,
+#            field on the related model pointing back)
+# only: columns the serializer reads, or None when that cannot be known
+QueryPlan = namedtuple("QueryPlan", ["select_related", "prefetch", "only"])
+
+
+class SerializerQueryPlanMixin:
+    """
+    ViewSet mixin that loads related objects the way the serializer needs them.
+
+    Nested serializers on forward foreign keys become ``select_related``,
+    nested lists and many-to-many fields become ``prefetch_related`` (with
+    their own nested plan), and on read actions ``only()`` limits the
+    columns to those the serializer renders. The plan is derived from the
+    serializer class once and cached, so it follows the serializers as they
+    change.
+
+    Columns are not restricted when a serializer reads something that is not
+    a plain model field (``SerializerMethodField``, ``source="*"``, dotted
+    sources, annotations or properties).
+    """
+
+    # Actions whose response is the serializer output
+    query_plan_actions = ("list", "retrieve", "update", "partial_update")
+    # Actions that only read, where unused columns can be left out
+    query_plan_column_actions = ("list", "retrieve")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in self.query_plan_actions:
+            return queryset
+        return plan_queryset(
+            queryset,
+            self.get_serializer_class(),
+            columns=self.action in self.query_plan_column_actions,
+        )
+
+
+def plan_queryset(queryset, serializer_class, columns=True):
+    """
+    Apply the query plan of ``serializer_class`` to ``queryset``.
+
+    Args:
+        queryset: QuerySet of the serializer's model
+        serializer_class: ModelSerializer subclass
+        columns: Also restrict the loaded columns with ``only()``
+
+    Returns:
+        QuerySet
+    """
+    return _apply(queryset, query_plan(serializer_class), columns)
+
+
+@lru_cache(maxsize=None)
+def query_plan(serializer_class):
+    """Build (and cache) the QueryPlan for a ModelSerializer class."""
+    select_related = []
+    prefetch = []
+    only = set()
+    known = _collect(serializer_class(), serializer_class.Meta.model, "", select_related, prefetch, only)
+    return QueryPlan(tuple(select_related), tuple(prefetch), tuple(sorted(only)) if known else None)
+
+
+def _collect(serializer, model, prefix, select_related, prefetch, only):
+    """Walk the serializer fields; returns False if the columns read are unknown."""
+    known = True
+    only.add(prefix + model._meta.pk.name)
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        source = field.source
+        if source == "*" or "." in source:
+            known = False
+            continue
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            # Annotation, property or method
+            known = False
+            continue
+
+        path = prefix + source
+        if model_field.one_to_many or model_field.many_to_many:
+            prefetch.append(_prefetch_entry(field, model_field, path))
+        elif model_field.is_relation:
+            if isinstance(field, serializers.BaseSerializer):
+                select_related.append(path)
+                known &= _collect(
+                    field, model_field.related_model, path + "__", select_related, prefetch, only
+                )
+            elif not model_field.concrete:
+                known = False
+                continue
+            if model_field.concrete:
+                only.add(path)
+        else:
+            only.add(path)
+
+    return known
+
+
+def _prefetch_entry(field, model_field, path):
+    related_model = model_field.related_model
+    if not isinstance(field, serializers.ListSerializer):
+        return (path, related_model, None, None)
+
+    # Reverse foreign keys need the key back to the parent to attach results
+    back = model_field.field.name if model_field.one_to_many else None
+    return (path, related_model, query_plan(type(field.child)), back)
+
+
+def _apply(queryset, plan, columns, extra_columns=()):
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+
+    for path, related_model, child_plan, back in plan.prefetch:
+        if child_plan is None:
+            queryset = queryset.prefetch_related(path)
+            continue
+        child_columns = columns and back is not None
+        child_queryset = _apply(
+            related_model._default_manager.all(), child_plan, child_columns, (back,)
+        )
+        queryset = queryset.prefetch_related(Prefetch(path, queryset=child_queryset))
+
+    if columns and plan.only is not None:
+        queryset = queryset.only(*plan.only, *extra_columns)
+    return queryset
@@ -0,0 +1,64 @@
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def single_flight(key, compute, wait_timeout=30, lock_timeout=300, result_timeout=10, poll_interval=0.1):
+    """
+    Run ``compute`` once for concurrent callers that share ``key``.
+
+    The first caller takes a lock in the Django cache (``cache.add`` is
+    atomic on the shared backends) and publishes its result there. Callers
+    that arrive while it runs poll for that result instead of computing it
+    again. The result is kept for ``result_timeout`` seconds so that retries
+    arriving just after the first call also get it.
+
+    A caller computes the value itself if the lock is released without a
+    result (the first caller failed) or after waiting ``wait_timeout``
+    seconds. Callers in different worker processes are coalesced through
+    the shared cache configured in ``settings.CACHES``. ``key`` must change
+    whenever the inputs of ``compute`` do, or a stale result is shared.
+
+    Args:
+        key: Cache key identifying the work
+        compute: Callable producing a small picklable result; for large
+            output, write it to storage and return the file name
+        wait_timeout: Seconds to wait for another caller's result
+        lock_timeout: Seconds before an abandoned lock expires
+        result_timeout: Seconds the result stays shared after it is computed
+        poll_interval: Seconds between result checks while waiting
+
+    Returns:
+        The computed value
+    """
+    result_key = f"singleflight:{key}:result"
+    lock_key = f"singleflight:{key}:lock"
+    deadline = time.monotonic() + wait_timeout
+    waited = False
+
+    while True:
+        value = cache.get(result_key, _MISSING)
+        if value is not _MISSING:
+            if waited:
+                logger.debug("Shared in-flight result | key=%s", key)
+            return value
+
+        if cache.add(lock_key, True, lock_timeout):
+            try:
+                value = compute()
+                cache.set(result_key, value, result_timeout)
+                return value
+            finally:
+                cache.delete(lock_key)
+
+        if time.monotonic() >= deadline:
+            logger.warning("Timed out waiting for in-flight result | key=%s", key)
+            return compute()
+
+        waited = True
+        time.sleep(poll_interval)
@@ -0,0 +1,44 @@
+import io
+import zipfile
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Write-only, unseekable sink that hands back whatever was written since
+    the last drain. ``zipfile`` falls back to data descriptors for such
+    streams, so entries never need to be rewritten in place.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Build a ZIP archive incrementally from ``(name, bytes)`` pairs.
+
+    Yields the archive bytes as each entry is written, so only one entry is
+    held in memory at a time. Suitable for ``StreamingHttpResponse``.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, mode="w", compression=compression) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+    yield sink.drain()
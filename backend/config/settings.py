@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "common.utils.middleware.CompressedResponseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -91,6 +92,21 @@ DATABASES = {
     }
 }
 
+# The cache must be shared by every worker process: it holds the in-flight
+# render locks and results (common.utils.singleflight) and the batch response
+# cache with its invalidation generations (core.response_cache). The database
+# cache needs no extra service (its table is created by core migration 0016);
+# point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached to scale. With a
+# process-local backend (locmem) the batch response cache is off and
+# identical renders are coalesced within one process only.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "django_cache"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "10000"))},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -134,6 +150,25 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 MEDIA_URL = "/media/"  # URL prefix for media files
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Label rendering
+# Worker processes used for raster (PNG) labels; 0 or 1 renders in-process
+LABEL_RENDER_WORKERS = int(os.getenv("LABEL_RENDER_WORKERS", "2"))
+# Background threads that pre-render labels after purchase
+LABEL_RENDER_THREADS = int(os.getenv("LABEL_RENDER_THREADS", "2"))
+# Render inline instead of on the background pool (tests, debugging)
+LABEL_RENDER_ASYNC = os.getenv("LABEL_RENDER_ASYNC", "True") == "True"
+# Seconds a download waits for a render already in progress before answering
+# 202, and for a concurrent identical on-demand render to finish
+LABEL_RENDER_WAIT_SECONDS = int(os.getenv("LABEL_RENDER_WAIT_SECONDS", "10"))
+# A render claimed longer ago than this is presumed dead (crashed or restarted
+# worker) and may be claimed again
+LABEL_RENDER_STALE_SECONDS = int(os.getenv("LABEL_RENDER_STALE_SECONDS", "600"))
+# Cached batch list/detail responses; writes invalidate them immediately.
+# Needs a shared CACHES backend (off with locmem); 0 turns it off
+BATCH_RESPONSE_CACHE_SECONDS = int(os.getenv("BATCH_RESPONSE_CACHE_SECONDS", "300"))
+# PDF output profile, see core.services.PDF_PROFILES ("standard" or "compact")
+LABEL_PDF_PROFILE = os.getenv("LABEL_PDF_PROFILE", "compact")
+
 #  Rest Framework
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
@@ -156,6 +191,11 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_PAGINATION_CLASS": "common.utils.pagination.CustomPagination",
     "PAGE_SIZE": 20,
+    # Uses orjson when installed, the standard library otherwise
+    "DEFAULT_RENDERER_CLASSES": [
+        "common.utils.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 SIMPLE_JWT = {
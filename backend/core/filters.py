@@ -1,6 +1,19 @@
 from django_filters import rest_framework as filters
 from .models import Batch, Shipment
+from django.db import connection
 from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Trigram full-text index over order number and recipient address, kept up
+# to date by core.search (see migration 0012). Only on SQLite; PostgreSQL
+# serves the icontains filter from trigram GIN indexes instead.
+SHIPMENT_SEARCH_SQL = (
+    "SELECT k.shipment_id FROM core_shipment_search s "
+    "JOIN core_shipment_search_key k ON k.rowid = s.rowid "
+    "WHERE core_shipment_search MATCH %s"
+)
+# The trigram index cannot match shorter terms
+SHIPMENT_SEARCH_MIN_LENGTH = 3
 
 
 class BatchFilter(filters.FilterSet):
@@ -35,8 +48,13 @@ class ShipmentFilter(filters.FilterSet):
         ]
 
     def filter_search(self, queryset, name, value):
+        value = value.strip() if value else value
+        if value and connection.vendor == "sqlite" and len(value) >= SHIPMENT_SEARCH_MIN_LENGTH:
+            # Quoted phrase: a substring match in any indexed column
+            phrase = '"%s"' % value.replace('"', '""')
+            return queryset.filter(id__in=RawSQL(SHIPMENT_SEARCH_SQL, [phrase]))
+
         if value:
-            value = value.strip()
             queryset = queryset.filter(
                 Q(order_no__icontains=value)
                 | Q(ship_to__name__icontains=value)
@@ -0,0 +1,378 @@
+"""
+Declarative label layouts.
+
+Each label design is described as data: a list of elements (boxes, rules,
+text, address blocks, barcode) positioned in inches from the bottom-left
+corner of the label. A layout is compiled once into flat draw operations in
+absolute points, and the renderers (PDF in ``services``, PNG in ``raster``)
+just apply shipment values to those operations.
+
+Printable stocks are ``SHEETS``: a page size and a grid of cells, each drawn
+with one of the layouts. ``impose`` computes the cell positions once per
+stock.
+
+Adding a label design means adding an entry to ``LAYOUTS``; adding a roll or
+adhesive sheet means adding an entry to ``SHEETS``.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+from reportlab.lib.colors import HexColor, black
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+
+# Professional color scheme
+BORDER_COLOR = HexColor("#2c3e50")
+HEADER_BG = HexColor("#ecf0f1")
+ACCENT_COLOR = HexColor("#3498db")
+SEPARATOR_COLOR = HexColor("#dfe6e9")
+TEXT_PRIMARY = black
+TEXT_SECONDARY = HexColor("#7f8c8d")
+
+DEFAULT_LAYOUT = "4x6"
+
+# ``when`` / ``unless`` name a LabelData field (ship_from, ship_to, package)
+# that must be set / unset for the element to be drawn.
+Box = namedtuple(
+    "Box",
+    ["x", "y", "width", "height", "line_width", "stroke", "fill", "when", "unless"],
+    defaults=(1, BORDER_COLOR, None, None, None),
+)
+Rule = namedtuple(
+    "Rule",
+    ["x1", "x2", "y", "line_width", "color", "when", "unless"],
+    defaults=(1, SEPARATOR_COLOR, None, None),
+)
+# Either ``text`` (fixed) or ``slot`` (a per-shipment value, see
+# ``services.LABEL_TEXT_SLOTS``). ``align`` is "left", "right" or "center".
+Text = namedtuple(
+    "Text",
+    ["x", "y", "font", "size", "text", "slot", "color", "align", "when", "unless"],
+    defaults=(None, None, TEXT_PRIMARY, "left", None, None),
+)
+# Lines from ``services.address_lines``; the block is skipped when the
+# address is missing, so pair it with a Text(..., unless=field) placeholder.
+Address = namedtuple(
+    "Address",
+    ["x", "y", "field", "size", "leading", "is_from"],
+    defaults=(False,),
+)
+# Code128 of the tracking number; bars start after the quiet zone like the
+# reportlab widget, and an outlined box with the number replaces unencodable
+# values.
+Barcode = namedtuple(
+    "Barcode",
+    ["x", "y", "width", "height", "bar_width"],
+    defaults=(1.2,),
+)
+
+# A single label design; width / height in inches
+Layout = namedtuple("Layout", ["width", "height", "elements"])
+
+# A printable stock: a page holding a grid of ``columns`` x ``rows`` cells
+# of ``cell_width`` x ``cell_height`` inches, ``left`` / ``top`` inches from
+# the page edges and ``gutter_x`` / ``gutter_y`` apart. Each cell is drawn
+# with ``layout``, shrunk to fit and centred when the cell is smaller.
+Sheet = namedtuple(
+    "Sheet",
+    [
+        "layout",
+        "page_width",
+        "page_height",
+        "columns",
+        "rows",
+        "cell_width",
+        "cell_height",
+        "left",
+        "top",
+        "gutter_x",
+        "gutter_y",
+    ],
+    defaults=(1, 1, None, None, 0, 0, 0, 0),
+)
+
+# Where one label lands on the page: bottom-left corner in points and the
+# factor the layout is scaled by
+Cell = namedtuple("Cell", ["x", "y", "scale"])
+
+Op = namedtuple("Op", ["kind", "when", "unless", "args"])
+
+
+LAYOUTS = {
+    "4x6": Layout(
+        width=4,
+        height=6,
+        elements=(
+            Box(0.15, 0.15, 3.7, 5.7, line_width=1.5),
+            # Header - service & price
+            Box(0.3, 5.2, 3.4, 0.5, stroke=None, fill=HEADER_BG),
+            Text(0.4, 5.43, "Helvetica-Bold", 12, slot="service", color=ACCENT_COLOR),
+            Text(3.6, 5.43, "Helvetica-Bold", 14, slot="price", color=ACCENT_COLOR, align="right"),
+            # Sender
+            Text(0.4, 4.8, "Helvetica-Bold", 8, "SHIP FROM:", color=TEXT_SECONDARY),
+            Address(0.4, 4.6, "ship_from", 8, 0.15, is_from=True),
+            Text(
+                0.4, 4.6, "Helvetica-Oblique", 8, "No sender address provided",
+                color=TEXT_SECONDARY, unless="ship_from",
+            ),
+            Rule(0.4, 3.6, 3.85),
+            # Recipient
+            Text(0.4, 3.6, "Helvetica-Bold", 11, "DELIVER TO:"),
+            Address(0.4, 3.35, "ship_to", 11, 0.2),
+            Text(
+                0.4, 3.35, "Helvetica-Oblique", 11, "No recipient address provided",
+                color=TEXT_SECONDARY, unless="ship_to",
+            ),
+            # Package details
+            Rule(0.4, 3.6, 2.4),
+            Text(0.4, 2.15, "Helvetica-Bold", 9, "Weight:", when="package"),
+            Text(1.4, 2.15, "Helvetica", 9, slot="weight", when="package"),
+            Text(0.4, 1.9, "Helvetica-Bold", 9, "Dimensions:", when="package"),
+            Text(1.4, 1.9, "Helvetica", 9, slot="dimensions", when="package"),
+            Text(
+                0.4, 2.0, "Helvetica-Oblique", 8, "Package details not provided",
+                color=TEXT_SECONDARY, unless="package",
+            ),
+            # Footer - order & barcode
+            Text(2.0, 1.2, "Helvetica-Bold", 10, slot="order", align="center"),
+            Barcode(0.6, 0.35, 2.8, 0.6),
+        ),
+    ),
+    "4x4": Layout(
+        width=4,
+        height=4,
+        elements=(
+            Box(0.1, 0.1, 3.8, 3.8, line_width=1.5),
+            Box(0.2, 3.4, 3.6, 0.4, stroke=None, fill=HEADER_BG),
+            Text(0.3, 3.55, "Helvetica-Bold", 11, slot="service", color=ACCENT_COLOR),
+            Text(3.7, 3.55, "Helvetica-Bold", 12, slot="price", color=ACCENT_COLOR, align="right"),
+            Text(0.3, 3.2, "Helvetica-Bold", 7, "SHIP FROM:", color=TEXT_SECONDARY),
+            Address(0.3, 3.05, "ship_from", 7, 0.12, is_from=True),
+            Text(
+                0.3, 3.05, "Helvetica-Oblique", 7, "No sender address provided",
+                color=TEXT_SECONDARY, unless="ship_from",
+            ),
+            Rule(0.3, 3.7, 2.55),
+            Text(0.3, 2.35, "Helvetica-Bold", 9, "DELIVER TO:"),
+            Address(0.3, 2.15, "ship_to", 10, 0.17),
+            Text(
+                0.3, 2.15, "Helvetica-Oblique", 10, "No recipient address provided",
+                color=TEXT_SECONDARY, unless="ship_to",
+            ),
+            Rule(0.3, 3.7, 1.33),
+            Text(0.3, 1.13, "Helvetica", 8, slot="package_summary", when="package"),
+            Text(
+                0.3, 1.13, "Helvetica-Oblique", 8, "Package details not provided",
+                color=TEXT_SECONDARY, unless="package",
+            ),
+            Text(2.0, 0.92, "Helvetica-Bold", 9, slot="order", align="center"),
+            Barcode(0.55, 0.25, 2.9, 0.55, bar_width=1.1),
+        ),
+    ),
+    "4x8": Layout(
+        width=4,
+        height=8,
+        elements=(
+            Box(0.15, 0.15, 3.7, 7.7, line_width=1.5),
+            Box(0.3, 7.2, 3.4, 0.5, stroke=None, fill=HEADER_BG),
+            Text(0.4, 7.43, "Helvetica-Bold", 13, slot="service", color=ACCENT_COLOR),
+            Text(3.6, 7.43, "Helvetica-Bold", 15, slot="price", color=ACCENT_COLOR, align="right"),
+            Text(0.4, 6.8, "Helvetica-Bold", 9, "SHIP FROM:", color=TEXT_SECONDARY),
+            Address(0.4, 6.58, "ship_from", 9, 0.17, is_from=True),
+            Text(
+                0.4, 6.58, "Helvetica-Oblique", 9, "No sender address provided",
+                color=TEXT_SECONDARY, unless="ship_from",
+            ),
+            Rule(0.4, 3.6, 5.75),
+            Text(0.4, 5.45, "Helvetica-Bold", 13, "DELIVER TO:"),
+            Address(0.4, 5.13, "ship_to", 14, 0.26),
+            Text(
+                0.4, 5.13, "Helvetica-Oblique", 13, "No recipient address provided",
+                color=TEXT_SECONDARY, unless="ship_to",
+            ),
+            Rule(0.4, 3.6, 3.6),
+            Text(0.4, 3.3, "Helvetica-Bold", 10, "Weight:", when="package"),
+            Text(1.55, 3.3, "Helvetica", 10, slot="weight", when="package"),
+            Text(0.4, 3.03, "Helvetica-Bold", 10, "Dimensions:", when="package"),
+            Text(1.55, 3.03, "Helvetica", 10, slot="dimensions", when="package"),
+            Text(
+                0.4, 3.15, "Helvetica-Oblique", 9, "Package details not provided",
+                color=TEXT_SECONDARY, unless="package",
+            ),
+            Text(2.0, 2.2, "Helvetica-Bold", 12, slot="order", align="center"),
+            Barcode(0.4, 0.5, 3.2, 1.1, bar_width=1.4),
+        ),
+    ),
+    # Half a Letter sheet
+    "half-letter": Layout(
+        width=8.5,
+        height=5.5,
+        elements=(
+            Box(0.5, 0.25, 7.5, 5.0, line_width=2),
+            Box(0.6, 4.25, 7.3, 0.7, stroke=None, fill=HEADER_BG),
+            Text(0.8, 4.5, "Helvetica-Bold", 16, slot="service", color=ACCENT_COLOR),
+            Text(7.7, 4.5, "Helvetica-Bold", 18, slot="price", color=ACCENT_COLOR, align="right"),
+            # Two columns: sender (left) | recipient (right)
+            Text(0.65, 3.65, "Helvetica-Bold", 11, "FROM:"),
+            Rule(1.15, 4.1, 3.7, line_width=0.5, color=TEXT_SECONDARY),
+            Address(0.65, 3.35, "ship_from", 8, 0.15, is_from=True),
+            Text(
+                0.65, 3.35, "Helvetica-Oblique", 10, "No sender address",
+                color=TEXT_SECONDARY, unless="ship_from",
+            ),
+            Text(4.4, 3.65, "Helvetica-Bold", 13, "SHIP TO:"),
+            Rule(5.1, 7.85, 3.73, color=ACCENT_COLOR),
+            Address(4.4, 3.3, "ship_to", 11, 0.2),
+            Text(
+                4.4, 3.3, "Helvetica-Oblique", 11, "No recipient address",
+                color=TEXT_SECONDARY, unless="ship_to",
+            ),
+            # Package details (left) | order & barcode (right)
+            Rule(0.6, 7.9, 2.2, line_width=0.5, color=TEXT_SECONDARY),
+            Text(0.65, 1.95, "Helvetica-Bold", 10, "PACKAGE DETAILS:", when="package"),
+            Text(0.65, 1.7, "Helvetica", 10, slot="weight_detail", when="package"),
+            Text(0.65, 1.45, "Helvetica", 10, slot="dimensions_detail", when="package"),
+            Text(
+                0.65, 1.8, "Helvetica-Oblique", 9, "Package details not provided",
+                color=TEXT_SECONDARY, unless="package",
+            ),
+            Text(4.4, 1.95, "Helvetica-Bold", 11, slot="order"),
+            Barcode(4.6, 1.35, 2.5, 0.5),
+        ),
+    ),
+}
+
+LETTER_WIDTH, LETTER_HEIGHT = letter[0] / inch, letter[1] / inch
+
+# Stocks selectable as a batch label_format
+SHEETS = {
+    # Thermal rolls: one label per page, page size is the label size
+    "4x6": Sheet("4x6", 4, 6),
+    "4x4": Sheet("4x4", 4, 4),
+    "4x8": Sheet("4x8", 4, 8),
+    # Letter adhesive sheets
+    "letter-1up": Sheet(
+        "4x6", LETTER_WIDTH, LETTER_HEIGHT, cell_width=4, cell_height=6, left=2.25, top=0.5
+    ),
+    "letter": Sheet("half-letter", LETTER_WIDTH, LETTER_HEIGHT, rows=2),
+    "letter-4up": Sheet(
+        "4x4", LETTER_WIDTH, LETTER_HEIGHT, columns=2, rows=2,
+        cell_width=4, cell_height=5, left=0.25, top=0.5,
+    ),
+    "letter-6up": Sheet(
+        "4x4", LETTER_WIDTH, LETTER_HEIGHT, columns=2, rows=3,
+        cell_width=4, cell_height=10 / 3, left=0.156, top=0.5, gutter_x=0.188,
+    ),
+}
+
+# Batch label_format values accepted as aliases
+SHEET_ALIASES = {"a4": "letter", "letter/a4": "letter", "letter-2up": "letter"}
+
+
+def sheet_name(label_format):
+    """Stock used for a batch label format (4x6 for anything unknown)."""
+    name = (label_format or DEFAULT_LAYOUT).lower()
+    name = SHEET_ALIASES.get(name, name)
+    return name if name in SHEETS else DEFAULT_LAYOUT
+
+
+def layout_name(label_format):
+    """Label design drawn in each cell for a batch label format."""
+    return SHEETS[sheet_name(label_format)].layout
+
+
+@lru_cache(maxsize=None)
+def impose(name):
+    """
+    Compute where each label of a sheet goes, in print order (rows top to
+    bottom, left to right).
+
+    Returns:
+        tuple of Cell, one per label position on the page
+    """
+    sheet = SHEETS[name]
+    layout = LAYOUTS[sheet.layout]
+    cell_width = sheet.cell_width or sheet.page_width / sheet.columns
+    cell_height = sheet.cell_height or sheet.page_height / sheet.rows
+    scale = min(1, cell_width / layout.width, cell_height / layout.height)
+
+    cells = []
+    for row in range(sheet.rows):
+        for column in range(sheet.columns):
+            x = sheet.left + column * (cell_width + sheet.gutter_x)
+            y = sheet.page_height - sheet.top - (row + 1) * cell_height - row * sheet.gutter_y
+            # Centre the (possibly shrunk) label inside its cell
+            x += (cell_width - layout.width * scale) / 2
+            y += (cell_height - layout.height * scale) / 2
+            cells.append(Cell(x * inch, y * inch, scale))
+    return tuple(cells)
+
+
+@lru_cache(maxsize=None)
+def compile_layout(name, origin=(0, 0)):
+    """
+    Compile a layout into draw operations in absolute page points.
+
+    Args:
+        name: Key of LAYOUTS
+        origin: Bottom-left corner of the label on the page, in points
+
+    Returns:
+        tuple of Op
+    """
+    ox, oy = origin
+    return tuple(_compile_element(element, ox, oy) for element in LAYOUTS[name].elements)
+
+
+def page_size(name):
+    """Page size in points for a sheet."""
+    sheet = SHEETS[name]
+    return sheet.page_width * inch, sheet.page_height * inch
+
+
+def label_size(name):
+    """Size of a single label in points for a layout."""
+    layout = LAYOUTS[name]
+    return layout.width * inch, layout.height * inch
+
+
+def _compile_element(element, ox, oy):
+    def px(value):
+        return ox + value * inch
+
+    def py(value):
+        return oy + value * inch
+
+    if isinstance(element, Box):
+        args = (
+            px(element.x), py(element.y), element.width * inch, element.height * inch,
+            element.line_width, element.stroke, element.fill,
+        )
+        return Op("box", element.when, element.unless, args)
+
+    if isinstance(element, Rule):
+        args = (px(element.x1), px(element.x2), py(element.y), element.line_width, element.color)
+        return Op("rule", element.when, element.unless, args)
+
+    if isinstance(element, Text):
+        args = (
+            px(element.x), py(element.y), element.font, element.size,
+            element.text, element.slot, element.color, element.align,
+        )
+        return Op("text", element.when, element.unless, args)
+
+    if isinstance(element, Address):
+        args = (
+            px(element.x), py(element.y), element.field, element.size,
+            element.leading * inch, element.is_from,
+        )
+        return Op("address", element.field, None, args)
+
+    if isinstance(element, Barcode):
+        args = (
+            px(element.x), py(element.y), element.width * inch, element.height * inch,
+            element.bar_width,
+        )
+        return Op("barcode", None, None, args)
+
+    raise TypeError(f"Unknown layout element {element!r}")
@@ -0,0 +1,301 @@
+import gc
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import services
+from core.models import Address, Package, Shipment
+
+
+DEFAULT_SIZES = [1, 100, 1000, 10000]
+DEFAULT_FORMATS = ["4x6", "letter"]
+DEFAULT_VARIANT = "default=core.services.generate_shipping_labels_pdf"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark label rendering on in-memory shipments (no database access). "
+        "Records wall time, per-label latency percentiles, peak memory and output "
+        "size per format and batch size, and can compare renderer variants."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=DEFAULT_SIZES,
+            help="Batch sizes to render (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--formats",
+            nargs="+",
+            default=DEFAULT_FORMATS,
+            help="Label formats to render (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--variant",
+            action="append",
+            dest="variants",
+            metavar="NAME=DOTTED.PATH",
+            help=(
+                "Renderer to benchmark, called as fn(shipments, label_format=...) and "
+                "returning a buffer. Repeat to compare variants. "
+                f"Default: {DEFAULT_VARIANT}"
+            ),
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="Timed runs per case; the median wall time is reported",
+        )
+        parser.add_argument(
+            "--skip-memory",
+            action="store_true",
+            help="Skip the extra tracemalloc pass per case",
+        )
+        parser.add_argument(
+            "--output",
+            default="label-benchmark.json",
+            help="Where to write the JSON results (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Previous results JSON to compare wall times against",
+        )
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=0.10,
+            help="Allowed slowdown vs. baseline before failing (default: 0.10 = 10%%)",
+        )
+
+    def handle(self, *args, **options):
+        variants = self._load_variants(options["variants"] or [DEFAULT_VARIANT])
+        results = []
+
+        for variant_name, renderer in variants.items():
+            for label_format in options["formats"]:
+                for size in options["sizes"]:
+                    result = self._run_case(
+                        renderer,
+                        label_format,
+                        size,
+                        repeat=max(1, options["repeat"]),
+                        measure_memory=not options["skip_memory"],
+                    )
+                    result["variant"] = variant_name
+                    results.append(result)
+                    self._print_result(result)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+
+        with open(options["output"], "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options["baseline"]:
+            self._check_baseline(results, options["baseline"], options["max_regression"])
+
+    def _load_variants(self, specs):
+        variants = {}
+        for spec in specs:
+            name, sep, path = spec.partition("=")
+            if not sep:
+                name, path = spec.rsplit(".", 1)[-1], spec
+            try:
+                variants[name] = import_string(path)
+            except ImportError as exc:
+                raise CommandError(f"Cannot import renderer '{path}': {exc}")
+        return variants
+
+    def _run_case(self, renderer, label_format, size, repeat, measure_memory):
+        shipments = build_shipments(size)
+        walls = []
+        latencies = []
+        output_bytes = 0
+
+        for _ in range(repeat):
+            timed = _TimedIterable(shipments)
+            _reset_caches()
+            gc.collect()
+            started = time.perf_counter()
+            buffer = renderer(timed, label_format=label_format)
+            walls.append(time.perf_counter() - started)
+            latencies = timed.latencies
+            output_bytes = len(buffer.getvalue())
+
+        result = {
+            "format": label_format,
+            "size": size,
+            "wall_seconds": statistics.median(walls),
+            "labels_per_second": size / statistics.median(walls),
+            "latency_ms": _percentiles(latencies),
+            "output_bytes": output_bytes,
+            "bytes_per_label": output_bytes / size,
+            # Peak of the tracemalloc pass below; ru_maxrss is a process-lifetime
+            # peak and would repeat the largest earlier case
+            "peak_traced_bytes": None,
+        }
+
+        if measure_memory:
+            _reset_caches()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                renderer(shipments, label_format=label_format)
+                result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        return result
+
+    def _print_result(self, result):
+        self.stdout.write(
+            "{variant:>12} {format:>7} {size:>6} labels | {wall:8.3f}s | "
+            "p50 {p50:6.2f}ms p95 {p95:6.2f}ms p99 {p99:6.2f}ms | {kb:9.1f} KB".format(
+                variant=result.get("variant", ""),
+                format=result["format"],
+                size=result["size"],
+                wall=result["wall_seconds"],
+                kb=result["output_bytes"] / 1024,
+                **result["latency_ms"],
+            )
+        )
+
+    def _check_baseline(self, results, baseline_path, max_regression):
+        try:
+            with open(baseline_path, encoding="utf-8") as fh:
+                baseline = json.load(fh)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read baseline '{baseline_path}': {exc}")
+
+        previous = {
+            (r.get("variant"), r["format"], r["size"]): r for r in baseline.get("results", [])
+        }
+        regressions = []
+
+        for result in results:
+            key = (result["variant"], result["format"], result["size"])
+            if key not in previous:
+                continue
+            before = previous[key]["wall_seconds"]
+            change = (result["wall_seconds"] - before) / before if before else 0
+            if change > max_regression:
+                regressions.append(
+                    f"{key[0]} {key[1]} x{key[2]}: {before:.3f}s -> "
+                    f"{result['wall_seconds']:.3f}s (+{change:.0%})"
+                )
+
+        if regressions:
+            raise CommandError(
+                "Label rendering regressed against baseline:\n" + "\n".join(regressions)
+            )
+
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+
+
+class _TimedIterable:
+    """
+    Wraps the shipments handed to a renderer and records the time between
+    successive items, i.e. how long the renderer spent on each label.
+    """
+
+    def __init__(self, items):
+        self._items = items
+        self.latencies = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        last = None
+        for item in self._items:
+            now = time.perf_counter()
+            if last is not None:
+                self.latencies.append(now - last)
+            last = now
+            yield item
+        if last is not None:
+            self.latencies.append(time.perf_counter() - last)
+
+
+def build_shipments(count):
+    """Unsaved shipments with realistic, varied addresses and packages."""
+    sender = Address(
+        name="Print TTS",
+        first_name="Print",
+        last_name="TTS",
+        address_line1="502 W Arrow Hwy, STE P",
+        city="San Dimas",
+        state="CA",
+        zip_code="91773",
+    )
+    shipments = []
+    for i in range(count):
+        recipient = Address(
+            name=f"Customer {i}",
+            first_name="Customer",
+            last_name=f"{i:05d}",
+            address_line1=f"{100 + i % 900} Market Street",
+            address_line2="Apt 4B" if i % 3 == 0 else "",
+            city="San Francisco",
+            state="CA",
+            zip_code=f"{94100 + i % 100}",
+            phone="415-555-0100" if i % 2 == 0 else "",
+        )
+        package = Package(
+            name="Medium Box",
+            length_inches=Decimal("12.00"),
+            width_inches=Decimal("10.00"),
+            height_inches=Decimal("8.00"),
+            weight_lbs=1 + i % 10,
+            weight_oz=i % 16,
+        )
+        service = "priority" if i % 2 else "ground"
+        shipments.append(
+            Shipment(
+                order_no=f"BENCH-{i:06d}",
+                ship_from=sender,
+                ship_to=recipient,
+                package=package,
+                shipping_service=service,
+                price=Decimal("7.45"),
+                tracking_number=Shipment.format_tracking_number(service, i + 1),
+            )
+        )
+    return shipments
+
+
+def _reset_caches():
+    # Every shipment has its own tracking number, so a real first render
+    # never hits the barcode caches - measure it cold
+    services.code128_runs.cache_clear()
+    services._code128_path.cache_clear()
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1] * 1000}
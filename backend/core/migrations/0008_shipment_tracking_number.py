@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-19 10:11
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_alter_address_options_alter_batch_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackingSequence',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('name', models.CharField(default='default', max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'Tracking Sequence',
+                'verbose_name_plural': 'Tracking Sequences',
+            },
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='tracking_number',
+            field=models.CharField(blank=True, editable=False, max_length=20, null=True, unique=True),
+        ),
+    ]
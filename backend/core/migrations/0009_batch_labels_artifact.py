@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_shipment_tracking_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='labels_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='labels_file',
+            field=models.FileField(blank=True, null=True, upload_to='labels/'),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='labels_render_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='labels_rendered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='labels_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_batch_labels_artifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='labels_bytes_saved',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
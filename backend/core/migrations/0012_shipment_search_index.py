@@ -0,0 +1,91 @@
+from django.db import migrations
+
+# Searchable text: the order number and the recipient (ship_to) address.
+# The FTS5 trigram tokenizer indexes every 3-character substring, so a
+# MATCH on a quoted phrase behaves like icontains on each column. Rows are
+# kept current by core.search from signals; see migration 0017 for why
+# there are no triggers.
+SQLITE_FORWARD = [
+    # Stable integer keys for FTS rows (shipment ids are UUIDs, and the
+    # implicit rowid of core_shipment may change on VACUUM)
+    """
+    CREATE TABLE core_shipment_search_key (
+        rowid INTEGER PRIMARY KEY,
+        shipment_id char(32) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE core_shipment_search USING fts5(
+        order_no, name, first_name, last_name, address_line1, address_line2,
+        city, state, tokenize = 'trigram'
+    )
+    """,
+    # Index the shipments that already exist
+    "INSERT INTO core_shipment_search_key (shipment_id) SELECT id FROM core_shipment",
+    """
+    INSERT INTO core_shipment_search (
+        rowid, order_no, name, first_name, last_name, address_line1,
+        address_line2, city, state
+    )
+    SELECT k.rowid, s.order_no, a.name, a.first_name, a.last_name,
+           a.address_line1, a.address_line2, a.city, a.state
+    FROM core_shipment s
+    JOIN core_shipment_search_key k ON k.shipment_id = s.id
+    LEFT JOIN core_address a ON a.id = s.ship_to_id
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS core_shipment_search_address",
+    "DROP TRIGGER IF EXISTS core_shipment_search_delete",
+    "DROP TRIGGER IF EXISTS core_shipment_search_update",
+    "DROP TRIGGER IF EXISTS core_shipment_search_insert",
+    "DROP TABLE IF EXISTS core_shipment_search",
+    "DROP TABLE IF EXISTS core_shipment_search_key",
+]
+
+# On PostgreSQL the existing icontains filter (ILIKE) can use trigram GIN
+# indexes directly, so no separate search table is needed
+POSTGRES_COLUMNS = {
+    "core_shipment": ["order_no"],
+    "core_address": [
+        "name", "first_name", "last_name", "address_line1", "address_line2", "city", "state",
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+    elif vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, columns in POSTGRES_COLUMNS.items():
+            for column in columns:
+                schema_editor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_{column}_trgm "
+                    f"ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+                )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in SQLITE_REVERSE:
+            schema_editor.execute(statement)
+    elif vendor == "postgresql":
+        for table, columns in POSTGRES_COLUMNS.items():
+            for column in columns:
+                schema_editor.execute(f"DROP INDEX IF EXISTS {table}_{column}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
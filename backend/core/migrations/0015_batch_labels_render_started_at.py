@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='labels_render_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
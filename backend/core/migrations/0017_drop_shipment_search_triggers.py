@@ -0,0 +1,31 @@
+from django.db import migrations
+
+# 0012 used to keep the search index current with triggers on core_shipment
+# and core_address that read each other's table. SQLite then refuses the
+# table rebuild Django does for AlterField/RemoveField on either model ("no
+# such table: main.core_shipment"), and a rebuild would drop the triggers of
+# the rebuilt table anyway. core.search now maintains the index instead.
+TRIGGERS = [
+    "core_shipment_search_insert",
+    "core_shipment_search_update",
+    "core_shipment_search_delete",
+    "core_shipment_search_address",
+]
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for trigger in TRIGGERS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0016_create_cache_table"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 import logging
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.lookups import LessThan
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from common.models.base_model import BaseModel
 
@@ -30,6 +33,15 @@ class Address(BaseModel):
         verbose_name = "Saved Address"
         verbose_name_plural = "Saved Addresses"
         ordering = ["name"]
+        indexes = [
+            # get_or_create on CSV upload
+            models.Index(
+                fields=["address_line1", "zip_code", "city", "state"],
+                name="address_natural_key_idx",
+            ),
+            # The saved address book, listed by name
+            models.Index(fields=["name"], condition=Q(saved=True), name="address_saved_name_idx"),
+        ]
 
     def __str__(self):
         """Unicode representation of Address."""
@@ -54,12 +66,39 @@ class Package(BaseModel):
         verbose_name = "Package"
         verbose_name_plural = "Packages"
         ordering = ["name"]
+        indexes = [
+            # get_or_create by SKU on CSV upload
+            models.Index(fields=["sku"], name="package_sku_idx"),
+            # Saved packages, listed by name
+            models.Index(fields=["name"], condition=Q(saved=True), name="package_saved_name_idx"),
+        ]
 
     def __str__(self):
         """Unicode representation of Package."""
         return f"{self.name} ({self.weight_lbs}lb {self.weight_oz}oz)"
 
 
+class BatchQuerySet(models.QuerySet):
+    def with_shipment_summary(self):
+        """
+        Annotate shipment count, price total and per-status counts.
+
+        All figures come from one aggregate over a single join, so a page of
+        batches costs one query however many shipments they hold.
+        """
+        status_counts = {
+            f"{shipment_status}_count": Count(
+                "shipments", filter=Q(shipments__status=shipment_status)
+            )
+            for shipment_status, _ in Shipment.STATUS_CHOICES
+        }
+        return self.annotate(
+            shipment_count=Count("shipments"),
+            shipments_total=Sum("shipments__price", default=Decimal("0.00")),
+            **status_counts,
+        )
+
+
 class Batch(BaseModel):
     """Model definition for Batch."""
 
@@ -71,11 +110,31 @@ class Batch(BaseModel):
         ("failed", "Failed"),
     ]
 
+    LABELS_STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("rendering", "Rendering"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="uploaded")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     label_format = models.CharField(max_length=10, null=True, blank=True)
+    # Pre-rendered label artifact, produced in the background after purchase
+    labels_status = models.CharField(
+        max_length=20, choices=LABELS_STATUS_CHOICES, default="pending"
+    )
+    labels_file = models.FileField(upload_to="labels/", null=True, blank=True)
+    # When the current render claimed the batch; lets a dead render be reclaimed
+    labels_render_started_at = models.DateTimeField(null=True, blank=True)
+    labels_rendered_at = models.DateTimeField(null=True, blank=True)
+    labels_render_seconds = models.FloatField(null=True, blank=True)
+    labels_bytes_saved = models.PositiveBigIntegerField(null=True, blank=True)
+    labels_error = models.TextField(blank=True)
+
+    objects = BatchQuerySet.as_manager()
 
     class Meta:
         """Meta definition for Batch."""
@@ -83,6 +142,10 @@ class Batch(BaseModel):
         verbose_name = "Batch"
         verbose_name_plural = "Batches"
         ordering = ["-created_at"]
+        indexes = [
+            # Keyset pagination of a user's batches
+            models.Index(fields=["user", "created_at", "id"], name="batch_user_created_id_idx"),
+        ]
 
     def __str__(self):
         """Unicode representation of Batch."""
@@ -108,6 +171,93 @@ class Batch(BaseModel):
             )
             raise
 
+    def shipment_stats(self):
+        """
+        Shipment counts and price totals by status, service and weight.
+
+        Everything comes from one aggregate grouped by (status, service,
+        weight bucket), folded into the separate breakdowns here; the
+        grouping reads through the (batch, status) index.
+
+        Returns:
+            dict: ``shipment_count``, ``total_price``, ``by_status`` and
+            ``by_service`` (each ``{key: {"count", "total_price"}}``, every
+            choice present) and ``weight_buckets`` (``{label: count}``)
+        """
+        rows = (
+            self.shipments.order_by()
+            .annotate(weight_bucket=Shipment.weight_bucket_expression())
+            .values("status", "shipping_service", "weight_bucket")
+            .annotate(count=Count("pk"), total_price=Sum("price"))
+        )
+
+        def empty_groups(choices):
+            return {key: {"count": 0, "total_price": Decimal("0.00")} for key, _ in choices}
+
+        stats = {
+            "shipment_count": 0,
+            "total_price": Decimal("0.00"),
+            "by_status": empty_groups(Shipment.STATUS_CHOICES),
+            "by_service": empty_groups(Shipment.SERVICE_CHOICES),
+            "weight_buckets": {label: 0 for label, _ in Shipment.WEIGHT_BUCKETS},
+        }
+        stats["weight_buckets"][Shipment.NO_PACKAGE_BUCKET] = 0
+
+        for row in rows:
+            total = row["total_price"] or Decimal("0.00")
+            stats["shipment_count"] += row["count"]
+            stats["total_price"] += total
+            for breakdown, key in (
+                ("by_status", row["status"]),
+                ("by_service", row["shipping_service"]),
+            ):
+                group = stats[breakdown].setdefault(
+                    key, {"count": 0, "total_price": Decimal("0.00")}
+                )
+                group["count"] += row["count"]
+                group["total_price"] += total
+            stats["weight_buckets"][row["weight_bucket"]] += row["count"]
+
+        return stats
+
+    def assign_tracking_numbers(self):
+        """
+        Allocate tracking numbers for every shipment in the batch that has none.
+
+        Numbers come from a single block reserved on TrackingSequence and are
+        written with one bulk update, so the cost does not grow with per-row
+        queries. Returns the number of shipments updated.
+        """
+        shipments = list(
+            self.shipments.filter(tracking_number__isnull=True)
+            .only("id", "shipping_service")
+            .order_by("id")
+        )
+        if not shipments:
+            return 0
+
+        block = TrackingSequence.allocate(len(shipments))
+        now = timezone.now()
+        for shipment, value in zip(shipments, block):
+            shipment.tracking_number = Shipment.format_tracking_number(
+                shipment.shipping_service, value
+            )
+            shipment.updated_at = now
+
+        Shipment.objects.bulk_update(
+            shipments, ["tracking_number", "updated_at"], batch_size=500
+        )
+        # bulk_update sends no signals
+        from core.response_cache import invalidate_batch_responses
+
+        invalidate_batch_responses(self.pk, self.user_id)
+
+        logger.info(
+            f"Assigned {len(shipments)} tracking numbers for Batch {self.id} "
+            f"({shipments[0].tracking_number} .. {shipments[-1].tracking_number})"
+        )
+        return len(shipments)
+
 
 class Shipment(BaseModel):
     """Model definition for Shipment."""
@@ -122,6 +272,16 @@ class Shipment(BaseModel):
         ("incomplete", "Incomplete"),
         ("error", "Error"),
     ]
+
+    # Package weight buckets for batch stats: (label, upper bound in oz)
+    WEIGHT_BUCKETS = [
+        ("0-1 lb", 16),
+        ("1-5 lb", 80),
+        ("5-20 lb", 320),
+        ("20+ lb", None),
+    ]
+    NO_PACKAGE_BUCKET = "no package"
+
     order_no = models.CharField(max_length=50, blank=True)
     batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name="shipments")
     # Ship From
@@ -155,6 +315,9 @@ class Shipment(BaseModel):
     )
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     error_message = models.TextField(blank=True)
+    tracking_number = models.CharField(
+        max_length=20, unique=True, null=True, blank=True, editable=False
+    )
 
     class Meta:
         """Meta definition for Shipment."""
@@ -162,11 +325,50 @@ class Shipment(BaseModel):
         verbose_name = "Shipment"
         verbose_name_plural = "Shipments"
         ordering = ["-created_at"]
+        indexes = [
+            # Keyset pagination
+            models.Index(fields=["created_at", "id"], name="shipment_created_id_idx"),
+            # Per-batch status filters and the batch stats aggregate
+            models.Index(fields=["batch", "status"], name="shipment_batch_status_idx"),
+            models.Index(fields=["batch", "shipping_service"], name="shipment_batch_service_idx"),
+            # A batch's shipments in the default -created_at order
+            models.Index(fields=["batch", "created_at"], name="shipment_batch_created_idx"),
+        ]
 
     def __str__(self):
         """Unicode representation of Shipment."""
         return f"Order {self.order_no or self.id}"
 
+    @classmethod
+    def weight_bucket_expression(cls):
+        """Expression labelling each shipment with its WEIGHT_BUCKETS entry."""
+        weight_oz = F("package__weight_lbs") * 16 + F("package__weight_oz")
+        whens = [When(package__isnull=True, then=Value(cls.NO_PACKAGE_BUCKET))]
+        whens.extend(
+            When(LessThan(weight_oz, upper), then=Value(label))
+            for label, upper in cls.WEIGHT_BUCKETS[:-1]
+        )
+        return Case(
+            *whens,
+            default=Value(cls.WEIGHT_BUCKETS[-1][0]),
+            output_field=models.CharField(),
+        )
+
+    @staticmethod
+    def format_tracking_number(shipping_service, value):
+        """
+        Format a sequence value as a tracking number.
+
+        Service prefix, 10 zero-padded digits and a weighted mod-10 check digit,
+        e.g. ``PM00000012347``.
+        """
+        prefix = "PM" if shipping_service == "priority" else "GS"
+        digits = f"{value:010d}"
+        weighted = sum(
+            int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(digits)
+        )
+        return f"{prefix}{digits}{(10 - weighted % 10) % 10}"
+
     def validate_address(self, address, address_type="address"):
         """
         Validate an address object.
@@ -320,3 +522,36 @@ class Shipment(BaseModel):
 
     def save(self, *args, **kwargs):
         return super().save(*args, **kwargs)
+
+
+class TrackingSequence(BaseModel):
+    """Monotonic counter that hands out tracking numbers in blocks."""
+
+    name = models.CharField(max_length=50, unique=True, default="default")
+    next_value = models.BigIntegerField(default=1)
+
+    class Meta:
+        """Meta definition for TrackingSequence."""
+
+        verbose_name = "Tracking Sequence"
+        verbose_name_plural = "Tracking Sequences"
+
+    def __str__(self):
+        """Unicode representation of TrackingSequence."""
+        return f"{self.name} (next: {self.next_value})"
+
+    @classmethod
+    def allocate(cls, count, name="default"):
+        """
+        Reserve ``count`` consecutive values and return them as a range.
+
+        The row is locked for the duration of the reservation, so concurrent
+        purchases always receive disjoint blocks.
+        """
+        with transaction.atomic():
+            sequence, _ = cls.objects.select_for_update().get_or_create(name=name)
+            start = sequence.next_value
+            sequence.next_value = start + count
+            sequence.save(update_fields=["next_value", "updated_at"])
+
+        return range(start, start + count)
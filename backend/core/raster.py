@@ -0,0 +1,240 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+import reportlab
+from django.conf import settings
+from django.utils.text import get_valid_filename
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.units import inch
+
+from core.layouts import (
+    TEXT_PRIMARY,
+    TEXT_SECONDARY,
+    compile_layout,
+    label_size,
+    layout_name,
+)
+from core.services import LABEL_TEXT_SLOTS, address_lines, as_label_data, code128_runs
+
+logger = logging.getLogger(__name__)
+
+RASTER_FORMATS = ["png"]
+SUPPORTED_DPI = (203, 300)
+DEFAULT_DPI = 203
+
+# On-screen previews: grayscale so small text stays legible
+PREVIEW_DPI = 96
+
+# reportlab ships the Bitstream Vera fonts; it has no Vera Sans Mono, so the
+# metric-compatible DejaVu Sans Mono Bold is bundled in core/fonts
+_FONT_DIR = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+_BUNDLED_FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+
+
+def is_raster_format(label_format):
+    """Return True when the batch label format asks for image output."""
+    return (label_format or "").lower() in RASTER_FORMATS
+
+
+def iter_shipping_labels_png(shipments, dpi=DEFAULT_DPI, workers=None):
+    """
+    Render 1-bit PNG labels for each shipment, spread across worker processes.
+
+    Workers receive picklable LabelData snapshots and never touch the ORM.
+    At most ``4 * workers`` labels are in flight at a time and results are
+    yielded in input order, which keeps memory bounded for very large
+    batches.
+
+    Args:
+        shipments: Iterable of LabelData or shipment objects
+        dpi: Printer resolution, one of SUPPORTED_DPI
+        workers: Worker process count (defaults to settings.LABEL_RENDER_WORKERS)
+
+    Yields:
+        tuple: (filename, png_bytes)
+    """
+    if dpi not in SUPPORTED_DPI:
+        raise ValueError(f"Unsupported dpi {dpi}, expected one of {SUPPORTED_DPI}")
+
+    if workers is None:
+        workers = settings.LABEL_RENDER_WORKERS
+
+    jobs = (
+        (_label_filename(label, index, "png"), label)
+        for index, label in enumerate(map(as_label_data, shipments), 1)
+    )
+
+    if workers <= 1:
+        for filename, label in jobs:
+            yield filename, render_label_png(label, dpi)
+        return
+
+    logger.debug("Rendering PNG labels with %d workers at %d dpi", workers, dpi)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for filename, label in jobs:
+            pending.append((filename, pool.submit(render_label_png, label, dpi)))
+            if len(pending) >= workers * 4:
+                filename, future = pending.popleft()
+                yield filename, future.result()
+
+        while pending:
+            filename, future = pending.popleft()
+            yield filename, future.result()
+
+
+def render_label_png(label, dpi=DEFAULT_DPI, grayscale=False, label_format=None):
+    """
+    Render one label as a 1-bit PNG at printer resolution.
+
+    Draws the same compiled layout as the PDF renderer. Barcode modules are
+    snapped to whole printer dots so every bar prints at the same width.
+
+    Args:
+        label: LabelData snapshot of the shipment
+        dpi: Printer resolution
+        grayscale: Anti-aliased 8-bit output for screen previews instead of
+            1-bit printer output
+        label_format: Layout name (defaults to 4x6)
+
+    Returns:
+        bytes: PNG image data
+    """
+    layout = layout_name(label_format)
+    width, height = label_size(layout)
+    scale = dpi / 72.0
+
+    image = Image.new(
+        "L" if grayscale else "1",
+        (int(round(width * scale)), int(round(height * scale))),
+        255 if grayscale else 1,
+    )
+    painter = _RasterPainter(image, scale, height, grayscale)
+
+    for kind, when, unless, args in compile_layout(layout):
+        if when and not getattr(label, when):
+            continue
+        if unless and getattr(label, unless):
+            continue
+        getattr(painter, kind)(label, *args)
+
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+
+class _RasterPainter:
+    """Applies compiled layout operations (in points) to a PIL image."""
+
+    def __init__(self, image, scale, height, grayscale):
+        self.draw = ImageDraw.Draw(image)
+        self.scale = scale
+        self.height = height
+        self.grayscale = grayscale
+
+    def px(self, value):
+        return int(round(value * self.scale))
+
+    def top(self, y):
+        # PDF y grows upwards from the bottom edge, image y grows downwards
+        return self.px(self.height - y)
+
+    def ink(self, color):
+        # Thermal printers have no tints: everything prints black
+        if not self.grayscale:
+            return 0
+        return int(round(255 * (0.299 * color.red + 0.587 * color.green + 0.114 * color.blue)))
+
+    def box(self, label, x, y, width, height, line_width, stroke, fill):
+        bounds = [self.px(x), self.top(y + height), self.px(x + width), self.top(y)]
+        if fill is not None and self.grayscale:
+            self.draw.rectangle(bounds, fill=self.ink(fill))
+        if stroke is not None or not self.grayscale:
+            # Tinted areas become outlines on 1-bit output
+            self.draw.rectangle(
+                bounds,
+                outline=self.ink(stroke or fill),
+                width=max(1, self.px(line_width)),
+            )
+
+    def rule(self, label, x1, x2, y, line_width, color):
+        self.draw.line(
+            [(self.px(x1), self.top(y)), (self.px(x2), self.top(y))],
+            fill=self.ink(color),
+            width=max(1, self.px(line_width)),
+        )
+
+    def text(self, label, x, y, font, size, text, slot, color, align):
+        if slot:
+            text = LABEL_TEXT_SLOTS[slot](label)
+        self.draw.text(
+            (self.px(x), self.top(y)),
+            text,
+            font=_font(font, self.px(size)),
+            fill=self.ink(color),
+            anchor=_ANCHORS[align],
+        )
+
+    def address(self, label, x, y, field, size, leading, is_from):
+        for kind, line in address_lines(getattr(label, field), is_from=is_from):
+            if kind == "name":
+                self.text(label, x, y, "Helvetica-Bold", size, line, None, TEXT_PRIMARY, "left")
+            elif kind == "phone":
+                self.text(label, x, y, "Helvetica", size - 1, line, None, TEXT_SECONDARY, "left")
+            else:
+                self.text(label, x, y, "Helvetica", size, line, None, TEXT_PRIMARY, "left")
+            y -= leading
+
+    def barcode(self, label, x, y, width, height, bar_width):
+        tracking_number = label.tracking_number
+        try:
+            runs = code128_runs(tracking_number)
+        except ValueError as barcode_err:
+            logger.warning("Failed to encode Code128 barcode: %s", str(barcode_err))
+            self.box(label, x, y, width, height, 1, TEXT_PRIMARY, None)
+            self.text(
+                label, x + width / 2, y + height / 2, "Courier-Bold", 8,
+                f"|||  {tracking_number}  |||", None, TEXT_SECONDARY, "center",
+            )
+            return
+
+        # Whole dots per module, shrunk only if the symbol would not fit
+        module = max(1, round(bar_width * self.scale))
+        module = max(1, min(module, self.px(width) // sum(runs)))
+        bar_top = self.top(y + height)
+        bar_bottom = self.top(y) - 1
+        left = self.px(x + max(0.25 * inch, bar_width * 10.0))
+
+        for index, run in enumerate(runs):
+            run_width = run * module
+            if index % 2 == 0:
+                self.draw.rectangle([left, bar_top, left + run_width - 1, bar_bottom], fill=0)
+            left += run_width
+
+
+# PDF fonts and their closest Vera equivalents (Courier needs a monospace
+# face so barcode text keeps the width it has in the PDF and ZPL output)
+_FONT_FILES = {
+    "Helvetica": os.path.join(_FONT_DIR, "Vera.ttf"),
+    "Helvetica-Bold": os.path.join(_FONT_DIR, "VeraBd.ttf"),
+    "Helvetica-Oblique": os.path.join(_FONT_DIR, "VeraIt.ttf"),
+    "Courier-Bold": os.path.join(_BUNDLED_FONT_DIR, "DejaVuSansMono-Bold.ttf"),
+}
+
+_ANCHORS = {"left": "ls", "right": "rs", "center": "ms"}
+
+
+@lru_cache(maxsize=64)
+def _font(name, size):
+    return ImageFont.truetype(_FONT_FILES[name], size)
+
+
+def _label_filename(label, index, extension):
+    """Stable, filesystem-safe file name for one label inside an archive."""
+    reference = label.order_no or label.id or index
+    return f"{index:05d}-{get_valid_filename(str(reference))}.{extension}"
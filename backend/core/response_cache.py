@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified
+
+from common.utils.oncommit import collect_on_commit
+from core.models import Batch, Shipment
+
+logger = logging.getLogger(__name__)
+
+# Entries are never deleted; bumping a generation makes every key built
+# from the old value unreachable, and the stale entries simply expire
+_GENERATION_KEY = "batch-responses:gen:%s"
+
+# Backends whose entries other worker processes cannot see
+_PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class BatchResponseCacheMixin:
+    """
+    Serve repeated batch list/retrieve reads from Django's cache.
+
+    List responses are keyed by user, detail responses by batch, each with a
+    generation number that ``invalidate_batch_responses`` bumps on every
+    write (see ``core.signals`` and the bulk update paths), plus the query
+    string and Accept header. A hit costs no database queries; a stored
+    ETag still answers ``If-None-Match`` with 304. Only rendered JSON 200
+    responses are stored.
+
+    Off unless the default cache is shared by all worker processes (see
+    ``response_cache_enabled``): with a per-process cache, a write would
+    only invalidate the entries of the worker that made it.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not response_cache_enabled():
+            return super().list(request, *args, **kwargs)
+        scope = f"user:{request.user.pk}"
+        return self._cached(request, scope, super().list, args, kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not response_cache_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        scope = f"batch:{self.kwargs[lookup_url_kwarg]}"
+        return self._cached(request, scope, super().retrieve, args, kwargs)
+
+    def _cached(self, request, scope, view, args, kwargs):
+        key = _response_key(request, scope)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug("Batch response cache hit | scope=%s", scope)
+            return _cached_response(request, cached)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.add_post_render_callback(lambda rendered: _store(key, rendered))
+        return response
+
+
+def response_cache_enabled():
+    """True when responses are cached: a TTL is set and the cache is shared."""
+    return settings.BATCH_RESPONSE_CACHE_SECONDS > 0 and not isinstance(
+        caches["default"], _PROCESS_LOCAL_CACHES
+    )
+
+
+def invalidate_batch_responses(batch_id, user_id=None):
+    """
+    Drop cached list responses of the batch owner and the batch's detail.
+
+    Generations are bumped when the write becomes visible, once the
+    transaction commits, and only once per scope however many rows it
+    wrote. A read racing the commit stores its entry under the generation
+    it started with, which the bump makes unreachable.
+
+    Args:
+        batch_id: Batch primary key
+        user_id: Owner, looked up at commit when not given
+    """
+    if response_cache_enabled():
+        collect_on_commit(_bump_batches, [(batch_id, user_id)])
+
+
+def invalidate_shipment_responses(shipment):
+    """Invalidate the batch a shipment belongs to, reusing its loaded batch."""
+    if not shipment.batch_id or not response_cache_enabled():
+        return
+    user_id = shipment.batch.user_id if Shipment.batch.is_cached(shipment) else None
+    invalidate_batch_responses(shipment.batch_id, user_id)
+
+
+def invalidate_related_responses(**relation):
+    """
+    Invalidate every batch with a shipment pointing at an address or package.
+
+    Args:
+        relation: ``address=`` or ``package=`` instance
+    """
+    if not response_cache_enabled():
+        return
+    if "address" in relation:
+        address = relation["address"]
+        shipments = Shipment.objects.filter(Q(ship_from=address) | Q(ship_to=address))
+    else:
+        shipments = Shipment.objects.filter(package=relation["package"])
+    for batch_id, user_id in shipments.values_list("batch_id", "batch__user_id").distinct():
+        invalidate_batch_responses(batch_id, user_id)
+
+
+def _bump_batches(changes):
+    # One owner query for the batches written without a known owner
+    batch_ids = {batch_id for batch_id, _ in changes}
+    user_ids = {user_id for _, user_id in changes if user_id is not None}
+    unknown = batch_ids - {batch_id for batch_id, user_id in changes if user_id is not None}
+    if unknown:
+        user_ids.update(Batch.objects.filter(pk__in=unknown).values_list("user_id", flat=True))
+    _bump([f"batch:{batch_id}" for batch_id in batch_ids] + [f"user:{user_id}" for user_id in user_ids])
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = _GENERATION_KEY % scope
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Unknown or evicted; start from a value no earlier entry can have used
+            cache.set(key, time.time_ns(), None)
+
+
+def _generation(scope):
+    key = _GENERATION_KEY % scope
+    generation = cache.get(key)
+    if generation is None:
+        generation = time.time_ns()
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def _response_key(request, scope):
+    variant = "|".join(
+        [
+            request.get_full_path(),
+            request.META.get("HTTP_ACCEPT", ""),
+            str(request.user.pk),
+        ]
+    )
+    digest = hashlib.sha1(variant.encode("utf-8")).hexdigest()
+    return f"batch-responses:{scope}:{_generation(scope)}:{digest}"
+
+
+def _store(key, response):
+    renderer = getattr(response, "accepted_renderer", None)
+    if renderer is None or renderer.format != "json":
+        return
+    cache.set(
+        key,
+        {
+            "content": response.content,
+            "content_type": response["Content-Type"],
+            "etag": response.get("ETag"),
+            "last_modified": response.get("Last-Modified"),
+        },
+        settings.BATCH_RESPONSE_CACHE_SECONDS,
+    )
+
+
+def _cached_response(request, cached):
+    etag = cached["etag"]
+    if etag and etag.removeprefix("W/") in {
+        tag.strip().removeprefix("W/")
+        for tag in request.META.get("HTTP_IF_NONE_MATCH", "").split(",")
+    }:
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    response = HttpResponse(cached["content"], content_type=cached["content_type"])
+    if etag:
+        response["ETag"] = etag
+    if cached["last_modified"]:
+        response["Last-Modified"] = cached["last_modified"]
+    return response
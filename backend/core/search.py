@@ -0,0 +1,92 @@
+from django.db import connection
+
+from common.utils.oncommit import collect_on_commit
+from core.models import Shipment
+
+# Shipment search index on SQLite (tables created by migration 0012).
+# It is kept current from application code (see core.signals) rather than
+# database triggers: triggers on core_shipment and core_address that read
+# each other's table break the table rebuilds Django's SQLite schema editor
+# does for AlterField/RemoveField migrations. Signals queue the changed
+# shipments and the index is rewritten for all of them once the transaction
+# commits. Writers that bypass signals (queryset ``update()`` of
+# ``order_no``/``ship_to``, or of address fields) must call
+# ``queue_reindex``/``reindex_address`` themselves.
+
+_INDEX_ROWS_SQL = """
+    INSERT INTO core_shipment_search (
+        rowid, order_no, name, first_name, last_name, address_line1,
+        address_line2, city, state
+    )
+    SELECT k.rowid, s.order_no, a.name, a.first_name, a.last_name,
+           a.address_line1, a.address_line2, a.city, a.state
+    FROM core_shipment s
+    JOIN core_shipment_search_key k ON k.shipment_id = s.id
+    LEFT JOIN core_address a ON a.id = s.ship_to_id
+    WHERE {where}
+"""
+_DELETE_ROWS_SQL = """
+    DELETE FROM core_shipment_search WHERE rowid IN (
+        SELECT k.rowid FROM core_shipment_search_key k WHERE {where}
+    )
+"""
+
+
+def search_index_enabled():
+    """The trigram search index only exists on SQLite."""
+    return connection.vendor == "sqlite"
+
+
+def queue_reindex(shipment_ids):
+    """
+    Reindex shipments once the current transaction commits.
+
+    Shipments queued during one transaction are reindexed together, so
+    saving N shipments costs a few statements per 500 rather than per row.
+    """
+    if search_index_enabled():
+        collect_on_commit(reindex_shipments, shipment_ids)
+
+
+def reindex_shipments(shipment_ids):
+    """
+    Write the search rows of the given shipments from their current data.
+
+    Rows of shipments that no longer exist are removed.
+
+    Args:
+        shipment_ids: Primary keys of created, changed or deleted shipments
+    """
+    if not search_index_enabled():
+        return
+    with connection.cursor() as cursor:
+        for keys in _key_chunks(shipment_ids):
+            marks = ", ".join(["%s"] * len(keys))
+            cursor.execute(
+                "INSERT OR IGNORE INTO core_shipment_search_key (shipment_id) "
+                f"SELECT id FROM core_shipment WHERE id IN ({marks})",
+                keys,
+            )
+            cursor.execute(_DELETE_ROWS_SQL.format(where=f"k.shipment_id IN ({marks})"), keys)
+            cursor.execute(
+                f"DELETE FROM core_shipment_search_key WHERE shipment_id IN ({marks}) "
+                "AND shipment_id NOT IN (SELECT id FROM core_shipment)",
+                keys,
+            )
+            cursor.execute(_INDEX_ROWS_SQL.format(where=f"s.id IN ({marks})"), keys)
+
+
+def reindex_address(address_id):
+    """Queue a reindex of every shipment delivered to an address."""
+    if not search_index_enabled():
+        return
+    queue_reindex(Shipment.objects.filter(ship_to_id=address_id).values_list("pk", flat=True))
+
+
+def _key_chunks(shipment_ids, size=500):
+    # Shipment ids as stored (char(32) on SQLite), batched under the
+    # bound-parameter limit
+    pk = Shipment._meta.pk
+    keys = [pk.get_db_prep_value(value, connection) for value in shipment_ids]
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
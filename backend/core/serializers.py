@@ -1,22 +1,24 @@
 from rest_framework import serializers
+
+from common.utils.fieldsets import SparseFieldsetMixin
 from .models import Batch, Shipment, Address, Package
 
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = "__all__"
         read_only_fields = ["saved", "created_at", "updated_at"]
 
 
-class PackageSerializer(serializers.ModelSerializer):
+class PackageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Package
         fields = "__all__"
         read_only_fields = ["saved", "created_at", "updated_at"]
 
 
-class ShipmentSerializer(serializers.ModelSerializer):
+class ShipmentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     ship_from = AddressSerializer(read_only=True)
     ship_to = AddressSerializer(read_only=True)
     package = PackageSerializer(read_only=True)
@@ -24,13 +26,75 @@ class ShipmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shipment
         fields = "__all__"
-        read_only_fields = ["batch", "price", "status", "created_at", "updated_at"]
+        read_only_fields = [
+            "batch",
+            "price",
+            "status",
+            "tracking_number",
+            "created_at",
+            "updated_at",
+        ]
+
 
+BATCH_READ_ONLY_FIELDS = [
+    "total_price",
+    "labels_status",
+    "labels_file",
+    "labels_render_started_at",
+    "labels_rendered_at",
+    "labels_render_seconds",
+    "labels_bytes_saved",
+    "labels_error",
+    "created_at",
+    "updated_at",
+]
 
-class BatchSerializer(serializers.ModelSerializer):
+
+class BatchSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     shipments = ShipmentSerializer(many=True, read_only=True)
 
     class Meta:
         model = Batch
         fields = "__all__"
-        read_only_fields = ["total_price", "created_at", "updated_at"]
+        read_only_fields = BATCH_READ_ONLY_FIELDS
+
+
+class BatchListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Batch summary for list endpoints, without the nested shipments.
+
+    Expects a queryset annotated by ``Batch.objects.with_shipment_summary()``;
+    shipments themselves come from the batch detail or shipments endpoint.
+    """
+
+    shipment_count = serializers.IntegerField(read_only=True)
+    shipments_total = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True
+    )
+    status_counts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Batch
+        exclude = ["labels_error"]
+        read_only_fields = BATCH_READ_ONLY_FIELDS
+
+    def get_status_counts(self, obj):
+        return {
+            shipment_status: getattr(obj, f"{shipment_status}_count")
+            for shipment_status, _ in Shipment.STATUS_CHOICES
+        }
+
+
+class ShipmentGroupStatsSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class BatchStatsSerializer(serializers.Serializer):
+    """Output of ``Batch.shipment_stats()``."""
+
+    shipment_count = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    by_status = serializers.DictField(child=ShipmentGroupStatsSerializer())
+    by_service = serializers.DictField(child=ShipmentGroupStatsSerializer())
+    weight_buckets = serializers.DictField(child=serializers.IntegerField())
@@ -1,550 +1,701 @@
 import logging
+from collections import namedtuple
+from functools import lru_cache
 from io import BytesIO
+from itertools import chain, islice
 from reportlab.lib.units import inch
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.colors import black, HexColor
+from reportlab.pdfgen.pathobject import PDFPathObject
+from reportlab.lib.colors import black
 from reportlab.graphics.barcode import code128
 
+from django.conf import settings
+from django.utils.text import get_valid_filename
+
+from common.utils.pdfstream import StreamingCanvas
+from core.layouts import (
+    BORDER_COLOR,
+    SHEETS,
+    Op,
+    TEXT_PRIMARY,
+    TEXT_SECONDARY,
+    compile_layout,
+    impose,
+    page_size,
+    sheet_name,
+)
+from core.models import Shipment
+
 # Configure logging (you can move this to your project's main settings)
 logger = logging.getLogger(__name__)
 
-# Label dimensions
+# ZPL output is drawn for 4x6 stock only
 LABEL_4X6_WIDTH = 4 * inch
 LABEL_4X6_HEIGHT = 6 * inch
-LETTER_WIDTH, LETTER_HEIGHT = letter
 
-# Professional color scheme
-BORDER_COLOR = HexColor("#2c3e50")
-HEADER_BG = HexColor("#ecf0f1")
-ACCENT_COLOR = HexColor("#3498db")
-TEXT_PRIMARY = black
-TEXT_SECONDARY = HexColor("#7f8c8d")
+# Encoded Code128 patterns kept in memory (a few hundred bytes each)
+CODE128_CACHE_SIZE = 4096
+
+# Sender blocks kept as reusable forms per document; further distinct senders
+# are drawn inline
+SENDER_FORM_LIMIT = 256
+
+
+class PdfProfile(namedtuple("PdfProfile", ["compress", "forms", "elide_state"])):
+    """
+    PDF output settings.
+
+    compress: Flate-compress page and form streams
+    forms: Draw the fixed parts of each label and repeated sender blocks once
+        per document as form XObjects and reference them from every page
+    elide_state: Skip font, colour and line width operators that repeat the
+        current state
+    """
+
+    __slots__ = ()
+
+
+PDF_PROFILES = {
+    "standard": PdfProfile(compress=True, forms=False, elide_state=False),
+    "compact": PdfProfile(compress=True, forms=True, elide_state=True),
+}
+
+# Forms only pay for themselves once they are reused across pages: below
+# this many pages a compact PDF is larger than a standard one (a single 4x6
+# label by about a third), so the default profile falls back to standard
+COMPACT_MIN_PAGES = 10
+
+
+# Result of writing a label PDF; bytes_saved is content stream bytes avoided
+# by compression and form reuse compared to drawing every page in full
+PdfStats = namedtuple("PdfStats", ["labels", "pages", "bytes_written", "bytes_saved"])
+
+
+class LabelAddress(
+    namedtuple(
+        "LabelAddress",
+        [
+            "name",
+            "first_name",
+            "last_name",
+            "address_line1",
+            "address_line2",
+            "city",
+            "state",
+            "zip_code",
+            "phone",
+        ],
+    )
+):
+    """Address fields printed on a label (all strings, never None)."""
+
+    __slots__ = ()
+
+
+class LabelPackage(
+    namedtuple(
+        "LabelPackage",
+        ["weight_lbs", "weight_oz", "length_inches", "width_inches", "height_inches"],
+    )
+):
+    """Package fields printed on a label."""
+
+    __slots__ = ()
+
+
+class LabelData(
+    namedtuple(
+        "LabelData",
+        [
+            "id",
+            "order_no",
+            "service",
+            "price",
+            "tracking_number",
+            "ship_from",
+            "ship_to",
+            "package",
+        ],
+    )
+):
+    """
+    Everything a label layout needs for one shipment.
+
+    A compact, picklable snapshot: renderers never touch model instances, so
+    labels can be built from a single ``.values()`` query and handed to
+    worker processes as-is.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_values(cls, row):
+        """Build from a row of ``Shipment.objects.values(*LABEL_VALUES_FIELDS)``."""
+        return cls(
+            id=row["id"],
+            order_no=row["order_no"],
+            service=SERVICE_NAMES.get(row["shipping_service"], "Standard Shipping"),
+            price=row["price"],
+            tracking_number=row["tracking_number"]
+            or _generate_tracking_number(
+                row["order_no"], row["id"], row["shipping_service"]
+            ),
+            ship_from=_address_from_values(row, "ship_from"),
+            ship_to=_address_from_values(row, "ship_to"),
+            package=(
+                LabelPackage(*(row[f"package__{f}"] for f in LabelPackage._fields))
+                if row["package_id"]
+                else None
+            ),
+        )
+
+    @classmethod
+    def from_shipment(cls, shipment):
+        """Build from a Shipment instance (saved or not)."""
+        pkg = shipment.package
+        return cls(
+            id=shipment.id,
+            order_no=shipment.order_no,
+            service=SERVICE_NAMES.get(shipment.shipping_service, "Standard Shipping"),
+            price=shipment.price,
+            tracking_number=shipment.tracking_number
+            or _generate_tracking_number(
+                shipment.order_no, shipment.id, shipment.shipping_service
+            ),
+            ship_from=_address_from_model(shipment.ship_from),
+            ship_to=_address_from_model(shipment.ship_to),
+            package=(
+                LabelPackage(*(getattr(pkg, f) for f in LabelPackage._fields))
+                if pkg
+                else None
+            ),
+        )
+
+
+SERVICE_NAMES = dict(Shipment.SERVICE_CHOICES)
+
+# Columns fetched for rendering; one LEFT JOIN per address and the package
+LABEL_VALUES_FIELDS = (
+    "id",
+    "order_no",
+    "shipping_service",
+    "price",
+    "tracking_number",
+    "ship_from_id",
+    "ship_to_id",
+    "package_id",
+    *(f"ship_from__{f}" for f in LabelAddress._fields),
+    *(f"ship_to__{f}" for f in LabelAddress._fields),
+    *(f"package__{f}" for f in LabelPackage._fields),
+)
+
+
+def label_data_from_queryset(shipments, chunk_size=2000):
+    """
+    Yield LabelData for a shipment queryset using a single ``.values()`` query.
+
+    Rows are streamed with a server-side iterator, so no model instances are
+    created and memory does not grow with the batch size.
+    """
+    rows = shipments.values(*LABEL_VALUES_FIELDS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield LabelData.from_values(row)
+
+
+def as_label_data(shipment):
+    """Return ``shipment`` as LabelData, converting model instances."""
+    if isinstance(shipment, LabelData):
+        return shipment
+    return LabelData.from_shipment(shipment)
+
+
+def _address_from_values(row, prefix):
+    if not row[f"{prefix}_id"]:
+        return None
+    return LabelAddress(*(row[f"{prefix}__{f}"] or "" for f in LabelAddress._fields))
+
 
+def _address_from_model(address):
+    if not address:
+        return None
+    return LabelAddress(*(getattr(address, f) or "" for f in LabelAddress._fields))
 
-def generate_shipping_labels_pdf(shipments, label_format="4x6"):
+
+def generate_shipping_labels_pdf(shipments, label_format="4x6", profile=None):
     """
     Generate multi-page PDF with labels in specified format.
 
     Args:
-        shipments: List of shipment objects
-        label_format: "4x6" for thermal labels or "letter" for Letter/A4 paper
+        shipments: Iterable of LabelData (see label_data_from_queryset) or
+            shipment objects
+        label_format: Stock name from ``core.layouts.SHEETS``
+        profile: Key of PDF_PROFILES; defaults as in ``write_shipping_labels_pdf``
 
     Returns:
         BytesIO buffer ready to be sent as HttpResponse
     """
-    if not shipments:
-        logger.warning("generate_shipping_labels_pdf called with empty shipments list")
-        buffer = BytesIO()
-        buffer.seek(0)
-        return buffer
-
-    logger.info(
-        "Starting PDF generation for %d shipments (format: %s)",
-        len(shipments),
-        label_format,
-    )
-
     buffer = BytesIO()
+    write_shipping_labels_pdf(shipments, buffer, label_format=label_format, profile=profile)
+    buffer.seek(0)
+    return buffer
 
-    # Normalize label format
-    label_format = (label_format or "4x6").lower()
-    is_letter = label_format in ["letter", "a4", "letter/a4"]
 
-    try:
-        if is_letter:
-            logger.debug("Using Letter/A4 format - 2 labels per page")
-            c = canvas.Canvas(buffer, pagesize=(LETTER_WIDTH, LETTER_HEIGHT))
+def write_shipping_labels_pdf(shipments, fh, label_format="4x6", profile=None):
+    """
+    Write a multi-page label PDF to an open binary file.
 
-            for i, shipment in enumerate(shipments):
-                page_position = i % 2
+    Pages are written to ``fh`` as they are drawn, so with a streamed input
+    such as ``label_data_from_queryset`` memory use does not depend on the
+    number of labels. Nothing is written when there are no shipments.
+    Output is deterministic for a given input and profile.
 
-                if i > 0 and page_position == 0:
-                    logger.debug("Showing new page for letter format")
-                    c.showPage()
+    Args:
+        shipments: Iterable of LabelData or shipment objects
+        fh: Writable binary file object
+        label_format: Stock name from ``core.layouts.SHEETS`` ("4x6", "4x4",
+            "4x8", "letter", "letter-4up", ...); unknown formats use 4x6
+        profile: Key of PDF_PROFILES; defaults to ``settings.LABEL_PDF_PROFILE``,
+            or "standard" for runs shorter than ``COMPACT_MIN_PAGES``
 
-                _draw_letter_label(c, shipment, page_position)
+    Returns:
+        PdfStats: Labels and pages written, file size and bytes saved
+    """
+    labels = (as_label_data(shipment) for shipment in shipments)
+    first = next(labels, None)
+    if first is None:
+        logger.warning("generate_shipping_labels_pdf called with empty shipments list")
+        return PdfStats(0, 0, 0, 0)
+
+    labels = chain([first], labels)
+    count = 0
+    sheet = sheet_name(label_format)
+
+    profile_name = profile or settings.LABEL_PDF_PROFILE
+    if profile is None and PDF_PROFILES[profile_name].forms:
+        # Look ahead just far enough to tell a short run from a long one
+        short_run = SHEETS[sheet].columns * SHEETS[sheet].rows * COMPACT_MIN_PAGES
+        head = list(islice(labels, short_run))
+        if len(head) < short_run:
+            profile_name = "standard"
+        labels = chain(head, labels)
+    pdf_profile = PDF_PROFILES[profile_name]
+    logger.info("Starting PDF generation (format: %s, profile: %s)", label_format, profile_name)
+
+    cells = _pdf_cells(sheet, pdf_profile.forms)
+    per_page = len(cells)
 
-            c.save()
-        else:
-            logger.debug("Using 4x6 thermal label format - 1 label per page")
-            c = canvas.Canvas(buffer, pagesize=(LABEL_4X6_WIDTH, LABEL_4X6_HEIGHT))
+    try:
+        logger.debug("Using %s stock - %d label(s) per page", sheet, per_page)
+        c = _profile_canvas(fh, sheet, pdf_profile)
 
-            for i, shipment in enumerate(shipments, 1):
-                if i > 1:
-                    logger.debug("Showing new page for 4x6 label #%d", i)
-                    c.showPage()
+        for i, label in enumerate(labels):
+            position = i % per_page
+            if i > 0 and position == 0:
+                c.showPage()
 
-                _draw_single_4x6_label(c, shipment)
+            _draw_cell(c, cells[position], label)
+            count += 1
 
-            c.save()
+        pages = c.getPageNumber()
+        c.save()
 
+        stats = PdfStats(count, pages, c.bytes_written, c.bytes_saved)
         logger.info(
-            "PDF generation completed successfully for %d shipments", len(shipments)
+            "PDF generation completed successfully for %d shipments "
+            "(%d bytes, %d bytes saved, %d forms)",
+            count, stats.bytes_written, stats.bytes_saved, c.form_count,
         )
 
     except Exception:
         logger.error("Failed to generate shipping labels PDF", exc_info=True)
         raise
 
-    buffer.seek(0)
-    return buffer
+    return stats
 
 
-def _draw_single_4x6_label(c, shipment):
-    """Professional 4x6 shipping label with spacious layout and real barcode."""
-    logger.debug(
-        "Drawing 4x6 label for shipment: %s", getattr(shipment, "order_no", shipment.id)
-    )
+def iter_shipping_label_files(shipments, label_format="4x6"):
+    """
+    Render one label file per shipment, named after its order number.
 
-    margin = 0.3 * inch
-    content_width = LABEL_4X6_WIDTH - (2 * margin)
+    PDF formats produce a one-page PDF per shipment and ``zpl`` a single
+    ``^XA ... ^XZ`` block. Labels are rendered lazily, so the result can be
+    fed straight into ``common.utils.zipstream.iter_zip``.
 
-    # Draw outer border
-    c.setStrokeColor(BORDER_COLOR)
-    c.setLineWidth(1.5)
-    c.rect(margin / 2, margin / 2, LABEL_4X6_WIDTH - margin, LABEL_4X6_HEIGHT - margin)
+    Args:
+        shipments: Iterable of LabelData or shipment objects
+        label_format: Batch label format
 
-    y_position = LABEL_4X6_HEIGHT - margin - 0.15 * inch
+    Yields:
+        tuple: (filename, file_bytes)
+    """
+    zpl = is_zpl_format(label_format)
+    extension = "zpl" if zpl else "pdf"
+    seen = set()
+    count = 0
+
+    for shipment in shipments:
+        label = as_label_data(shipment)
+        if zpl:
+            data = _build_zpl_label(label).encode("utf-8")
+        else:
+            data = _render_label_pdf(label, label_format)
+        count += 1
+        yield _label_file_name(label, seen, extension), data
 
-    # Header - Service & Price
-    header_height = 0.5 * inch
-    c.setFillColor(HEADER_BG)
-    c.rect(
-        margin,
-        y_position - header_height + 0.15 * inch,
-        content_width,
-        header_height,
-        fill=1,
-        stroke=0,
-    )
+    logger.info("Rendered %d individual label files (format: %s)", count, label_format)
 
-    service_display = (
-        shipment.get_shipping_service_display()
-        if hasattr(shipment, "get_shipping_service_display")
-        else "Standard Shipping"
-    )
-    price_text = (
-        f"${shipment.price:.2f}"
-        if hasattr(shipment, "price") and shipment.price is not None
-        else "$0.00"
+
+def _render_label_pdf(label, label_format):
+    # One label per file, so there is nothing for forms to share
+    sheet = sheet_name(label_format)
+    pdf_profile = PDF_PROFILES["standard"]
+    buffer = BytesIO()
+    c = _profile_canvas(buffer, sheet, pdf_profile)
+    _draw_cell(c, _pdf_cells(sheet, pdf_profile.forms)[0], label)
+    c.save()
+    return buffer.getvalue()
+
+
+def _profile_canvas(fh, sheet, pdf_profile):
+    return StreamingCanvas(
+        fh,
+        pagesize=page_size(sheet),
+        compress=pdf_profile.compress,
+        elide_state=pdf_profile.elide_state,
     )
 
-    c.setFillColor(ACCENT_COLOR)
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(margin + 0.1 * inch, y_position - 0.12 * inch, service_display)
 
-    c.setFont("Helvetica-Bold", 14)
-    c.drawRightString(
-        LABEL_4X6_WIDTH - margin - 0.1 * inch, y_position - 0.12 * inch, price_text
-    )
+def _label_file_name(label, seen, extension):
+    """File name from the order number, suffixed when it repeats in a batch."""
+    stem = get_valid_filename(label.order_no or "") or str(label.id)
+    name = f"{stem}.{extension}"
+    suffix = 1
+    while name in seen:
+        suffix += 1
+        name = f"{stem}-{suffix}.{extension}"
+    seen.add(name)
+    return name
 
-    y_position -= header_height + 0.25 * inch
 
-    # FROM section
-    c.setFillColor(TEXT_SECONDARY)
-    c.setFont("Helvetica-Bold", 8)
-    c.drawString(margin + 0.1 * inch, y_position, "SHIP FROM:")
-    y_position -= 0.2 * inch
+def _draw_label(c, ops, label):
+    """Apply one shipment's values to a compiled layout."""
+    logger.debug("Drawing label for shipment: %s", label.order_no or label.id)
 
-    if hasattr(shipment, "ship_from") and shipment.ship_from:
-        y_position = _draw_address_block(
-            c,
-            shipment.ship_from,
-            margin + 0.1 * inch,
-            y_position,
-            LABEL_4X6_WIDTH,
-            margin,
-            is_from=True,
-        )
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 8)
-        c.drawString(margin + 0.1 * inch, y_position, "No sender address provided")
-        y_position -= 0.18 * inch
+    for draw, when, unless, args in ops:
+        if when and not getattr(label, when):
+            continue
+        if unless and getattr(label, unless):
+            continue
+        draw(c, label, *args)
 
-    # Separator
-    y_position -= 0.15 * inch
-    c.setStrokeColor(HexColor("#dfe6e9"))
-    c.setLineWidth(1)
-    c.line(
-        margin + 0.1 * inch,
-        y_position,
-        LABEL_4X6_WIDTH - margin - 0.1 * inch,
-        y_position,
-    )
 
-    y_position -= 0.25 * inch
+def _draw_cell(c, cell, label):
+    """Draw one label into its cell on the sheet."""
+    ops, transform = cell
+    if transform is None:
+        _draw_label(c, ops, label)
+        return
 
-    # TO section
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(margin + 0.1 * inch, y_position, "DELIVER TO:")
-    y_position -= 0.25 * inch
+    c.saveState()
+    c.translate(transform.x, transform.y)
+    c.scale(transform.scale, transform.scale)
+    _draw_label(c, ops, label)
+    c.restoreState()
 
-    if hasattr(shipment, "ship_to") and shipment.ship_to:
-        y_position = _draw_address_block(
-            c,
-            shipment.ship_to,
-            margin + 0.1 * inch,
-            y_position,
-            LABEL_4X6_WIDTH,
-            margin,
-            is_from=False,
-        )
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 11)
-        c.drawString(margin + 0.1 * inch, y_position, "No recipient address provided")
-        y_position -= 0.22 * inch
 
-    # Package details
-    details_y = 1.9 * inch
-    c.setStrokeColor(HexColor("#dfe6e9"))
-    c.setLineWidth(1)
-    c.line(
-        margin + 0.1 * inch,
-        details_y + 0.5 * inch,
-        LABEL_4X6_WIDTH - margin - 0.1 * inch,
-        details_y + 0.5 * inch,
-    )
+@lru_cache(maxsize=None)
+def _pdf_cells(sheet, forms=False):
+    """
+    Per page position: layout operations bound to canvas draw functions, and
+    the cell transform still to apply (None when the label is drawn at full
+    size, in which case the position is compiled into the operations).
 
-    if hasattr(shipment, "package") and shipment.package:
-        pkg = shipment.package
-        c.setFillColor(TEXT_PRIMARY)
-        c.setFont("Helvetica-Bold", 9)
-        c.drawString(margin + 0.1 * inch, details_y + 0.25 * inch, "Weight:")
+    With ``forms``, the operations that draw the same thing on every label
+    are gathered into one form painted first, and sender blocks are drawn
+    through per-address forms.
+    """
+    layout = SHEETS[sheet].layout
+    cells = []
+    for index, cell in enumerate(impose(sheet)):
+        if cell.scale == 1:
+            ops = compile_layout(layout, (cell.x, cell.y))
+            transform = None
+            # Operations carry the cell position, so forms are per position
+            key = (sheet, index)
+        else:
+            ops = compile_layout(layout)
+            transform = cell
+            key = (sheet,)
+        cells.append((_bind_forms(ops, key) if forms else _bind(ops), transform))
+    return tuple(cells)
+
+
+def _bind(ops):
+    return tuple((_PDF_DRAW[op.kind], op.when, op.unless, op.args) for op in ops)
+
+
+def _bind_forms(ops, key):
+    static = []
+    dynamic = []
+    for op in ops:
+        # A filled box after per-label content stays in place so that it
+        # does not end up underneath what it used to cover
+        if _is_static(op) and not (dynamic and op.kind == "box" and op.args[-1] is not None):
+            static.append(op)
+        elif op.kind == "address" and op.args[-1]:
+            dynamic.append(Op("sender", op.when, op.unless, (key,) + op.args))
+        else:
+            dynamic.append(op)
+
+    bound = [(_PDF_DRAW[op.kind], op.when, op.unless, op.args) for op in dynamic]
+    if static:
+        bound.insert(0, (_pdf_form, None, None, (key + ("static",), _bind(static))))
+    return tuple(bound)
+
+
+def _is_static(op):
+    if op.when or op.unless:
+        return False
+    if op.kind == "text":
+        return op.args[5] is None  # no slot
+    return op.kind in ("box", "rule")
+
+
+def _pdf_form(c, label, key, ops):
+    if not c.has_form(key):
+        c.begin_form(key)
+        _draw_label(c, ops, label)
+        c.end_form()
+    c.draw_form(key)
+
+
+def _pdf_box(c, label, x, y, width, height, line_width, stroke, fill):
+    if fill is not None:
+        c.setFillColor(fill)
+    if stroke is not None:
+        c.setStrokeColor(stroke)
+        c.setLineWidth(line_width)
+    c.rect(x, y, width, height, stroke=stroke is not None, fill=fill is not None)
+
+
+def _pdf_rule(c, label, x1, x2, y, line_width, color):
+    c.setStrokeColor(color)
+    c.setLineWidth(line_width)
+    c.line(x1, y, x2, y)
+
+
+def _pdf_text(c, label, x, y, font, size, text, slot, color, align):
+    if slot:
+        text = LABEL_TEXT_SLOTS[slot](label)
+    c.setFillColor(color)
+    c.setFont(font, size)
+    if align == "right":
+        c.drawRightString(x, y, text)
+    elif align == "center":
+        c.drawCentredString(x, y, text)
+    else:
+        c.drawString(x, y, text)
 
-        c.setFont("Helvetica", 9)
-        weight_text = (
-            f"{getattr(pkg, 'weight_lbs', 0)} lb {getattr(pkg, 'weight_oz', 0)} oz"
-        )
-        c.drawString(margin + 0.55 * inch, details_y + 0.25 * inch, weight_text)
 
-        c.setFont("Helvetica-Bold", 9)
-        c.drawString(margin + 0.1 * inch, details_y, "Dimensions:")
+def _pdf_address(c, label, x, y, field, size, leading, is_from):
+    """Draw address block with consistent formatting."""
+    for kind, text in address_lines(getattr(label, field), is_from=is_from):
+        if kind == "name":
+            c.setFillColor(TEXT_PRIMARY)
+            c.setFont("Helvetica-Bold", size)
+        elif kind == "phone":
+            c.setFont("Helvetica", size - 1)
+            c.setFillColor(TEXT_SECONDARY)
+        else:
+            c.setFont("Helvetica", size)
 
-        c.setFont("Helvetica", 9)
-        dim_text = f"{getattr(pkg, 'length_inches', '?')} × {getattr(pkg, 'width_inches', '?')} × {getattr(pkg, 'height_inches', '?')} in"
-        c.drawString(margin + 0.75 * inch, details_y, dim_text)
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 8)
-        c.drawString(
-            margin + 0.1 * inch, details_y + 0.1 * inch, "Package details not provided"
-        )
+        c.drawString(x, y, text)
+        y -= leading
 
-    # Footer - Order & Barcode
-    footer_y = 1.2 * inch
-    order_text = (
-        f"Order: {shipment.order_no}"
-        if hasattr(shipment, "order_no") and shipment.order_no
-        else f"Shipment #{getattr(shipment, 'id', 'UNKNOWN')}"
-    )
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", 10)
-    c.drawCentredString(LABEL_4X6_WIDTH / 2, footer_y, order_text)
 
-    tracking_number = _generate_tracking_number(shipment)
+def _pdf_sender(c, label, key, x, y, field, size, leading, is_from):
+    """Sender address through a form shared by labels from the same sender."""
+    form_key = key + (getattr(label, field),)
+    if not c.has_form(form_key):
+        if c.form_count >= SENDER_FORM_LIMIT:
+            _pdf_address(c, label, x, y, field, size, leading, is_from)
+            return
+        c.begin_form(form_key)
+        _pdf_address(c, label, x, y, field, size, leading, is_from)
+        c.end_form()
+    c.draw_form(form_key)
 
-    barcode_width = 2.8 * inch
-    barcode_height = 0.6 * inch
-    barcode_x = (LABEL_4X6_WIDTH - barcode_width) / 2
-    barcode_y = 0.35 * inch
 
+def _pdf_barcode(c, label, x, y, width, height, bar_width):
+    tracking_number = label.tracking_number
     try:
-        barcode = code128.Code128(
-            tracking_number, barHeight=barcode_height, barWidth=1.2
-        )
-        barcode.drawOn(c, barcode_x, barcode_y)
-        logger.debug("Barcode generated successfully for tracking: %s", tracking_number)
-    except Exception as barcode_err:
+        _draw_code128(c, tracking_number, x, y, height, bar_width)
+    except ValueError as barcode_err:
         logger.warning("Failed to generate Code128 barcode: %s", str(barcode_err))
         c.setStrokeColor(BORDER_COLOR)
         c.setLineWidth(1)
-        c.rect(barcode_x, barcode_y, barcode_width, barcode_height, fill=0, stroke=1)
+        c.rect(x, y, width, height, fill=0, stroke=1)
         c.setFillColor(TEXT_SECONDARY)
         c.setFont("Courier-Bold", 8)
-        c.drawCentredString(
-            LABEL_4X6_WIDTH / 2,
-            barcode_y + barcode_height / 2,
-            f"|||  {tracking_number}  |||",
-        )
-
+        c.drawCentredString(x + width / 2, y + height / 2, f"|||  {tracking_number}  |||")
 
 
-def _draw_letter_label(c, shipment, position):
-    """Draw shipping label on Letter/A4 paper (top or bottom half)."""
-    logger.debug(
-        "Drawing letter label (position %d) for shipment: %s",
-        position,
-        getattr(shipment, "order_no", shipment.id),
-    )
+_PDF_DRAW = {
+    "box": _pdf_box,
+    "rule": _pdf_rule,
+    "text": _pdf_text,
+    "address": _pdf_address,
+    "sender": _pdf_sender,
+    "barcode": _pdf_barcode,
+}
 
-    label_height = LETTER_HEIGHT / 2
-    margin = 0.5 * inch
-    y_offset = LETTER_HEIGHT / 2 if position == 0 else 0
-    content_width = LETTER_WIDTH - (2 * margin)
-
-    # Draw border
-    c.setStrokeColor(BORDER_COLOR)
-    c.setLineWidth(2)
-    c.rect(margin, y_offset + 0.25 * inch, content_width, label_height - 0.5 * inch)
-
-    y_position = y_offset + label_height - margin - 0.3 * inch
-
-    # ═══════════════════════════════════════════════════
-    # HEADER SECTION - Service Type & Price
-    # ═══════════════════════════════════════════════════
-    header_height = 0.7 * inch
-    c.setFillColor(HEADER_BG)
-    c.rect(
-        margin + 0.1 * inch,
-        y_position - header_height + 0.25 * inch,
-        content_width - 0.2 * inch,
-        header_height,
-        fill=1,
-        stroke=0,
-    )
 
-    # Service name (left)
-    c.setFillColor(ACCENT_COLOR)
-    c.setFont("Helvetica-Bold", 16)
-    service_display = (
-        shipment.get_shipping_service_display()
-        if hasattr(shipment, "get_shipping_service_display")
-        else "Standard Shipping"
-    )
-    c.drawString(margin + 0.3 * inch, y_position - 0.2 * inch, service_display)
-
-    # Price (right)
-    c.setFont("Helvetica-Bold", 18)
-    price_text = f"${shipment.price:.2f}" if shipment.price else "$0.00"
-    c.drawRightString(
-        LETTER_WIDTH - margin - 0.3 * inch, y_position - 0.2 * inch, price_text
-    )
+def address_lines(address, is_from=False):
+    """
+    Build the printable lines of an address block.
 
-    y_position -= header_height + 0.35 * inch
-
-    # ═══════════════════════════════════════════════════
-    # Two-column layout: FROM (left) | TO (right)
-    # ═══════════════════════════════════════════════════
-    column_width = (content_width - 0.3 * inch) / 2
-    left_x = margin + 0.15 * inch
-    right_x = margin + column_width + 0.3 * inch
-
-    # FROM SECTION (Left Column)
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(left_x, y_position, "FROM:")
-
-    c.setStrokeColor(TEXT_SECONDARY)
-    c.setLineWidth(0.5)
-    c.line(
-        left_x + 0.5 * inch,
-        y_position + 0.05 * inch,
-        left_x + column_width - 0.15 * inch,
-        y_position + 0.05 * inch,
-    )
+    Returns:
+        list of (kind, text) tuples where kind is "name", "line" or "phone"
+    """
+    if address.first_name or address.last_name:
+        full_name = f"{address.first_name} {address.last_name}".strip()
+    else:
+        full_name = address.name or "RECIPIENT"
 
-    from_y = y_position - 0.3 * inch
+    lines = [("name", full_name[:50])]
 
-    if shipment.ship_from:
-        _draw_address_block(
-            c,
-            shipment.ship_from,
-            left_x,
-            from_y,
-            left_x + column_width,
-            margin,
-            is_from=True,
-            compact=True,
-        )
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 10)
-        c.drawString(left_x, from_y, "No sender address")
-
-    # TO SECTION (Right Column) - Larger and more prominent
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", 13)
-    c.drawString(right_x, y_position, "SHIP TO:")
-
-    c.setStrokeColor(ACCENT_COLOR)
-    c.setLineWidth(1)
-    c.line(
-        right_x + 0.7 * inch,
-        y_position + 0.08 * inch,
-        LETTER_WIDTH - margin - 0.15 * inch,
-        y_position + 0.08 * inch,
-    )
+    # Address lines
+    if address.address_line1:
+        lines.append(("line", address.address_line1[:55]))
 
-    to_y = y_position - 0.35 * inch
+    if address.address_line2.strip():
+        lines.append(("line", address.address_line2[:55]))
 
-    if shipment.ship_to:
-        _draw_address_block(
-            c,
-            shipment.ship_to,
-            right_x,
-            to_y,
-            LETTER_WIDTH,
-            margin,
-            is_from=False,
-            compact=False,
-        )
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 11)
-        c.drawString(right_x, to_y, "No recipient address")
-
-    # ═══════════════════════════════════════════════════
-    # PACKAGE DETAILS & ORDER INFO (Bottom section)
-    # ═══════════════════════════════════════════════════
-    bottom_y = y_offset + 1.5 * inch
-
-    c.setStrokeColor(TEXT_SECONDARY)
-    c.setLineWidth(0.5)
-    c.line(
-        margin + 0.1 * inch,
-        bottom_y + 0.7 * inch,
-        LETTER_WIDTH - margin - 0.1 * inch,
-        bottom_y + 0.7 * inch,
-    )
+    # City, State, ZIP
+    city_state_zip = (
+        f"{address.city.strip()}, {address.state.strip()} {address.zip_code.strip()}"
+    ).strip(", ")
+    if city_state_zip:
+        lines.append(("line", city_state_zip[:55]))
 
-    # Left side: Package details
-    if shipment.package:
-        pkg = shipment.package
-        total_oz = (pkg.weight_lbs * 16) + pkg.weight_oz
+    # Phone (optional, only for recipient addresses)
+    if not is_from and address.phone.strip():
+        lines.append(("phone", f"Tel: {address.phone[:20]}"))
 
-        c.setFillColor(TEXT_PRIMARY)
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(left_x, bottom_y + 0.45 * inch, "PACKAGE DETAILS:")
+    return lines
 
-        c.setFont("Helvetica", 10)
-        weight_text = f"Weight: {pkg.weight_lbs} lb {pkg.weight_oz} oz ({total_oz} oz)"
-        c.drawString(left_x, bottom_y + 0.2 * inch, weight_text)
 
-        dim_text = f"Dimensions: {pkg.length_inches} × {pkg.width_inches} × {pkg.height_inches} in"
-        c.drawString(left_x, bottom_y - 0.05 * inch, dim_text)
-    else:
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Helvetica-Oblique", 9)
-        c.drawString(left_x, bottom_y + 0.3 * inch, "Package details not provided")
-
-    # Right side: Order number
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", 11)
-    order_text = (
-        f"Order: {shipment.order_no}"
-        if shipment.order_no
-        else f"Shipment: #{shipment.id}"
-    )
-    c.drawString(right_x, bottom_y + 0.45 * inch, order_text)
+def _price_text(label):
+    """Formatted label price."""
+    if label.price is not None:
+        return f"${label.price:.2f}"
+    return "$0.00"
 
-    # Generate tracking number
-    tracking_number = _generate_tracking_number(shipment)
 
-    # Draw real barcode
-    barcode_width = 2.5 * inch
-    barcode_height = 0.5 * inch
-    barcode_x = right_x + 0.2 * inch
-    barcode_y = bottom_y - 0.15 * inch
+def _order_text(label):
+    """Order reference printed above the barcode."""
+    if label.order_no:
+        return f"Order: {label.order_no}"
+    return f"Shipment #{label.id}"
 
-    try:
-        # Create Code128 barcode
-        barcode = code128.Code128(
-            tracking_number, barHeight=barcode_height, barWidth=1.2
-        )
 
-        barcode.drawOn(c, barcode_x, barcode_y)
+def _weight_text(pkg):
+    return f"{pkg.weight_lbs} lb {pkg.weight_oz} oz"
 
-    except Exception:
-        # Fallback if barcode generation fails
-        c.setStrokeColor(BORDER_COLOR)
-        c.setLineWidth(1)
-        c.rect(barcode_x, barcode_y, barcode_width, barcode_height, fill=0, stroke=1)
-        c.setFillColor(TEXT_SECONDARY)
-        c.setFont("Courier-Bold", 8)
-        c.drawCentredString(
-            barcode_x + barcode_width / 2,
-            barcode_y + barcode_height / 2,
-            f"|||  {tracking_number}  |||",
-        )
 
+def _dimensions_text(pkg):
+    return f"{pkg.length_inches} × {pkg.width_inches} × {pkg.height_inches} in"
 
-def _draw_address_block(
-    c, address, x, y, page_width, margin, is_from=False, compact=False
-):
-    """Draw address block with consistent formatting."""
-    line_spacing = 0.15 * inch if is_from else 0.20 * inch
-    font_size = 8 if is_from else 11
 
-    # Name
-    c.setFillColor(TEXT_PRIMARY)
-    c.setFont("Helvetica-Bold", font_size)
+# Per-shipment values available to layout Text slots
+LABEL_TEXT_SLOTS = {
+    "service": lambda label: label.service,
+    "price": _price_text,
+    "order": _order_text,
+    "weight": lambda label: _weight_text(label.package),
+    "dimensions": lambda label: _dimensions_text(label.package),
+    "weight_detail": lambda label: (
+        f"Weight: {_weight_text(label.package)} "
+        f"({label.package.weight_lbs * 16 + label.package.weight_oz} oz)"
+    ),
+    "dimensions_detail": lambda label: f"Dimensions: {_dimensions_text(label.package)}",
+    "package_summary": lambda label: (
+        f"{_weight_text(label.package)}  ·  {_dimensions_text(label.package)}"
+    ),
+}
 
-    first_name = getattr(address, "first_name", "") or ""
-    last_name = getattr(address, "last_name", "") or ""
 
-    if first_name or last_name:
-        full_name = f"{first_name} {last_name}".strip()
-    else:
-        full_name = getattr(address, "name", "RECIPIENT") or "RECIPIENT"
+def _draw_code128(c, value, x, y, bar_height, bar_width):
+    """
+    Draw a Code128 symbol straight onto the canvas.
 
-    c.drawString(x, y, full_name[:50])
-    y -= line_spacing
+    Produces the same geometry as ``code128.Code128(...).drawOn(c, x, y)``
+    (including the left quiet zone) but emits every bar as a rect of one
+    filled path instead of going through the graphics widget layer.
+    Raises ValueError when the value cannot be encoded.
+    """
+    path = _code128_path(value)
 
-    # Address lines
-    c.setFont("Helvetica", font_size)
+    c.saveState()
+    c.translate(x + max(0.25 * inch, bar_width * 10.0), y)
+    c.scale(bar_width, bar_height)
+    c.setFillColor(black)
+    c.drawPath(path, stroke=0, fill=1)
+    c.restoreState()
 
-    if address.address_line1:
-        c.drawString(x, y, address.address_line1[:55])
-        y -= line_spacing
 
-    if address.address_line2 and address.address_line2.strip():
-        c.drawString(x, y, address.address_line2[:55])
-        y -= line_spacing
+@lru_cache(maxsize=CODE128_CACHE_SIZE)
+def _code128_path(value):
+    """
+    Cached path of all bars for ``value`` in module units (1 module wide,
+    1 unit tall). The caller positions and scales it on the canvas, so the
+    same path object is reused for every render of the same tracking number.
+    """
+    path = PDFPathObject()
+    left = 0
+    for index, run in enumerate(code128_runs(value)):
+        if index % 2 == 0:
+            path.rect(left, 0, run, 1)
+        left += run
+    return path
 
-    # City, State, ZIP
-    city = (address.city or "").strip()
-    state = (address.state or "").strip()
-    zip_code = (address.zip_code or "").strip()
 
-    city_state_zip = f"{city}, {state} {zip_code}".strip(", ")
-    if city_state_zip:
-        c.drawString(x, y, city_state_zip[:55])
-        y -= line_spacing
+@lru_cache(maxsize=CODE128_CACHE_SIZE)
+def code128_runs(value):
+    """
+    Encode ``value`` as Code128 and return its bar/space widths in modules.
 
-    # Phone (optional, only for recipient addresses)
-    if (
-        not is_from
-        and hasattr(address, "phone")
-        and address.phone
-        and address.phone.strip()
-    ):
-        c.setFont("Helvetica", font_size - 1)
-        c.setFillColor(TEXT_SECONDARY)
-        c.drawString(x, y, f"Tel: {address.phone[:20]}")
-        y -= line_spacing
+    The tuple alternates bar, space, bar, ... starting with a bar and excludes
+    quiet zones. Results are cached, so re-rendering a label skips encoding.
+    Raises ValueError when the value cannot be encoded.
+    """
+    symbol = code128.Code128(value)
+    symbol.validate()
+    if not symbol.valid:
+        raise ValueError(f"Cannot encode {value!r} as Code128")
+
+    symbol.encode()
+    symbol.decompose()
+    return tuple(
+        ord(ch) - (ord("A") if ch.isupper() else ord("a")) + 1
+        for ch in symbol.decomposed
+    )
 
-    return y
 
+def _generate_tracking_number(order_no, shipment_id, shipping_service):
+    """
+    Derive a tracking number from shipment data.
 
-def _generate_tracking_number(shipment):
-    """Generate consistent tracking number from shipment data."""
+    Only used for shipments purchased before tracking numbers were stored.
+    """
     import hashlib
 
-    base_id = str(
-        getattr(shipment, "order_no", None) or getattr(shipment, "id", "UNKNOWN")
-    )
+    base_id = str(order_no or shipment_id or "UNKNOWN")
     logger.debug("Generating tracking number from base_id: %s", base_id)
 
     hash_obj = hashlib.md5(base_id.encode())
     hash_hex = hash_obj.hexdigest()[:8].upper()
 
-    service_prefix = (
-        "PM" if getattr(shipment, "shipping_service", "") == "priority" else "GS"
-    )
+    service_prefix = "PM" if shipping_service == "priority" else "GS"
 
     tracking = f"{service_prefix}{hash_hex}"
 
@@ -555,3 +706,175 @@ def _generate_tracking_number(shipment):
     logger.debug("Generated tracking number: %s", final_tracking)
 
     return final_tracking
+
+
+# ═══════════════════════════════════════════════════
+# ZPL II output (Zebra and compatible thermal printers)
+# ═══════════════════════════════════════════════════
+ZPL_FORMATS = ["zpl"]
+ZPL_DPI = 203
+ZPL_BAR_MODULE = 3  # dots, ~1.2pt at 203 dpi like the PDF barcode
+
+
+def is_zpl_format(label_format):
+    """Return True when the batch label format asks for raw ZPL output."""
+    return (label_format or "").lower() in ZPL_FORMATS
+
+
+def iter_shipping_labels_zpl(shipments):
+    """
+    Generate ZPL II labels one shipment at a time.
+
+    ZPL keeps its own geometry in ``_build_zpl_label``, modelled on the 4x6
+    layout (``LAYOUTS["4x6"]`` in core/layouts.py) but not generated from it.
+    Each label is a self-contained ``^XA ... ^XZ`` block of a few hundred
+    bytes, so the output can be streamed straight to the client without
+    buffering the batch.
+
+    Args:
+        shipments: Iterable of LabelData or shipment objects
+
+    Yields:
+        bytes: UTF-8 encoded ZPL for a single label
+    """
+    count = 0
+    for shipment in shipments:
+        yield _build_zpl_label(as_label_data(shipment)).encode("utf-8")
+        count += 1
+
+    logger.info("ZPL generation completed for %d shipments", count)
+
+
+def _build_zpl_label(label):
+    """Build the ZPL II document for one 4x6 label."""
+    logger.debug("Building ZPL label for shipment: %s", label.order_no or label.id)
+
+    margin = 0.3 * inch
+    content_width = LABEL_4X6_WIDTH - (2 * margin)
+    left_x = margin + 0.1 * inch
+
+    cmds = [
+        "^XA",
+        "^CI28",
+        f"^PW{_zpl_dots(LABEL_4X6_WIDTH)}",
+        f"^LL{_zpl_dots(LABEL_4X6_HEIGHT)}",
+        "^LH0,0",
+    ]
+
+    # Outer border
+    cmds.append(
+        _zpl_box(margin / 2, margin / 2, LABEL_4X6_WIDTH - margin, LABEL_4X6_HEIGHT - margin, 3)
+    )
+
+    y_position = LABEL_4X6_HEIGHT - margin - 0.15 * inch
+
+    # Header - Service & Price
+    header_height = 0.5 * inch
+    cmds.append(
+        _zpl_box(margin, y_position - header_height + 0.15 * inch, content_width, header_height)
+    )
+    cmds.append(_zpl_text(left_x, y_position - 0.12 * inch, label.service, 12))
+    cmds.append(
+        _zpl_text(
+            margin,
+            y_position - 0.12 * inch,
+            _price_text(label),
+            14,
+            width=content_width - 0.1 * inch,
+            align="R",
+        )
+    )
+
+    y_position -= header_height + 0.25 * inch
+
+    # FROM section
+    cmds.append(_zpl_text(left_x, y_position, "SHIP FROM:", 8))
+    y_position -= 0.2 * inch
+
+    if label.ship_from:
+        for _, text in address_lines(label.ship_from, is_from=True):
+            cmds.append(_zpl_text(left_x, y_position, text, 8))
+            y_position -= 0.15 * inch
+    else:
+        cmds.append(_zpl_text(left_x, y_position, "No sender address provided", 8))
+        y_position -= 0.18 * inch
+
+    # Separator
+    y_position -= 0.15 * inch
+    cmds.append(_zpl_box(left_x, y_position, content_width - 0.2 * inch, 0, 2))
+    y_position -= 0.25 * inch
+
+    # TO section
+    cmds.append(_zpl_text(left_x, y_position, "DELIVER TO:", 11))
+    y_position -= 0.25 * inch
+
+    if label.ship_to:
+        for kind, text in address_lines(label.ship_to, is_from=False):
+            cmds.append(_zpl_text(left_x, y_position, text, 10 if kind == "phone" else 11))
+            y_position -= 0.20 * inch
+    else:
+        cmds.append(_zpl_text(left_x, y_position, "No recipient address provided", 11))
+
+    # Package details
+    details_y = 1.9 * inch
+    cmds.append(_zpl_box(left_x, details_y + 0.5 * inch, content_width - 0.2 * inch, 0, 2))
+
+    pkg = label.package
+    if pkg:
+        weight_text = f"Weight: {pkg.weight_lbs} lb {pkg.weight_oz} oz"
+        dim_text = (
+            f"Dimensions: {pkg.length_inches} x {pkg.width_inches} x {pkg.height_inches} in"
+        )
+        cmds.append(_zpl_text(left_x, details_y + 0.25 * inch, weight_text, 9))
+        cmds.append(_zpl_text(left_x, details_y, dim_text, 9))
+    else:
+        cmds.append(
+            _zpl_text(left_x, details_y + 0.1 * inch, "Package details not provided", 8)
+        )
+
+    # Footer - Order & Barcode
+    cmds.append(
+        _zpl_text(0, 1.2 * inch, _order_text(label), 10, width=LABEL_4X6_WIDTH, align="C")
+    )
+
+    tracking_number = label.tracking_number
+    barcode_height = 0.6 * inch
+    barcode_x = (LABEL_4X6_WIDTH - 2.8 * inch) / 2 + 0.25 * inch  # skip quiet zone
+    barcode_top = _zpl_dots(LABEL_4X6_HEIGHT - 0.35 * inch - barcode_height)
+    cmds.append(
+        f"^FO{_zpl_dots(barcode_x)},{barcode_top}"
+        f"^BY{ZPL_BAR_MODULE}^BCN,{_zpl_dots(barcode_height)},N,N,N"
+        f"^FH^FD{_zpl_escape(tracking_number)}^FS"
+    )
+
+    cmds.append("^XZ")
+    return "\n".join(cmds) + "\n"
+
+
+def _zpl_dots(points):
+    """Convert a length in PDF points to printer dots."""
+    return int(round(points / inch * ZPL_DPI))
+
+
+def _zpl_escape(text):
+    """Escape ZPL control characters in field data (used together with ^FH)."""
+    return str(text).replace("_", "_5F").replace("^", "_5E").replace("~", "_7E")
+
+
+def _zpl_box(x, y, width, height, thickness=2):
+    """Box (or horizontal rule when height is 0) at PDF coordinates."""
+    top = _zpl_dots(LABEL_4X6_HEIGHT - y - height)
+    return (
+        f"^FO{_zpl_dots(x)},{top}"
+        f"^GB{_zpl_dots(width)},{max(_zpl_dots(height), thickness)},{thickness}^FS"
+    )
+
+
+def _zpl_text(x, y, text, size, width=None, align="L"):
+    """Text field whose baseline sits at PDF coordinate ``(x, y)``."""
+    height = _zpl_dots(size)
+    top = max(_zpl_dots(LABEL_4X6_HEIGHT - y) - height, 0)
+    field = f"^FO{_zpl_dots(x)},{top}^A0N,{height},{height}"
+    if width:
+        field += f"^FB{_zpl_dots(width)},1,0,{align}"
+    return f"{field}^FH^FD{_zpl_escape(text)}^FS"
@@ -1,10 +1,17 @@
 import logging
 from decimal import Decimal
 from django.contrib.auth import get_user_model
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from core.models import Address, Package, Shipment
+from core.models import Address, Batch, Package, Shipment
+from core.response_cache import (
+    invalidate_batch_responses,
+    invalidate_related_responses,
+    invalidate_shipment_responses,
+)
+from core.search import queue_reindex, reindex_address
+from core.tasks import invalidate_batch_labels, invalidate_related_labels
 
 
 User = get_user_model()
@@ -117,5 +124,91 @@ def validate_and_price_shipment(sender, instance, **kwargs):
         shipment.package_id,
         shipment.error_message or "None"
     )
-    
-    
\ No newline at end of file
+
+
+@receiver([post_save, post_delete], sender=Batch)
+def invalidate_batch_cache(sender, instance, **kwargs):
+    invalidate_batch_responses(instance.pk, instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Shipment)
+def invalidate_shipment_cache(sender, instance, **kwargs):
+    invalidate_shipment_responses(instance)
+
+
+@receiver(post_save, sender=Address)
+def invalidate_address_cache(sender, instance, created, **kwargs):
+    # A new address is not referenced by any shipment yet
+    if not created:
+        invalidate_related_responses(address=instance)
+
+
+@receiver(post_save, sender=Package)
+def invalidate_package_cache(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_related_responses(package=instance)
+
+
+# Rendered label artifacts of purchased batches (see core.tasks)
+@receiver([post_save, post_delete], sender=Shipment)
+def invalidate_shipment_labels(sender, instance, **kwargs):
+    if instance.batch_id:
+        invalidate_batch_labels([instance.batch_id])
+
+
+@receiver(post_save, sender=Address)
+def invalidate_address_labels(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_related_labels(address=instance)
+
+
+@receiver(post_save, sender=Package)
+def invalidate_package_labels(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_related_labels(package=instance)
+
+
+# Deleting nulls the shipments' foreign keys with a queryset update, after
+# which the affected batches can no longer be found; look them up first
+@receiver(pre_delete, sender=Address)
+def invalidate_deleted_address_labels(sender, instance, **kwargs):
+    invalidate_related_labels(address=instance)
+
+
+@receiver(pre_delete, sender=Package)
+def invalidate_deleted_package_labels(sender, instance, **kwargs):
+    invalidate_related_labels(package=instance)
+
+
+# Columns of the shipment search index (see core.search)
+SEARCH_SHIPMENT_FIELDS = {"order_no", "ship_to"}
+SEARCH_ADDRESS_FIELDS = {
+    "name", "first_name", "last_name", "address_line1", "address_line2", "city", "state",
+}
+
+
+@receiver(post_save, sender=Shipment)
+def index_shipment_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_SHIPMENT_FIELDS & set(update_fields):
+        queue_reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Shipment)
+def unindex_shipment_search(sender, instance, **kwargs):
+    queue_reindex([instance.pk])
+
+
+@receiver(post_save, sender=Address)
+def index_address_search(sender, instance, created, update_fields=None, **kwargs):
+    # A new address has no shipments yet
+    if created:
+        return
+    if update_fields is None or SEARCH_ADDRESS_FIELDS & set(update_fields):
+        reindex_address(instance.pk)
+
+
+# Deleting an address nulls ship_to with a queryset update, which sends no
+# signals; queue its shipments while they can still be found
+@receiver(pre_delete, sender=Address)
+def index_deleted_address_search(sender, instance, **kwargs):
+    reindex_address(instance.pk)
@@ -0,0 +1,344 @@
+import logging
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from common.utils.oncommit import collect_on_commit
+from common.utils.zipstream import iter_zip
+from core.models import Batch, Shipment
+from core.raster import is_raster_format, iter_shipping_labels_png
+from core.response_cache import invalidate_batch_responses
+from core.services import (
+    is_zpl_format,
+    iter_shipping_labels_zpl,
+    label_data_from_queryset,
+    write_shipping_labels_pdf,
+)
+
+logger = logging.getLogger(__name__)
+
+LABEL_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "zpl": "application/x-zpl",
+    "zip": "application/zip",
+}
+
+# On-demand renders of shipment selections, one directory per batch
+SELECTIONS_DIR = "labels/selections"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def enqueue_label_render(batch_id):
+    """
+    Schedule a background render of a batch's labels.
+
+    The job is submitted once the surrounding transaction commits, so the
+    worker always sees the purchased batch. Enqueueing a batch that is
+    already rendering or ready is a no-op.
+    """
+    transaction.on_commit(lambda: _submit(batch_id))
+
+
+def invalidate_batch_labels(batch_ids):
+    """
+    Discard the rendered labels of purchased batches whose shipments changed.
+
+    Once the transaction commits, each affected batch is reset to pending,
+    its stored artifact deleted and a fresh render queued. A render already
+    running for it loses its claim and drops its output (see
+    ``render_batch_labels``). Batches are collected per transaction, so
+    saving many shipments costs one query.
+
+    Args:
+        batch_ids: Primary keys of batches whose shipment data changed
+    """
+    collect_on_commit(_reset_labels, batch_ids)
+
+
+def invalidate_related_labels(**relation):
+    """
+    Discard the labels of purchased batches using an address or package.
+
+    Args:
+        relation: ``address=`` or ``package=`` instance
+    """
+    if "address" in relation:
+        address = relation["address"]
+        shipments = Shipment.objects.filter(Q(ship_from=address) | Q(ship_to=address))
+    else:
+        shipments = Shipment.objects.filter(package=relation["package"])
+    batch_ids = (
+        shipments.filter(batch__status="purchased").values_list("batch_id", flat=True).distinct()
+    )
+    invalidate_batch_labels(list(batch_ids))
+
+
+def store_label_selection(batch, shipments, key):
+    """
+    Render a PDF of selected shipments to storage and return its name.
+
+    The file is named by ``key``, which must change whenever the content
+    does, and is reused while it exists. A batch's selections are deleted
+    when its labels go out of date (see ``invalidate_batch_labels``).
+
+    Args:
+        batch: Purchased batch the shipments belong to
+        shipments: Shipment queryset in print order
+        key: Filesystem-safe identifier of the selection and its content
+    """
+    storage = _labels_storage()
+    name = f"{SELECTIONS_DIR}/{batch.id}/{key}.pdf"
+    if storage.exists(name):
+        return name
+    with tempfile.TemporaryFile() as fh:
+        write_shipping_labels_pdf(
+            label_data_from_queryset(shipments), fh, label_format=batch.label_format
+        )
+        fh.seek(0)
+        return storage.save(name, File(fh))
+
+
+def render_batch_labels(batch_id):
+    """
+    Render the label artifact for a batch and store it on ``labels_file``.
+
+    Claims the batch by moving it from pending/failed to rendering, so
+    concurrent jobs for the same batch do not render twice. A rendering
+    claim older than ``LABEL_RENDER_STALE_SECONDS`` belongs to a render that
+    died with its process and is taken over the same way. A render whose
+    claim was reset by ``invalidate_batch_labels`` meanwhile drops its output.
+
+    Returns:
+        bool: True if this call rendered and stored the labels
+    """
+    now = timezone.now()
+    claimed = Batch.objects.filter(_claimable(now), pk=batch_id).update(
+        labels_status="rendering",
+        labels_render_started_at=now,
+        labels_error="",
+        updated_at=now,
+    )
+    if not claimed:
+        logger.debug("Label render skipped, batch not pending | batch=%s", batch_id)
+        return False
+    invalidate_batch_responses(batch_id)
+
+    batch = Batch.objects.get(pk=batch_id)
+    started = time.perf_counter()
+
+    logger.info(
+        "Label render started | batch=%s | format=%s", batch.id, batch.label_format
+    )
+
+    try:
+        shipments = batch.shipments.order_by("id")
+
+        with tempfile.TemporaryFile() as fh:
+            extension, bytes_saved = _write_labels(shipments, batch.label_format, fh)
+            fh.seek(0)
+            if batch.labels_file:
+                batch.labels_file.delete(save=False)
+            batch.labels_file.save(
+                f"labels-batch-{batch.id}.{extension}", File(fh), save=False
+            )
+
+        batch.labels_rendered_at = timezone.now()
+        batch.labels_render_seconds = time.perf_counter() - started
+        # Only while the claim is still ours: if the shipments changed during
+        # the render, invalidate_batch_labels reset the batch and this output
+        # is already stale
+        kept = _claimed(batch_id, now).update(
+            labels_status="ready",
+            labels_file=batch.labels_file.name,
+            labels_rendered_at=batch.labels_rendered_at,
+            labels_render_seconds=batch.labels_render_seconds,
+            labels_bytes_saved=bytes_saved,
+            updated_at=batch.labels_rendered_at,
+        )
+        if not kept:
+            batch.labels_file.delete(save=False)
+            logger.info("Label render discarded, batch changed while rendering | batch=%s", batch.id)
+            return False
+        invalidate_batch_responses(batch.pk, batch.user_id)
+
+        logger.info(
+            "Label render completed | batch=%s | file=%s | duration=%.3fs | bytes_saved=%s",
+            batch.id, batch.labels_file.name, batch.labels_render_seconds, bytes_saved
+        )
+        return True
+
+    except Exception as exc:
+        logger.error(
+            "Label render failed | batch=%s | error=%s", batch.id, str(exc), exc_info=True
+        )
+        _claimed(batch_id, now).update(
+            labels_status="failed",
+            labels_error=str(exc),
+            labels_render_seconds=time.perf_counter() - started,
+            updated_at=timezone.now(),
+        )
+        invalidate_batch_responses(batch.pk, batch.user_id)
+        return False
+
+
+def can_claim_label_render(batch):
+    """
+    Return True when a render of ``batch`` may be started.
+
+    Mirrors the conditional update in ``render_batch_labels``: the batch is
+    pending, failed, or its rendering claim has gone stale.
+    """
+    if batch.labels_status in ("pending", "failed"):
+        return True
+    if batch.labels_status != "rendering":
+        return False
+    started = batch.labels_render_started_at
+    return started is None or started < _stale_before(timezone.now())
+
+
+def wait_for_label_render(batch_id, timeout, poll_interval=0.25):
+    """
+    Wait for a batch render that is already in progress to finish.
+
+    Lets a download that arrives while another request's render is running
+    share that render instead of being told to retry.
+
+    Returns:
+        str: labels_status once it is no longer rendering, or "rendering"
+        if the timeout expired
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        labels_status = (
+            Batch.objects.filter(pk=batch_id).values_list("labels_status", flat=True).first()
+        )
+        if labels_status != "rendering" or time.monotonic() >= deadline:
+            return labels_status
+        time.sleep(poll_interval)
+
+
+def _claimable(now):
+    # Claims made before labels_render_started_at existed count as stale
+    return Q(labels_status__in=["pending", "failed"]) | Q(
+        Q(labels_render_started_at__isnull=True)
+        | Q(labels_render_started_at__lt=_stale_before(now)),
+        labels_status="rendering",
+    )
+
+
+def _stale_before(now):
+    return now - timedelta(seconds=settings.LABEL_RENDER_STALE_SECONDS)
+
+
+def _claimed(batch_id, started_at):
+    # The batch, if the render claim made at started_at still holds
+    return Batch.objects.filter(
+        pk=batch_id, labels_status="rendering", labels_render_started_at=started_at
+    )
+
+
+def _labels_storage():
+    return Batch._meta.get_field("labels_file").storage
+
+
+def _reset_labels(batch_ids):
+    purchased = Batch.objects.filter(pk__in=batch_ids, status="purchased")
+    storage = _labels_storage()
+    for batch_id in purchased.values_list("pk", flat=True):
+        _delete_selections(storage, batch_id)
+
+    # Pending batches without an artifact render from current data anyway
+    stale = list(
+        purchased.exclude(
+            Q(labels_file="") | Q(labels_file__isnull=True), labels_status="pending"
+        ).values_list("pk", "user_id", "labels_file")
+    )
+    if not stale:
+        return
+    Batch.objects.filter(pk__in=[batch_id for batch_id, _, _ in stale]).update(
+        labels_status="pending",
+        labels_file=None,
+        labels_render_started_at=None,
+        labels_error="",
+        updated_at=timezone.now(),
+    )
+    for batch_id, user_id, name in stale:
+        logger.info("Labels out of date, re-rendering | batch=%s", batch_id)
+        if name:
+            storage.delete(name)
+        invalidate_batch_responses(batch_id, user_id)
+        _submit(batch_id)
+
+
+def _delete_selections(storage, batch_id):
+    directory = f"{SELECTIONS_DIR}/{batch_id}"
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        storage.delete(f"{directory}/{name}")
+
+
+def _write_labels(shipments, label_format, fh):
+    """
+    Write labels in the batch format to ``fh``.
+
+    Returns:
+        tuple: (file extension, bytes saved by the PDF profile or None)
+    """
+    labels = label_data_from_queryset(shipments)
+
+    if is_zpl_format(label_format):
+        for chunk in iter_shipping_labels_zpl(labels):
+            fh.write(chunk)
+        return "zpl", None
+
+    if is_raster_format(label_format):
+        # Background renders run on a thread, and forking a process pool
+        # from a threaded process can deadlock the children; render in-process
+        images = iter_shipping_labels_png(labels, workers=1)
+        for chunk in iter_zip(images, compression=zipfile.ZIP_STORED):
+            fh.write(chunk)
+        return "zip", None
+
+    stats = write_shipping_labels_pdf(labels, fh, label_format=label_format)
+    return "pdf", stats.bytes_saved
+
+
+def _submit(batch_id):
+    if not settings.LABEL_RENDER_ASYNC:
+        render_batch_labels(batch_id)
+        return
+
+    _get_executor().submit(_run_in_worker, batch_id)
+
+
+def _run_in_worker(batch_id):
+    try:
+        render_batch_labels(batch_id)
+    finally:
+        # Worker threads get their own DB connections; don't leak them
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LABEL_RENDER_THREADS,
+                thread_name_prefix="label-render",
+            )
+        return _executor
@@ -1,18 +1,50 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from datetime import timedelta
 from decimal import Decimal
+from unittest.mock import patch
+from PIL import Image
+import io
+import json
 import os
+import pickle
+import tempfile
+import threading
+import zipfile
 
+from common.utils.singleflight import single_flight
+from . import layouts, services, tasks
+from .raster import iter_shipping_labels_png, render_label_png
+from .search import reindex_shipments
+from .tasks import render_batch_labels
 from .models import Batch, Shipment, Address, Package
 
 User = get_user_model()
 
+# Query-count assertions are about ORM queries, so most tests use a
+# process-local cache; tests of cross-worker behaviour use SHARED_CACHE
+LOCAL_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+SHARED_CACHE = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "django_cache",
+    }
+}
 
+
+@override_settings(CACHES=LOCAL_CACHE)
 class BaseAPITestCase(TestCase):
     def setUp(self):
+        # Cached responses are keyed by ids, which are reused between tests
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(
             email="testuser@example.com",
@@ -109,6 +141,7 @@ dummy_row_skip1,dummy
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+@override_settings(LABEL_RENDER_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp())
 class BatchViewSetTests(BaseAPITestCase):
     def setUp(self):
         super().setUp()
@@ -127,12 +160,142 @@ class BatchViewSetTests(BaseAPITestCase):
         self.shipment.calculate_price()
         self.shipment.save(update_fields=["price"])
 
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_batch_responses_are_cached_until_written(self):
+        list_url = reverse("batch-list")
+        detail_url = reverse("batch-detail", kwargs={"pk": self.batch.pk})
+        self.client.get(list_url)
+        self.client.get(detail_url)
+
+        # Hits touch the shared cache table only, never the app's tables
+        with CaptureQueriesContext(connection) as context:
+            listed = self.client.get(list_url)
+            detail = self.client.get(detail_url)
+        for query in context.captured_queries:
+            self.assertNotIn('"core_', query["sql"])
+        self.assertEqual(listed.json()["results"][0]["name"], "API Test Batch")
+        self.assertEqual(detail.json()["name"], "API Test Batch")
+
+        # Saving the batch shows up on the next read once it commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.batch.name = "Renamed Batch"
+            self.batch.save()
+        self.assertEqual(self.client.get(list_url).json()["results"][0]["name"], "Renamed Batch")
+        self.assertEqual(self.client.get(detail_url).json()["name"], "Renamed Batch")
+
+        # So do shipment changes, including the bulk update endpoint
+        other = Package.objects.create(
+            name="Large Box",
+            length_inches=Decimal("20.00"),
+            width_inches=Decimal("16.00"),
+            height_inches=Decimal("12.00"),
+            weight_lbs=6,
+            weight_oz=0,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("bulk-update", kwargs={"batch_id": self.batch.pk}),
+                {"action": "change_package", "package_id": other.pk, "shipment_ids": [str(self.shipment.pk)]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        detail = self.client.get(detail_url).json()
+        self.assertEqual(detail["shipments"][0]["package"]["name"], "Large Box")
+
+        # Another user never sees this user's cached list
+        intruder = User.objects.create_user(email="other@example.com", password="testpass123")
+        self.client.force_authenticate(user=intruder)
+        self.assertEqual(self.client.get(list_url).json()["results"], [])
+        self.assertEqual(self.client.get(detail_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_writes_bump_each_scope_once_per_transaction(self):
+        with patch("core.response_cache._bump") as bump:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(50):
+                    Shipment.objects.create(batch=self.batch, order_no=f"BUMP-{i}")
+                self.batch.save()
+                bump.assert_not_called()
+
+        bump.assert_called_once()
+        self.assertCountEqual(
+            bump.call_args.args[0], [f"batch:{self.batch.pk}", f"user:{self.user.pk}"]
+        )
+
+    def test_batch_responses_are_not_cached_in_a_process_local_cache(self):
+        url = reverse("batch-list")
+        self.client.get(url)
+        # Other workers could not see an invalidation, so every read is fresh
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
     def test_list_batches(self):
         url = reverse("batch-list")
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data["results"]), 1)
 
+    def test_stats_come_from_one_grouped_query(self):
+        heavy = Package.objects.create(
+            name="Crate",
+            length_inches=Decimal("20.00"),
+            width_inches=Decimal("20.00"),
+            height_inches=Decimal("20.00"),
+            weight_lbs=25,
+            weight_oz=0,
+        )
+        loose = Shipment.objects.create(batch=self.batch, order_no="STATS-1")
+        crated = Shipment.objects.create(batch=self.batch, order_no="STATS-2", package=heavy)
+        # Set directly, the pre_save signal would recompute them
+        Shipment.objects.filter(pk=loose.pk).update(status="incomplete", price=Decimal("0.00"))
+        Shipment.objects.filter(pk=crated.pk).update(
+            status="error", shipping_service="priority", price=Decimal("2.50")
+        )
+        Shipment.objects.filter(pk=self.shipment.pk).update(status="valid", price=Decimal("7.25"))
+
+        url = reverse("batch-stats", kwargs={"pk": self.batch.pk})
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = response.json()
+        self.assertEqual(data["shipment_count"], 3)
+        self.assertEqual(data["total_price"], "9.75")
+        self.assertEqual(data["by_status"]["valid"], {"count": 1, "total_price": "7.25"})
+        self.assertEqual(data["by_status"]["incomplete"]["count"], 1)
+        self.assertEqual(data["by_status"]["error"], {"count": 1, "total_price": "2.50"})
+        self.assertEqual(data["by_service"]["priority"], {"count": 2, "total_price": "9.75"})
+        self.assertEqual(data["by_service"]["ground"], {"count": 1, "total_price": "0.00"})
+        self.assertEqual(
+            data["weight_buckets"],
+            {"0-1 lb": 0, "1-5 lb": 1, "5-20 lb": 0, "20+ lb": 1, "no package": 1},
+        )
+
+    def test_list_batches_is_a_summary_in_constant_queries(self):
+        for i in range(3):
+            batch = Batch.objects.create(user=self.user, name=f"Bulk {i}")
+            for j in range(5):
+                Shipment.objects.create(
+                    batch=batch, order_no=f"BULK-{i}-{j}", ship_to=self.address,
+                    package=self.package,
+                )
+        # Saving validates the shipment, so set price and status directly
+        bulk = Shipment.objects.filter(order_no__startswith="BULK-")
+        bulk.update(price=Decimal("2.50"), status="valid")
+        bulk.filter(order_no__endswith="-0").update(status="error")
+
+        url = reverse("batch-list")
+        # Page and pagination count
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        bulk = next(b for b in response.data["results"] if b["name"] == "Bulk 0")
+        self.assertNotIn("shipments", bulk)
+        self.assertEqual(bulk["shipment_count"], 5)
+        self.assertEqual(bulk["shipments_total"], "12.50")
+        self.assertEqual(bulk["status_counts"], {"valid": 4, "incomplete": 0, "error": 1})
+
     def test_retrieve_batch(self):
         url = reverse("batch-detail", kwargs={"pk": self.batch.pk})
         response = self.client.get(url)
@@ -152,6 +315,25 @@ class BatchViewSetTests(BaseAPITestCase):
         self.assertEqual(self.batch.status, "purchased")
         self.assertEqual(self.batch.label_format, "4x6")
 
+        self.shipment.refresh_from_db()
+        self.assertRegex(self.shipment.tracking_number, r"^PM\d{11}$")
+
+    def test_purchase_allocates_distinct_tracking_numbers(self):
+        other = Batch.objects.create(user=self.user, status="shipping_selected")
+        Shipment.objects.create(batch=other, order_no="TEST-ORD-001")
+
+        for batch in (self.batch, other):
+            url = reverse("batch-purchase", kwargs={"pk": batch.pk})
+            self.client.post(url, {"label_format": "4x6"}, format="json")
+
+        numbers = list(
+            Shipment.objects.filter(order_no="TEST-ORD-001").values_list(
+                "tracking_number", flat=True
+            )
+        )
+        self.assertEqual(len(numbers), 2)
+        self.assertEqual(len(set(numbers)), 2)
+
     def test_cannot_purchase_already_purchased(self):
         self.batch.status = "purchased"
         self.batch.save()
@@ -162,6 +344,229 @@ class BatchViewSetTests(BaseAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("already purchased", str(response.data).lower())
 
+    def download_rendered_labels(self):
+        """First request queues the render (run inline here), the retry serves it."""
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = self.client.get(url)
+
+        self.assertEqual(pending.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn("Retry-After", pending)
+        return self.client.get(url)
+
+    def test_purchase_prerenders_labels(self):
+        self.batch.status = "shipping_selected"
+        self.batch.save()
+
+        url = reverse("batch-purchase", kwargs={"pk": self.batch.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"label_format": "4x6"}, format="json")
+
+        self.assertEqual(response.data["labels_status"], "pending")
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.labels_status, "ready")
+        self.assertIsNotNone(self.batch.labels_render_seconds)
+        self.assertIsNotNone(self.batch.labels_bytes_saved)
+
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+
+    def test_stale_rendering_claim_is_taken_over(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "4x6"
+        self.batch.save()
+        # A render whose process died an hour ago, never to finish
+        Batch.objects.filter(pk=self.batch.pk).update(
+            labels_status="rendering",
+            labels_render_started_at=timezone.now() - timedelta(hours=1),
+        )
+
+        with patch("core.views.wait_for_label_render") as wait:
+            response = self.download_rendered_labels()
+        wait.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.labels_status, "ready")
+
+        # A fresh claim is left to its render
+        Batch.objects.filter(pk=self.batch.pk).update(
+            labels_status="rendering", labels_render_started_at=timezone.now()
+        )
+        self.assertFalse(render_batch_labels(self.batch.pk))
+
+    def test_download_labels_zpl(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "zpl"
+        self.batch.save()
+
+        response = self.download_rendered_labels()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-zpl")
+        body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.startswith("^XA"))
+        self.assertIn("^BCN", body)
+        self.assertIn("TEST-ORD-001", body)
+        self.assertTrue(body.rstrip().endswith("^XZ"))
+
+    def test_edits_after_purchase_rerender_labels(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "zpl"
+        self.batch.save()
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        self.download_rendered_labels()
+
+        # The stale artifact is dropped and re-rendered once the edit commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shipment.order_no = "TEST-ORD-EDITED"
+            self.shipment.save()
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.labels_status, "ready")
+        # The old file was deleted, not left behind next to the new one
+        _, files = self.batch.labels_file.storage.listdir("labels")
+        self.assertEqual(
+            [name for name in files if name.startswith(f"labels-batch-{self.batch.pk}.")],
+            [os.path.basename(self.batch.labels_file.name)],
+        )
+        body = b"".join(self.client.get(url).streaming_content).decode()
+        self.assertIn("TEST-ORD-EDITED", body)
+        self.assertNotIn("TEST-ORD-001", body)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.city = "Mombasa"
+            self.address.save()
+        body = b"".join(self.client.get(url).streaming_content).decode()
+        self.assertIn("Mombasa", body)
+
+    def test_render_overtaken_by_an_edit_is_discarded(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "zpl"
+        self.batch.save()
+        write_labels = tasks._write_labels
+
+        def edit_while_rendering(*args):
+            result = write_labels(*args)
+            # The shipments change; reset without starting the follow-up render
+            with patch("core.tasks._submit"):
+                tasks._reset_labels({self.batch.pk})
+            return result
+
+        with patch("core.tasks._write_labels", side_effect=edit_while_rendering):
+            self.assertFalse(render_batch_labels(self.batch.pk))
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.labels_status, "pending")
+        self.assertFalse(self.batch.labels_file)
+
+    def test_download_labels_selection(self):
+        for i in range(4):
+            Shipment.objects.create(
+                batch=self.batch,
+                ship_to=self.address,
+                package=self.package,
+                order_no=f"SEL-{i}",
+            )
+        self.batch.status = "purchased"
+        self.batch.label_format = "zpl"
+        self.batch.save()
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+
+        response = self.client.get(url, {"range": "1-2"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("^XA"), 2)
+
+        response = self.client.get(url, {"ids": str(self.shipment.pk)})
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("^XA"), 1)
+        self.assertIn("TEST-ORD-001", body)
+
+        response = self.client.get(url, {"range": "10-20"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(url, {"shipment_status": "bogus"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("shipment_status", response.data)
+
+    def test_download_labels_zip_per_shipment(self):
+        for order_no in ("ZIP-1", "ZIP-1", "ZIP/2"):
+            Shipment.objects.create(batch=self.batch, ship_to=self.address, order_no=order_no)
+        self.batch.status = "purchased"
+        self.batch.label_format = "4x6"
+        self.batch.save()
+
+        url = reverse("batch-download-labels-zip", kwargs={"pk": self.batch.pk})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            ["TEST-ORD-001.pdf", "ZIP-1-2.pdf", "ZIP-1.pdf", "ZIP2.pdf"],
+        )
+        self.assertTrue(archive.read("ZIP-1.pdf").startswith(b"%PDF"))
+
+    def test_download_labels_selection_pdf(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "letter"
+        self.batch.save()
+
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        selection = {"shipment_status": self.shipment.status}
+        response = self.client.get(url, selection)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pdf = b"".join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b"%PDF"))
+
+        # The render is kept in storage, so only its name goes through the
+        # cache and a repeat streams the same file
+        storage = self.batch.labels_file.storage
+        directory = f"{tasks.SELECTIONS_DIR}/{self.batch.pk}"
+        self.assertEqual(len(storage.listdir(directory)[1]), 1)
+        with patch("core.tasks.write_shipping_labels_pdf") as render:
+            repeat = self.client.get(url, selection)
+        render.assert_not_called()
+        self.assertEqual(b"".join(repeat.streaming_content), pdf)
+
+        # A repeat right after an edit must not get the result shared a
+        # moment ago, and the edit drops the outdated file
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.city = "Mombasa"
+            self.address.save()
+        self.assertEqual(storage.listdir(directory)[1], [])
+        edited = self.client.get(url, selection)
+        self.assertNotEqual(b"".join(edited.streaming_content), pdf)
+
+    @override_settings(LABEL_RENDER_WORKERS=1)
+    def test_download_labels_png_zip(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "png"
+        self.batch.save()
+
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        response = self.client.get(url, {"dpi": 300})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["00001-TEST-ORD-001.png"])
+
+        image = Image.open(io.BytesIO(archive.read("00001-TEST-ORD-001.png")))
+        self.assertEqual(image.mode, "1")
+        self.assertEqual(image.size, (1200, 1800))
+
+    def test_download_labels_png_rejects_unknown_dpi(self):
+        self.batch.status = "purchased"
+        self.batch.label_format = "png"
+        self.batch.save()
+
+        url = reverse("batch-download-labels", kwargs={"pk": self.batch.pk})
+        response = self.client.get(url, {"dpi": 150})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class BulkUpdateTests(BaseAPITestCase):
     def setUp(self):
@@ -218,13 +623,15 @@ class ShipmentViewSetTests(BaseAPITestCase):
     def setUp(self):
         super().setUp()
         self.batch = Batch.objects.create(user=self.user)
-        self.shipment = Shipment.objects.create(
-            batch=self.batch,
-            ship_to=self.address,
-            package=self.package,
-            order_no="SHIP-TEST-777",
-            shipping_service="ground"
-        )
+        # Committing indexes the shipment for search
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shipment = Shipment.objects.create(
+                batch=self.batch,
+                ship_to=self.address,
+                package=self.package,
+                order_no="SHIP-TEST-777",
+                shipping_service="ground"
+            )
         self.shipment.calculate_price()
         self.shipment.save(update_fields=["price"])
 
@@ -235,6 +642,567 @@ class ShipmentViewSetTests(BaseAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("total_prices", response.data)
 
+    def test_list_filters_once_for_totals_and_once_for_page(self):
+        Shipment.objects.filter(pk=self.shipment.pk).update(price=Decimal("4.25"))
+        url = reverse("shipment-list")
+        # Count and price total in one aggregate, then the page
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"search": "Warehouse", "page_size": 1})
+
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["total_prices"], "4.25")
+
+    def test_search_uses_index_kept_current_on_write(self):
+        url = reverse("shipment-list")
+
+        def search(term):
+            response = self.client.get(url, {"search": term})
+            return [row["order_no"] for row in response.data["results"]]
+
+        self.assertEqual(search("ship-test"), ["SHIP-TEST-777"])
+        self.assertEqual(search("nairo"), ["SHIP-TEST-777"])
+        # Short terms fall back to icontains
+        self.assertEqual(search("77"), ["SHIP-TEST-777"])
+
+        # Saves keep the index current through signals, rewriting it once
+        # per transaction when it commits
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.address.city = "Mombasa"
+            self.address.save()
+            self.shipment.order_no = "SHIP-RENAMED"
+            self.shipment.save(update_fields=["order_no", "updated_at"])
+            self.assertEqual(search("renamed"), [])
+        self.assertTrue(callbacks)
+        self.assertEqual(search("nairo"), [])
+        self.assertEqual(search("mombasa"), ["SHIP-RENAMED"])
+        self.assertEqual(search("renamed"), ["SHIP-RENAMED"])
+
+        # update() sends no signals; writers using it reindex explicitly
+        Shipment.objects.filter(pk=self.shipment.pk).update(order_no="SHIP-BULK")
+        reindex_shipments([self.shipment.pk])
+        self.assertEqual(search("ship-bulk"), ["SHIP-BULK"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Shipment.objects.filter(pk=self.shipment.pk).delete()
+        self.assertEqual(search("mombasa"), [])
+
+    def test_deleting_an_address_drops_it_from_search(self):
+        url = reverse("shipment-list")
+        self.assertEqual(len(self.client.get(url, {"search": "nairo"}).data["results"]), 1)
+
+        # SET_NULL detaches the shipment with a queryset update, no signals
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.delete()
+
+        self.assertEqual(self.client.get(url, {"search": "nairo"}).data["results"], [])
+        # The shipment itself stays findable by order number
+        response = self.client.get(url, {"search": "ship-test"})
+        self.assertEqual([row["order_no"] for row in response.data["results"]], ["SHIP-TEST-777"])
+
+    def test_unchanged_list_and_detail_answer_not_modified(self):
+        for url in (
+            reverse("shipment-list"),
+            reverse("shipment-detail", kwargs={"pk": self.shipment.pk}),
+            reverse("batch-list"),
+            reverse("batch-detail", kwargs={"pk": self.batch.pk}),
+        ):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, status.HTTP_200_OK, url)
+            self.assertIn("Last-Modified", first, url)
+            etag = first["ETag"]
+
+            # A poll of unchanged data costs the validator aggregate only
+            with self.assertNumQueries(1):
+                again = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED, url)
+
+            # Changing a rendered row, even through update(), changes the ETag
+            Address.objects.filter(pk=self.address.pk).update(
+                city=f"City {url}", updated_at=timezone.now()
+            )
+            Shipment.objects.filter(pk=self.shipment.pk).update(
+                price=Decimal("1.00"), updated_at=timezone.now()
+            )
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(changed.status_code, status.HTTP_200_OK, url)
+            self.assertNotEqual(changed["ETag"], etag, url)
+
+        # Deleting a row changes the list validator too
+        etag = self.client.get(reverse("shipment-list"))["ETag"]
+        Shipment.objects.create(batch=self.batch, order_no="SHIP-GONE").delete()
+        Shipment.objects.filter(pk=self.shipment.pk).delete()
+        response = self.client.get(reverse("shipment-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_sparse_fields_and_expand(self):
+        url = reverse("shipment-list")
+
+        response = self.client.get(url, {"fields": "id,order_no,ship_to.city"})
+        row = response.data["results"][0]
+        self.assertEqual(set(row), {"id", "order_no", "ship_to"})
+        self.assertEqual(row["ship_to"], {"city": "Nairobi"})
+
+        # Spaces after the commas are ignored
+        response = self.client.get(url, {"fields": "id, order_no , ship_to.city"})
+        row = response.data["results"][0]
+        self.assertEqual(set(row), {"id", "order_no", "ship_to"})
+
+        response = self.client.get(url, {"expand": "package"})
+        row = response.data["results"][0]
+        self.assertEqual(row["ship_to"], self.address.pk)
+        self.assertEqual(row["package"]["name"], "Medium Box")
+
+        # Full output is unchanged and large JSON is gzipped
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response.data["results"][0]["ship_to"]["name"], "Test Warehouse")
+
+    def test_cursor_pagination_walks_ties_in_order(self):
+        for i in range(5):
+            Shipment.objects.create(batch=self.batch, order_no=f"SHIP-CURSOR-{i}")
+        # Identical timestamps must still page by id without gaps or repeats
+        Shipment.objects.filter(order_no__startswith="SHIP-CURSOR-").update(
+            created_at=self.shipment.created_at
+        )
+
+        url = reverse("shipment-list")
+        seen = []
+        cursor = ""
+        while True:
+            response = self.client.get(url, {"cursor": cursor, "page_size": 2})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            seen.extend(row["id"] for row in response.data["results"])
+            if not response.data["has_next"]:
+                break
+            cursor = response.data["next_cursor"]
+
+        expected = Shipment.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        self.assertEqual(seen, [str(pk) for pk in expected])
+
+        invalid = self.client.get(url, {"cursor": "not-a-cursor"})
+        self.assertEqual(invalid.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_page_cost_is_bounded_by_the_page(self):
+        for i in range(6):
+            Shipment.objects.create(batch=self.batch, order_no=f"SHIP-DEEP-{i}")
+        url = reverse("shipment-list")
+        first = self.client.get(url, {"cursor": "", "page_size": 2})
+        params = {"cursor": first.data["next_cursor"], "page_size": 2}
+
+        # The page itself, then the validator over that page's keys only
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertNotIn("total_prices", response.data)
+        page_query, validator_query = [query["sql"] for query in context.captured_queries]
+        self.assertIn("LIMIT 3", page_query)
+        self.assertNotIn("SUM(", validator_query)
+        self.assertIn(" IN (", validator_query)
+
+        with self.assertNumQueries(2):
+            again = self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Editing a row on the page changes its validator
+        Shipment.objects.filter(pk=response.data["results"][0]["id"]).update(
+            order_no="SHIP-DEEP-EDITED", updated_at=timezone.now()
+        )
+        changed = self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        url = reverse("shipment-list")
+        with CaptureQueriesContext(connection) as single:
+            self.client.get(url)
+
+        for i in range(5):
+            Shipment.objects.create(
+                batch=self.batch, ship_from=self.address, ship_to=self.address,
+                package=self.package, order_no=f"SHIP-MANY-{i}",
+            )
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.data["results"]), 6)
+        self.assertEqual(len(many), len(single))
+
+    def test_preview_png_is_cached_until_label_changes(self):
+        url = reverse("shipment-preview", kwargs={"pk": self.shipment.pk})
+
+        with patch("core.views.render_label_png", wraps=render_label_png) as render:
+            first = self.client.get(url)
+            second = self.client.get(url)
+            self.assertEqual(render.call_count, 1)
+
+            Address.objects.filter(pk=self.address.pk).update(city="Mombasa")
+            third = self.client.get(url)
+            self.assertEqual(render.call_count, 2)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first["Content-Type"], "image/png")
+        self.assertEqual(first.content, second.content)
+        self.assertNotEqual(first.content, third.content)
+        self.assertEqual(Image.open(io.BytesIO(first.content)).size, (384, 576))
+
+    def test_track_by_tracking_number(self):
+        self.batch.assign_tracking_numbers()
+        self.shipment.refresh_from_db()
+
+        url = reverse(
+            "shipment-track",
+            kwargs={"tracking_number": self.shipment.tracking_number.lower()},
+        )
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["order_no"], "SHIP-TEST-777")
+
+        missing = reverse("shipment-track", kwargs={"tracking_number": "GS99999999999"})
+        self.assertEqual(self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class LabelRenderingTests(TestCase):
+    def test_code128_runs_are_cached(self):
+        services.code128_runs.cache_clear()
+
+        first = services.code128_runs("PM00000012347")
+        second = services.code128_runs("PM00000012347")
+
+        self.assertIs(first, second)
+        self.assertEqual(services.code128_runs.cache_info().hits, 1)
+        # Code128 symbols always end with the 13-module stop pattern
+        self.assertEqual(sum(first[-7:]), 13)
+
+    def test_unencodable_tracking_number_falls_back_to_box(self):
+        shipment = Shipment(order_no="FALLBACK-1", tracking_number="PMé001")
+
+        for label_format in ("4x6", "letter"):
+            buffer = services.generate_shipping_labels_pdf(
+                [shipment], label_format=label_format
+            )
+            self.assertTrue(buffer.getvalue().startswith(b"%PDF"))
+
+    def test_zpl_field_data_is_hex_escaped(self):
+        shipment = Shipment(order_no="ORD^1", tracking_number="PM_00~1")
+        zpl = b"".join(services.iter_shipping_labels_zpl([shipment])).decode("utf-8")
+
+        self.assertIn("^BCN,122,N,N,N^FH^FDPM_5F00_7E1^FS", zpl)
+        self.assertIn("_5E1", zpl)
+        # Escapes only decode in fields that enable ^FH
+        for field in zpl.split("^FD")[1:]:
+            self.assertNotIn("^", field.split("^FS")[0])
+        self.assertEqual(zpl.count("^FD"), zpl.count("^FH^FD"))
+
+    def test_pdf_pages_are_written_incrementally(self):
+        labels = [
+            Shipment(order_no=f"STREAM-{i}", tracking_number=f"PM0000000{i}")
+            for i in range(3)
+        ]
+        with tempfile.TemporaryFile() as fh:
+            stats = services.write_shipping_labels_pdf(labels, fh)
+            self.assertEqual((stats.labels, stats.pages), (3, 3))
+            fh.seek(0)
+            data = fh.read()
+
+        self.assertTrue(data.startswith(b"%PDF-1.4"))
+        self.assertIn(b"/Count 3", data)
+        # Every cross-reference entry must point at the start of its object
+        xref = int(data[data.rindex(b"startxref") + 9:].split()[0])
+        entries = data[xref:].split(b"\n")[3:]
+        for number, entry in enumerate(entries, 1):
+            if entry.startswith(b"trailer"):
+                break
+            offset = int(entry.split()[0])
+            self.assertTrue(data[offset:].startswith(b"%d 0 obj" % number))
+
+    def test_compact_profile_is_smaller_and_deterministic(self):
+        sender = services.LabelAddress("Acme", "", "", "1 Main St", "", "Springfield", "IL", "62701", "")
+        labels = [
+            services.LabelData.from_shipment(
+                Shipment(order_no=f"COMPACT-{i}", tracking_number=f"PM0000000{i}")
+            )._replace(ship_from=sender)
+            for i in range(6)
+        ]
+
+        standard = services.generate_shipping_labels_pdf(labels, profile="standard").getvalue()
+        compact = services.generate_shipping_labels_pdf(labels, profile="compact").getvalue()
+
+        self.assertNotIn(b"/Subtype /Form", standard)
+        # One form for the fixed label parts and one for the shared sender
+        self.assertEqual(compact.count(b"/Subtype /Form"), 2)
+        self.assertLess(len(compact), len(standard))
+        self.assertEqual(
+            compact, services.generate_shipping_labels_pdf(labels, profile="compact").getvalue()
+        )
+
+    @override_settings(LABEL_PDF_PROFILE="compact")
+    def test_short_runs_use_the_standard_profile(self):
+        shipment = Shipment(order_no="SINGLE-1", tracking_number="PM00000001")
+
+        single = services.generate_shipping_labels_pdf([shipment]).getvalue()
+        self.assertEqual(
+            single, services.generate_shipping_labels_pdf([shipment], profile="standard").getvalue()
+        )
+        (_, data), = services.iter_shipping_label_files([shipment])
+        self.assertNotIn(b"/Subtype /Form", data)
+
+        labels = [shipment] * services.COMPACT_MIN_PAGES
+        self.assertIn(b"/Subtype /Form", services.generate_shipping_labels_pdf(labels).getvalue())
+
+    def test_concurrent_identical_renders_are_coalesced(self):
+        cache.clear()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b"%PDF-shared"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(single_flight("labels:test", render)))
+            for _ in range(3)
+        ]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"%PDF-shared"] * 3)
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_render_in_flight_in_another_worker_is_shared(self):
+        # Another worker holds the lock and publishes its result in the
+        # database cache, which every process reads
+        cache.add("singleflight:labels:shared:lock", True, 60)
+        cache.set("singleflight:labels:shared:result", b"%PDF-other-worker", 10)
+
+        def render():
+            raise AssertionError("render already in flight elsewhere")
+
+        self.assertEqual(single_flight("labels:shared", render), b"%PDF-other-worker")
+
+    def test_every_stock_renders_pdf_and_png(self):
+        labels = [Shipment(order_no=f"LAYOUT-{i}", tracking_number="PM00000012347") for i in range(7)]
+
+        for name, sheet in layouts.SHEETS.items():
+            data = services.generate_shipping_labels_pdf(labels, label_format=name).getvalue()
+            per_page = sheet.columns * sheet.rows
+            self.assertIn(b"/Count %d" % -(-len(labels) // per_page), data, name)
+            self.assertIn(b"/MediaBox [0 0 %g %g]" % layouts.page_size(name), data, name)
+
+            png = render_label_png(
+                services.LabelData.from_shipment(labels[0]), dpi=72, label_format=name
+            )
+            image = Image.open(io.BytesIO(png))
+            self.assertEqual(
+                image.size, tuple(round(v) for v in layouts.label_size(sheet.layout)), name
+            )
+
+    def test_png_worker_pool_matches_in_process_render(self):
+        labels = [
+            Shipment(order_no=f"POOL-{i}", tracking_number=f"PM0000000{i}") for i in range(5)
+        ]
+
+        serial = list(iter_shipping_labels_png(labels, workers=1))
+        pooled = list(iter_shipping_labels_png(labels, workers=2))
+
+        self.assertEqual([name for name, _ in serial], [f"{i + 1:05d}-POOL-{i}.png" for i in range(5)])
+        self.assertEqual(pooled, serial)
+
+        # Closing the generator early shuts the pool down with work pending
+        stream = iter_shipping_labels_png(labels, workers=2)
+        self.assertEqual(next(stream), serial[0])
+        stream.close()
+
+    def test_sheet_cells_stay_on_page(self):
+        for name, sheet in layouts.SHEETS.items():
+            cells = layouts.impose(name)
+            width, height = layouts.label_size(sheet.layout)
+            page_width, page_height = layouts.page_size(name)
+
+            self.assertEqual(len(cells), sheet.columns * sheet.rows, name)
+            for cell in cells:
+                self.assertGreaterEqual(cell.x, -0.01, name)
+                self.assertGreaterEqual(cell.y, -0.01, name)
+                self.assertLessEqual(cell.x + width * cell.scale, page_width + 0.01, name)
+                self.assertLessEqual(cell.y + height * cell.scale, page_height + 0.01, name)
+            # Print order runs top to bottom
+            self.assertEqual(list(cells), sorted(cells, key=lambda c: (-round(c.y), c.x)), name)
+
+    def test_label_data_loaded_in_one_query(self):
+        user = User.objects.create_user(email="labels@example.com", password="pw")
+        batch = Batch.objects.create(user=user, name="Labels")
+        address = Address.objects.create(
+            first_name="Jane", last_name="Doe", address_line1="1 Main St", city="Nairobi"
+        )
+        package = Package.objects.create(
+            length_inches=Decimal("6.00"),
+            width_inches=Decimal("4.00"),
+            height_inches=Decimal("2.00"),
+            weight_lbs=1,
+            weight_oz=4,
+        )
+        shipment = Shipment.objects.create(
+            batch=batch,
+            ship_to=address,
+            package=package,
+            order_no="SNAP-1",
+            shipping_service="priority",
+            tracking_number="PM00000012347",
+        )
+
+        with self.assertNumQueries(1):
+            labels = list(services.label_data_from_queryset(batch.shipments.all()))
+
+        self.assertEqual(labels, [services.LabelData.from_shipment(shipment)])
+        label = labels[0]
+        self.assertIsNone(label.ship_from)
+        self.assertEqual(label.ship_to.address_line2, "")
+        self.assertEqual(label.service, shipment.get_shipping_service_display())
+        self.assertEqual(pickle.loads(pickle.dumps(label)), label)
+
+
+class BenchmarkLabelsCommandTests(TestCase):
+    def setUp(self):
+        self.output = tempfile.NamedTemporaryFile(suffix=".json", delete=False).name
+        self.addCleanup(os.remove, self.output)
+
+    def test_writes_results_json(self):
+        call_command(
+            "benchmark_labels",
+            sizes=[3],
+            formats=["4x6", "letter"],
+            skip_memory=True,
+            output=self.output,
+            stdout=io.StringIO(),
+        )
+
+        with open(self.output) as fh:
+            results = json.load(fh)["results"]
+
+        self.assertEqual([(r["format"], r["size"]) for r in results], [("4x6", 3), ("letter", 3)])
+        self.assertGreater(results[0]["output_bytes"], 0)
+        self.assertIn("p95", results[0]["latency_ms"])
+
+    def test_fails_on_regression_against_baseline(self):
+        with open(self.output, "w") as fh:
+            json.dump(
+                {"results": [{"variant": "default", "format": "4x6", "size": 3, "wall_seconds": 1e-9}]},
+                fh,
+            )
+
+        with self.assertRaises(CommandError):
+            call_command(
+                "benchmark_labels",
+                sizes=[3],
+                formats=["4x6"],
+                skip_memory=True,
+                output=os.devnull,
+                baseline=self.output,
+                stdout=io.StringIO(),
+            )
+
+
+class QueryPlanTests(BaseAPITestCase):
+    """The hot read paths must be served from indexes, not full table scans."""
+
+    def setUp(self):
+        super().setUp()
+        self.batch = Batch.objects.create(user=self.user, name="Plan Batch")
+        Shipment.objects.create(
+            batch=self.batch, ship_to=self.address, package=self.package, order_no="PLAN-1"
+        )
+
+    def assert_indexed(self, queries):
+        partial = {
+            index.name
+            for model in (Address, Package, Batch, Shipment)
+            for index in model._meta.indexes
+            if index.condition is not None
+        }
+        for query in queries:
+            sql = query["sql"]
+            if not sql.startswith("SELECT"):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            # A SCAN reads every row, also when it walks an index for ordering;
+            # only a partial index limits it to the rows the query wants
+            scans = [
+                step for step in plan
+                if step.startswith("SCAN ") and not any(name in step for name in partial)
+            ]
+            self.assertEqual(scans, [], f"{sql}\n" + "\n".join(plan))
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN output is SQLite specific")
+
+        urls = [
+            reverse("batch-list"),
+            reverse("batch-detail", kwargs={"pk": self.batch.pk}),
+            reverse("batch-stats", kwargs={"pk": self.batch.pk}),
+            reverse("address-list"),
+            reverse("package-list"),
+        ]
+        shipments = reverse("shipment-list")
+        for params in ("", "&status=valid", "&service=ground"):
+            urls.append(f"{shipments}?batch={self.batch.pk}{params}")
+
+        with CaptureQueriesContext(connection) as context:
+            for url in urls:
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK, url)
+            # CSV upload lookups
+            Address.objects.filter(
+                address_line1="123 Industrial Way", city="Nairobi", state="NA", zip_code="00100"
+            ).first()
+            Package.objects.filter(sku="MED-BOX-001").first()
+
+        self.assert_indexed(context.captured_queries)
+
+
+class SearchIndexSchemaTests(TransactionTestCase):
+    """Tables covered by the search index must stay alterable by migrations."""
+
+    def alter_field(self, model, name, **changes):
+        old_field = model._meta.get_field(name)
+        new_field = old_field.clone()
+        for attr, value in changes.items():
+            setattr(new_field, attr, value)
+        new_field.set_attributes_from_name(name)
+        new_field.model = model
+        # SQLite rebuilds the table for any AlterField
+        with connection.schema_editor() as editor:
+            editor.alter_field(model, old_field, new_field)
+            editor.alter_field(model, new_field, old_field)
+
+    def test_alter_field_after_search_index(self):
+        self.alter_field(Shipment, "order_no", max_length=60)
+        self.alter_field(Address, "city", max_length=120)
+
+        user = User.objects.create_user(email="schema@example.com", password="testpass123")
+        address = Address.objects.create(
+            name="Depot", address_line1="1 Quay Rd", city="Kisumu", state="KS", zip_code="40100"
+        )
+        Shipment.objects.create(
+            batch=Batch.objects.create(user=user), ship_to=address, order_no="SCHEMA-1"
+        )
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.get(reverse("shipment-list"), {"search": "kisumu"})
+        self.assertEqual([row["order_no"] for row in response.data["results"]], ["SCHEMA-1"])
+
 
 class ModelValidationTests(TestCase):
     def test_package_validation_zero_weight(self):
@@ -1,24 +1,62 @@
 import csv
+import hashlib
 import io
 import logging
+import math
+import os
+import uuid
+import zipfile
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework.generics import GenericAPIView
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 
-from core.services import generate_shipping_labels_pdf
+from common.utils.conditional import ConditionalGetMixin
+from common.utils.pagination import is_keyset_request
+from common.utils.queryplan import SerializerQueryPlanMixin
+from common.utils.singleflight import single_flight
+from common.utils.zipstream import iter_zip
+from core.raster import (
+    DEFAULT_DPI,
+    PREVIEW_DPI,
+    SUPPORTED_DPI,
+    is_raster_format,
+    iter_shipping_labels_png,
+    render_label_png,
+)
+from core.response_cache import BatchResponseCacheMixin, invalidate_batch_responses
+from core.services import (
+    is_zpl_format,
+    iter_shipping_label_files,
+    iter_shipping_labels_zpl,
+    label_data_from_queryset,
+)
+from core.tasks import (
+    LABEL_CONTENT_TYPES,
+    can_claim_label_render,
+    enqueue_label_render,
+    invalidate_batch_labels,
+    store_label_selection,
+    wait_for_label_render,
+)
 
 from .models import Batch, Shipment, Address, Package
 from .serializers import (
+    BatchListSerializer,
     BatchSerializer,
+    BatchStatsSerializer,
     ShipmentSerializer,
     AddressSerializer,
     PackageSerializer,
@@ -27,20 +65,24 @@ from .filters import BatchFilter, ShipmentFilter
 
 logger = logging.getLogger(__name__)
 
+# Previews are keyed by content, so entries only need to expire to free space
+LABEL_PREVIEW_CACHE_SECONDS = 60 * 60 * 24
 
-class AddressViewSet(viewsets.ModelViewSet):
+
+class AddressViewSet(SerializerQueryPlanMixin, viewsets.ModelViewSet):
     queryset = Address.objects.filter(saved=True)
     serializer_class = AddressSerializer
     permission_classes = [IsAuthenticated]
 
 
-class PackageViewSet(viewsets.ModelViewSet):
+class PackageViewSet(SerializerQueryPlanMixin, viewsets.ModelViewSet):
     queryset = Package.objects.filter(saved=True)
     serializer_class = PackageSerializer
     permission_classes = [IsAuthenticated]
 
 
-class BatchViewSet(viewsets.ModelViewSet):
+class BatchViewSet(BatchResponseCacheMixin, ConditionalGetMixin, SerializerQueryPlanMixin, viewsets.ModelViewSet):
+    queryset = Batch.objects.all()
     serializer_class = BatchSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -48,11 +90,27 @@ class BatchViewSet(viewsets.ModelViewSet):
     search_fields = ["name", "status"]
     ordering_fields = ["created_at", "total_price", "status"]
     ordering = ["-created_at"]
+    # ?cursor= switches to constant-time pages on (created_at, id)
+    keyset_pagination = True
+    # The list summary is computed from the shipments
+    conditional_related = ("shipments",)
 
     def get_queryset(self):
         logger.debug("User %s (id:%s) fetching their batches", 
                      self.request.user.full_name, self.request.user.id)
-        return Batch.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
+
+    def paginate_queryset(self, queryset):
+        # Summaries are added to the rows being listed only, so the conditional
+        # GET validator aggregates the plain filtered set
+        if self.action == "list":
+            queryset = queryset.with_shipment_summary()
+        return super().paginate_queryset(queryset)
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return BatchListSerializer
+        return BatchSerializer
 
     @action(detail=True, methods=["post"])
     def purchase(self, request, pk=None):
@@ -81,19 +139,41 @@ class BatchViewSet(viewsets.ModelViewSet):
             )
 
         old_status = batch.status
-        batch.status = "purchased"
-        batch.label_format = label_format
-        batch.save(update_fields=["status", "label_format", "updated_at"])
+        with transaction.atomic():
+            batch.status = "purchased"
+            batch.label_format = label_format
+            batch.labels_status = "pending"
+            batch.save(
+                update_fields=["status", "label_format", "labels_status", "updated_at"]
+            )
+            tracking_count = batch.assign_tracking_numbers()
+            enqueue_label_render(batch.id)
 
         logger.info(
             "Batch purchased successfully | batch=%d | user=%s | %s → purchased | "
-            "label_format=%s | total=%.2f",
+            "label_format=%s | total=%.2f | tracking_numbers=%d",
             batch.id, request.user.full_name, old_status, 
-            label_format or "not-specified", batch.total_price or 0
+            label_format or "not-specified", batch.total_price or 0, tracking_count
         )
         
         return Response(BatchSerializer(batch).data)
     
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None):
+        """
+        Shipment counts and price totals by status, service and weight bucket.
+
+        One grouped aggregate replaces paging through the shipments list.
+        """
+        batch = self.get_object()
+        stats = batch.shipment_stats()
+
+        logger.debug(
+            "Batch stats | batch=%s | shipments=%d | user=%s",
+            batch.id, stats["shipment_count"], request.user.full_name
+        )
+        return Response(BatchStatsSerializer(stats).data)
+
     @action(detail=True, methods=["get"], url_path="labels")
     def download_labels(self, request, pk=None):
         batch = self.get_object()
@@ -118,48 +198,239 @@ class BatchViewSet(viewsets.ModelViewSet):
             )
             return Response({"detail": "No shipments in batch"}, status=400)
 
+        dpi = DEFAULT_DPI
+        if is_raster_format(batch.label_format) and "dpi" in request.query_params:
+            try:
+                dpi = int(request.query_params["dpi"])
+            except ValueError:
+                dpi = None
+            if dpi not in SUPPORTED_DPI:
+                return Response(
+                    {"detail": f"dpi must be one of {', '.join(map(str, SUPPORTED_DPI))}"},
+                    status=400
+                )
+
+        shipments = self._select_label_shipments(batch, request.query_params)
+
+        if shipments is not None or dpi != DEFAULT_DPI:
+            # Subsets and non-default resolutions are not pre-rendered; render on demand
+            if shipments is None:
+                shipments = batch.shipments.order_by("id")
+            elif not shipments.exists():
+                return Response({"detail": "No shipments match the selection"}, status=400)
+
+            return self._render_labels_response(batch, shipments, dpi, request.query_params)
+
+        if batch.labels_status == "rendering" and not can_claim_label_render(batch):
+            # Another request's render is running; share it rather than start over
+            if wait_for_label_render(batch.id, settings.LABEL_RENDER_WAIT_SECONDS) != "rendering":
+                batch.refresh_from_db()
+
+        if batch.labels_status == "ready" and batch.labels_file:
+            extension = os.path.splitext(batch.labels_file.name)[1].lstrip(".")
+            try:
+                response = FileResponse(
+                    batch.labels_file.open("rb"),
+                    as_attachment=True,
+                    filename=f"labels-batch-{batch.id}.{extension}",
+                    content_type=LABEL_CONTENT_TYPES.get(extension, "application/octet-stream"),
+                )
+            except OSError:
+                logger.warning(
+                    "Rendered labels missing from storage, re-rendering | batch=%s | file=%s",
+                    batch.id, batch.labels_file.name
+                )
+                batch.labels_status = "pending"
+                batch.save(update_fields=["labels_status", "updated_at"])
+            else:
+                logger.info(
+                    "Labels successfully served | batch=%s | user=%s | file=%s | size=%d bytes",
+                    batch.id, request.user.full_name, batch.labels_file.name, batch.labels_file.size
+                )
+                return response
+
+        if can_claim_label_render(batch):
+            # Purchased before background rendering, the last render failed, or
+            # it died mid-render and left a stale claim
+            enqueue_label_render(batch.id)
+
         logger.info(
-            "Starting label PDF generation | batch=%d | user=%s | shipments=%d | format=%s",
-            batch.id, request.user.full_name, shipments_count, batch.label_format
+            "Labels not ready yet | batch=%s | user=%s | labels_status=%s | shipments=%d",
+            batch.id, request.user.full_name, batch.labels_status, shipments_count
         )
 
-        try:
-            shipments = batch.shipments.select_related(
-                "ship_from", "ship_to", "package"
-            ).order_by("id")
-            
-            pdf_buffer = generate_shipping_labels_pdf(shipments,label_format=batch.label_format)
-            
-            buffer_size = pdf_buffer.tell()
-            pdf_buffer.seek(0)
-            
-            logger.debug(
-                "Label PDF generated successfully | batch=%d | size=%d bytes",
-                batch.id, buffer_size
-            )
-        except Exception as e:
-            logger.error(
-                "Failed to generate shipping labels PDF | batch=%d | error=%s",
-                batch.id, str(e), exc_info=True
+        response = Response(
+            {
+                "detail": "Labels are being rendered, please retry shortly",
+                "labels_status": batch.labels_status,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+        # Rendering runs at roughly a thousand labels per second
+        response["Retry-After"] = str(max(2, math.ceil(shipments_count / 1000)))
+        return response
+
+
+    @action(detail=True, methods=["get"], url_path="labels-zip")
+    def download_labels_zip(self, request, pk=None):
+        """
+        Stream a ZIP with one label file per shipment, named by order number.
+
+        Accepts the same ``ids`` / ``shipment_status`` / ``range`` selection
+        as the labels download. Each label is rendered and deflated as the
+        archive is sent, so nothing is buffered beyond the current entry.
+        """
+        batch = self.get_object()
+
+        if batch.status != "purchased":
+            return Response(
+                {"detail": "Batch must be purchased before downloading labels"},
+                status=400
             )
+
+        if is_raster_format(batch.label_format):
             return Response(
-                {"detail": "Failed to generate labels PDF"},
-                status=500
+                {"detail": "PNG labels are already downloaded as one file per shipment"},
+                status=400
             )
 
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="labels-batch-{batch.id}.pdf"'
-        response.write(pdf_buffer.getvalue())
+        shipments = self._select_label_shipments(batch, request.query_params)
+        if shipments is None:
+            shipments = batch.shipments.order_by("id")
+        if not shipments.exists():
+            return Response({"detail": "No shipments match the selection"}, status=400)
 
         logger.info(
-            "Labels PDF successfully served | batch=%d | user=%s | size=%d bytes",
-            batch.id, request.user.full_name, len(response.content)
+            "Streaming per-shipment labels archive | batch=%s | user=%s | format=%s",
+            batch.id, request.user.full_name, batch.label_format
         )
 
+        files = iter_shipping_label_files(
+            label_data_from_queryset(shipments), label_format=batch.label_format
+        )
+        response = StreamingHttpResponse(iter_zip(files), content_type=LABEL_CONTENT_TYPES["zip"])
+        response["Content-Disposition"] = f'attachment; filename="labels-batch-{batch.id}.zip"'
         return response
 
+    def _select_label_shipments(self, batch, params):
+        """
+        Narrow the batch shipments to the subset requested for printing.
+
+        Supported query parameters (combinable):
+            ids: comma-separated shipment ids
+            shipment_status: valid / incomplete / error (``status`` already
+                filters the batch lookup itself)
+            range: zero-based inclusive index range in print order, e.g. 200-399
+
+        Returns None when no selection was requested.
+        """
+        if not any(key in params for key in ("ids", "shipment_status", "range")):
+            return None
+
+        shipments = batch.shipments.all()
+
+        if "ids" in params:
+            try:
+                ids = [uuid.UUID(value.strip()) for value in params["ids"].split(",") if value.strip()]
+            except ValueError:
+                raise ValidationError({"ids": "Must be a comma-separated list of shipment ids"})
+            shipments = shipments.filter(id__in=ids)
+
+        if "shipment_status" in params:
+            shipment_status = params["shipment_status"]
+            if shipment_status not in dict(Shipment.STATUS_CHOICES):
+                raise ValidationError(
+                    {"shipment_status": f"Unknown shipment status: {shipment_status}"}
+                )
+            shipments = shipments.filter(status=shipment_status)
+
+        shipments = shipments.order_by("id")
+
+        if "range" in params:
+            first, sep, last = params["range"].partition("-")
+            try:
+                first = int(first)
+                last = int(last) if sep else first
+            except ValueError:
+                raise ValidationError({"range": "Expected a range such as 200-399"})
+            if first < 0 or last < first:
+                raise ValidationError({"range": "Expected a range such as 200-399"})
+            shipments = shipments[first:last + 1]
+
+        return shipments
+
+    def _render_labels_response(self, batch, shipments, dpi, params):
+        """
+        Render the given shipments synchronously in the batch label format.
+
+        Identical PDF requests that overlap (double clicks, proxy retries)
+        are coalesced: the first renders to storage and the others wait for
+        the file name it publishes, then all stream the same file.
+        """
+        labels = label_data_from_queryset(shipments)
+        filename = f"labels-batch-{batch.id}-selection"
+
+        logger.info(
+            "Rendering label selection on demand | batch=%s | format=%s | dpi=%s",
+            batch.id, batch.label_format, dpi
+        )
+
+        if is_zpl_format(batch.label_format):
+            response = StreamingHttpResponse(
+                iter_shipping_labels_zpl(labels),
+                content_type=LABEL_CONTENT_TYPES["zpl"],
+            )
+            response["Content-Disposition"] = f'attachment; filename="{filename}.zpl"'
+            return response
+
+        if is_raster_format(batch.label_format):
+            images = iter_shipping_labels_png(labels, dpi=dpi)
+            response = StreamingHttpResponse(
+                iter_zip(images, compression=zipfile.ZIP_STORED),
+                content_type=LABEL_CONTENT_TYPES["zip"],
+            )
+            response["Content-Disposition"] = f'attachment; filename="{filename}-{dpi}dpi.zip"'
+            return response
+
+        selection = "|".join(
+            f"{key}={params[key]}" for key in ("ids", "shipment_status", "range") if key in params
+        )
+        # The content version keeps a result published just before an edit
+        # from being shared with requests made after it
+        version = shipments.aggregate(
+            rows=Count("pk"),
+            updated=Max("updated_at"),
+            ship_from=Max("ship_from__updated_at"),
+            ship_to=Max("ship_to__updated_at"),
+            package=Max("package__updated_at"),
+        )
+        variant = "|".join([selection, *(f"{name}={version[name]}" for name in sorted(version))])
+        selection_key = "%s-%s" % (
+            batch.label_format, hashlib.sha1(variant.encode("utf-8")).hexdigest()
+        )
+        try:
+            name = single_flight(
+                f"labels:{batch.id}:{selection_key}",
+                lambda: store_label_selection(batch, shipments, selection_key),
+                wait_timeout=settings.LABEL_RENDER_WAIT_SECONDS,
+            )
+            pdf = batch.labels_file.storage.open(name, "rb")
+        except Exception as e:
+            logger.error(
+                "Failed to generate shipping labels PDF | batch=%s | error=%s",
+                batch.id, str(e), exc_info=True
+            )
+            return Response({"detail": "Failed to generate labels PDF"}, status=500)
 
-class ShipmentViewSet(viewsets.ModelViewSet):
+        return FileResponse(
+            pdf,
+            as_attachment=True,
+            filename=f"{filename}.pdf",
+            content_type=LABEL_CONTENT_TYPES["pdf"],
+        )
+
+
+class ShipmentViewSet(ConditionalGetMixin, SerializerQueryPlanMixin, viewsets.ModelViewSet):
     serializer_class = ShipmentSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
@@ -172,13 +443,34 @@ class ShipmentViewSet(viewsets.ModelViewSet):
         "ship_from__name",
     ]
     queryset = Shipment.objects.all()
+    # ?cursor= switches to constant-time pages on (created_at, id)
+    keyset_pagination = True
     
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        
+        if is_keyset_request(request, self):
+            # Cursor pages carry no count or price total, so nothing runs over
+            # the whole filtered set
+            return self.keyset_list(request)
+
         queryset = self.filter_queryset(self.get_queryset())
-        total_price = queryset.aggregate(total=Sum('price'))['total'] or 0.00
-        
+
+        # One aggregate gives the pagination count, the price total and the
+        # conditional GET validator, so the filters run once for totals and
+        # once for the page
+        totals = queryset.aggregate(
+            count=Count("pk"), total=Sum("price"), **self.get_validator_aggregates()
+        )
+        not_modified = self.check_not_modified(request, totals)
+        if not_modified is not None:
+            return not_modified
+        total_price = totals["total"] or 0.00
+
+        page = self.paginator.paginate_queryset(
+            queryset, request, view=self, count=totals["count"]
+        )
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+
         response.data['total_prices'] = str(total_price)
         
         logger.debug(
@@ -186,8 +478,62 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             request.user.full_name, len(response.data.get('results', [])), total_price
         )
         
+        return self.set_validator_headers(response, totals)
+
+    @action(detail=True, methods=["get"], url_path=r"preview\.png")
+    def preview(self, request, pk=None):
+        """
+        Low-resolution PNG of the shipment's label for the review screen.
+
+        Rendered with the same layout as the printed labels and cached under
+        a digest of the label content and batch format. Address and package
+        edits change the digest even when the shipment row itself is untouched.
+        """
+        shipment = self.get_object()
+        label = next(label_data_from_queryset(Shipment.objects.filter(pk=shipment.pk)))
+
+        digest = hashlib.sha1(
+            f"{shipment.batch.label_format}|{label!r}".encode("utf-8")
+        ).hexdigest()
+        cache_key = f"label-preview:{shipment.id}:{digest}"
+
+        image = cache.get(cache_key)
+        if image is None:
+            image = render_label_png(
+                label,
+                dpi=PREVIEW_DPI,
+                grayscale=True,
+                label_format=shipment.batch.label_format,
+            )
+            cache.set(cache_key, image, LABEL_PREVIEW_CACHE_SECONDS)
+            logger.debug(
+                "Label preview rendered | shipment=%s | size=%d bytes",
+                shipment.id, len(image)
+            )
+
+        response = HttpResponse(image, content_type="image/png")
+        response["Cache-Control"] = "private, max-age=60"
         return response
 
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"track/(?P<tracking_number>[A-Za-z0-9]+)",
+    )
+    def track(self, request, tracking_number=None):
+        """Resolve a scanned tracking barcode back to its shipment."""
+        shipment = get_object_or_404(
+            self.get_queryset().select_related("ship_from", "ship_to", "package"),
+            tracking_number=tracking_number.upper(),
+        )
+
+        logger.debug(
+            "Tracking lookup | tracking=%s | shipment=%s | user=%s",
+            shipment.tracking_number, shipment.id, request.user.full_name
+        )
+
+        return Response(self.get_serializer(shipment).data)
+
     @action(detail=True, methods=["post"], url_path="upsert-address")
     def upsert_address(self, request, pk=None):
         shipment = self.get_object()
@@ -208,10 +554,10 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             if not address or not address.id:
                 if addr_type == "to":
                     shipment.ship_to = new_address
-                    shipment.save(update_fields=["ship_to"])
+                    shipment.save(update_fields=["ship_to", "updated_at"])
                 elif addr_type == "from":
                     shipment.ship_from = new_address
-                    shipment.save(update_fields=["ship_from"])
+                    shipment.save(update_fields=["ship_from", "updated_at"])
 
             logger.info(
                 "Address upsert successful | shipment=%d | address=%d | type=%s",
@@ -250,7 +596,7 @@ class ShipmentViewSet(viewsets.ModelViewSet):
 
             if not package:
                 shipment.package = new_package
-                shipment.save(update_fields=["package"])
+                shipment.save(update_fields=["package", "updated_at"])
 
             logger.info(
                 "Package upsert successful | shipment=%d | package=%d",
@@ -450,11 +796,11 @@ class CSVUploadView(GenericAPIView):
                     # Basic validation & status
                     if not shipment.ship_to:
                         shipment.status = "incomplete"
-                        shipment.save(update_fields=["status"])
+                        shipment.save(update_fields=["status", "updated_at"])
                         logger.warning("Row %d: Shipment created without ship-to → marked incomplete", idx)
                     elif not shipment.package or (shipment.package.weight_lbs + shipment.package.weight_oz == 0):
                         shipment.status = "incomplete"
-                        shipment.save(update_fields=["status"])
+                        shipment.save(update_fields=["status", "updated_at"])
                         logger.warning("Row %d: Shipment created with invalid weight → marked incomplete", idx)
 
                     created += 1
@@ -533,8 +879,9 @@ class BulkUpdateView(GenericAPIView):
 
         updated_count = 0
 
-        # Fields that the pre_save signal will update/refresh
-        SIGNAL_UPDATED_FIELDS = ['price', 'status', 'error_message']
+        # Fields that the pre_save signal will update/refresh, plus updated_at
+        # which the bulk .update() below does not touch
+        SIGNAL_UPDATED_FIELDS = ['price', 'status', 'error_message', 'updated_at']
 
         try:
             # ────────────────────────────────────────────────────────────────
@@ -597,6 +944,13 @@ class BulkUpdateView(GenericAPIView):
                 logger.warning("Unsupported bulk action requested: %s", action)
                 return Response({"error": f"Unknown action: {action}"}, status=400)
 
+            # Queryset .update() sends no signals, so drop cached batch
+            # responses and rendered labels here rather than relying on the
+            # saves below
+            if updated_count > 0:
+                invalidate_batch_responses(batch.id, batch.user_id)
+                invalidate_batch_labels([batch.id])
+
             # ────────────────────────────────────────────────────────────────
             # 2. Re-validate & re-price → trigger pre_save signal
             # ────────────────────────────────────────────────────────────────
@@ -20,37 +20,56 @@ export async function GET(
     const { id } = await params;
 
     // Forward the request to Django backend
-    // Important: we want the raw binary response (PDF)
+    // Important: we want the raw binary response (PDF, ZPL or ZIP)
     const response = await api.get(`/core/batches/${id}/labels/`, {
-      responseType: "arraybuffer", // crucial for binary data (PDF)
+      responseType: "arraybuffer", // crucial for binary data
       headers: {
         // Make sure token is sent if your axios instance doesn't handle it automatically
         Authorization: `Bearer ${session.accessToken}`,
       },
     });
 
-    // Create filename (optional but nice)
-    const filename = `shipping-labels-batch-${id}.pdf`;
+    // Labels are still rendering in the background: pass the 202 and its
+    // Retry-After on so the client polls instead of saving the JSON body
+    if (response.status === 202) {
+      const body = JSON.parse(Buffer.from(response.data).toString("utf-8"));
+      return NextResponse.json(
+        {
+          success: false,
+          pending: true,
+          labels_status: body.labels_status,
+          error: body.detail,
+        },
+        {
+          status: 202,
+          headers: { "Retry-After": response.headers["retry-after"] || "2" },
+        }
+      );
+    }
 
-    // Return the PDF as a downloadable response
-    return new NextResponse(response.data, {
-      status: 200,
-      headers: {
-        "Content-Type": "application/pdf",
-        "Content-Disposition": `attachment; filename="${filename}"`,
-        "Content-Length": response.headers["content-length"] || undefined,
-      },
-    });
+    // The backend names the file and sets its type for the batch format
+    const headers: Record<string, string> = {
+      "Content-Type": response.headers["content-type"] || "application/octet-stream",
+      "Content-Disposition":
+        response.headers["content-disposition"] ||
+        `attachment; filename="shipping-labels-batch-${id}"`,
+    };
+    if (response.headers["content-length"]) {
+      headers["Content-Length"] = response.headers["content-length"];
+    }
+
+    return new NextResponse(response.data, { status: 200, headers });
   } catch (error: any) {
-    console.error("Labels download error:", error?.response?.data || error);
+    console.error("Labels download error:", error);
 
-    if (error?.response?.status === 400 || error?.response?.status === 404) {
+    // lib/axios rejects with { message, status }
+    if (error?.status === 400 || error?.status === 404) {
       return NextResponse.json(
         {
           success: false,
-          error: error?.response?.data?.detail || "Cannot download labels yet",
+          error: error?.message || "Cannot download labels yet",
         },
-        { status: error.response.status }
+        { status: error.status }
       );
     }
 
@@ -59,4 +78,4 @@ export async function GET(
       { status: 500 }
     );
   }
-}
\ No newline at end of file
+}
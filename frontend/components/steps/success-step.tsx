@@ -9,6 +9,14 @@ interface ShipmentRecord {
   id: string;
 }
 
+// Give up polling a batch whose labels are still rendering after this long
+const LABELS_WAIT_MS = 5 * 60 * 1000;
+
+interface LabelsFile {
+  blob: Blob;
+  filename: string;
+}
+
 interface SuccessStepProps {
   batch: string | number;
   data: any;
@@ -26,20 +34,53 @@ export function SuccessStep({
   const [printing, setPrinting] = useState(false);
   const iframeRef = useRef<HTMLIFrameElement | null>(null);
 
-  // Shared fetch logic
-  const fetchLabels = async () => {
-    const response = await fetch(`/api/batches/${batch}/download`, {
-      method: "GET",
-    });
+  // Shared fetch logic: 202 means the labels are still rendering, so wait
+  // as long as Retry-After asks and try again
+  const fetchLabels = async (): Promise<LabelsFile> => {
+    const deadline = Date.now() + LABELS_WAIT_MS;
 
-    if (!response.ok) {
-      const errorData = await response.json().catch(() => ({}));
-      throw new Error(
-        errorData.error || `Failed to fetch labels (${response.status})`
-      );
+    while (true) {
+      const response = await fetch(`/api/batches/${batch}/download`, {
+        method: "GET",
+      });
+
+      if (response.status === 202) {
+        if (Date.now() >= deadline) {
+          throw new Error("Labels are still being prepared, please try again shortly");
+        }
+        const retryAfter = Number(response.headers.get("Retry-After"));
+        const seconds = retryAfter > 0 ? retryAfter : 2;
+        await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+        continue;
+      }
+
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(
+          errorData.error || `Failed to fetch labels (${response.status})`
+        );
+      }
+
+      // PDF, ZPL or a ZIP of PNGs depending on the batch format
+      const disposition = response.headers.get("Content-Disposition") || "";
+      const match = disposition.match(/filename="?([^";]+)"?/i);
+      return {
+        blob: await response.blob(),
+        filename: match?.[1] || `shipping-labels-batch-${batch}`,
+      };
     }
+  };
 
-    return await response.blob();
+  const saveLabels = ({ blob, filename }: LabelsFile) => {
+    const url = window.URL.createObjectURL(blob);
+    const link = document.createElement("a");
+    link.href = url;
+    link.download = filename;
+    document.body.appendChild(link);
+    link.click();
+
+    document.body.removeChild(link);
+    window.URL.revokeObjectURL(url);
   };
 
   const handleDownload = async () => {
@@ -57,17 +98,7 @@ export function SuccessStep({
     );
 
     try {
-      const blob = await fetchLabels();
-
-      const url = window.URL.createObjectURL(blob);
-      const link = document.createElement("a");
-      link.href = url;
-      link.download = `shipping-labels-batch-${batch}.pdf`;
-      document.body.appendChild(link);
-      link.click();
-
-      document.body.removeChild(link);
-      window.URL.revokeObjectURL(url);
+      saveLabels(await fetchLabels());
 
       toast.success(
         `Downloaded ${data?.count} label${
@@ -97,8 +128,16 @@ export function SuccessStep({
     );
 
     try {
-      const blob = await fetchLabels();
-      const url = window.URL.createObjectURL(blob);
+      const labels = await fetchLabels();
+
+      // Browsers can only print PDFs; ZPL and PNG archives go to the printer software
+      if (labels.blob.type !== "application/pdf") {
+        saveLabels(labels);
+        toast.info("These labels can't be printed from the browser, so they were downloaded instead.");
+        return;
+      }
+
+      const url = window.URL.createObjectURL(labels.blob);
 
       // Create or reuse hidden iframe
       if (!iframeRef.current) {